@@ -0,0 +1,168 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+# --- Infraestrutura dos Benchmarks ---
+# Sobe o socket_app num processo separado, com um diretório de trabalho próprio
+# (save.json, cache/ e uma biblioteca sintética), mede a CPU desse processo e
+# resume latências em percentis.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(REPO_DIR, "src")
+FILES_DIR = os.path.join(REPO_DIR, "files")
+SERVER_START_TIMEOUT = 60  # s até o servidor responder
+
+
+def percentiles(values: list[float]) -> dict:
+    """Resumo de uma lista de latências em segundos, em milissegundos."""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def at(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50": at(0.50),
+        "p90": at(0.90),
+        "p99": at(0.99),
+        "max": round(ordered[-1] * 1000, 3),
+    }
+
+
+def make_library(root: str, folders: int, videos_per_folder: int, big_video_mb: int) -> dict:
+    """
+    Cria uma biblioteca sintética: `folders` pastas com `videos_per_folder` vídeos
+    vazios cada, e um vídeo grande (esparso) para as requisições com Range.
+    """
+    os.makedirs(root, exist_ok=True)
+    paths = [""]
+    for i in range(folders):
+        folder = f"Serie {i:04d}"
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+        paths.append(folder)
+        for j in range(videos_per_folder):
+            open(os.path.join(root, folder, f"Episodio {j:03d}.mp4"), "wb").close()
+
+    big_video = "bench_range.mp4"
+    big_size = big_video_mb * 1024 * 1024
+    with open(os.path.join(root, big_video), "wb") as f:
+        f.truncate(big_size)
+    return {"paths": paths, "big_video": big_video, "big_size": big_size,
+            "videos": folders * videos_per_folder + 1}
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def cpu_seconds(pid: int) -> float | None:
+    """CPU (usuário + sistema) já usada pelo processo, via /proc (Linux) ou psutil."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # O nome do processo pode ter espaços: os campos começam depois do ")"
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        times = psutil.Process(pid).cpu_times()
+        return times.user + times.system
+    except Exception:
+        return None
+
+
+def _link_client_files(workdir: str):
+    target = os.path.join(workdir, "files")
+    try:
+        os.symlink(FILES_DIR, target, target_is_directory=True)
+    except (OSError, NotImplementedError):
+        shutil.copytree(FILES_DIR, target)
+
+
+class Server:
+    """O servidor rodando em segundo plano; use com `with`."""
+
+    def __init__(self, library_size: tuple[int, int], big_video_mb: int):
+        self.workdir = tempfile.mkdtemp(prefix="watchparty-bench-")
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.library = make_library(os.path.join(self.workdir, "videos"), *library_size, big_video_mb)
+        self.process = None
+
+    def __enter__(self):
+        _link_client_files(self.workdir)
+        with open(os.path.join(self.workdir, "save.json"), "w") as f:
+            json.dump({"port": self.port, "video_dir": "videos", "use_cloudflare": False}, f)
+
+        env = {**os.environ, "PYTHONPATH": SRC_DIR + os.pathsep + os.environ.get("PYTHONPATH", "")}
+        code = ("import uvicorn, main\n"
+                f"uvicorn.run(main.socket_app, host='127.0.0.1', port={self.port}, log_level='error')")
+        self.log = open(os.path.join(self.workdir, "server.log"), "wb")
+        self.process = subprocess.Popen([sys.executable, "-c", code], cwd=self.workdir, env=env,
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+        self._wait_ready()
+        return self
+
+    def _wait_ready(self):
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"O servidor terminou ao iniciar (veja {self.log.name}).")
+            try:
+                with urllib.request.urlopen(f"{self.url}/metrics", timeout=2) as resp:
+                    if resp.status == 200:
+                        return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError(f"O servidor não respondeu em {SERVER_START_TIMEOUT}s (veja {self.log.name}).")
+
+    def cpu_seconds(self) -> float | None:
+        return cpu_seconds(self.process.pid)
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class CpuMeter:
+    """CPU do servidor durante um trecho do benchmark, em % de um núcleo."""
+
+    def __init__(self, server: Server):
+        self.server = server
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.cpu_start = self.server.cpu_seconds()
+        self.result = {}
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        cpu_end = self.server.cpu_seconds()
+        if self.cpu_start is None or cpu_end is None:
+            self.result.update({"seconds": round(elapsed, 3), "server_cpu_seconds": None, "server_cpu_percent": None})
+            return
+        used = cpu_end - self.cpu_start
+        self.result.update({
+            "seconds": round(elapsed, 3),
+            "server_cpu_seconds": round(used, 3),
+            "server_cpu_percent": round(used / elapsed * 100, 1) if elapsed else None,
+        })
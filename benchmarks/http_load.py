@@ -0,0 +1,89 @@
+import asyncio
+import random
+import time
+from urllib.parse import quote
+
+import aiohttp
+
+from harness import percentiles
+
+# --- Carga HTTP ---
+# Requisições com Range concorrentes em /video (como players buscando trechos) e
+# listagens de /api/get_videos na biblioteca sintética. Cada worker faz uma
+# requisição por vez até o fim do tempo.
+
+RANGE_CHUNK = 1024 * 1024  # bytes por requisição, próximo do que um player pede
+
+
+async def _run_workers(concurrency: int, duration: float, request) -> float:
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            await request()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started
+
+
+async def video_ranges(url: str, video: str, size: int, concurrency: int, duration: float) -> dict:
+    """Trechos de RANGE_CHUNK bytes em posições aleatórias do vídeo."""
+    latencies, statuses = [], {}
+    received = 0
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def request():
+            nonlocal received
+            start = random.randrange(0, max(1, size - RANGE_CHUNK))
+            headers = {"Range": f"bytes={start}-{start + RANGE_CHUNK - 1}"}
+            began = time.perf_counter()
+            try:
+                async with session.get(f"{url}/video/{quote(video)}", headers=headers) as resp:
+                    body = await resp.read()
+                    statuses[resp.status] = statuses.get(resp.status, 0) + 1
+            except aiohttp.ClientError:
+                statuses["error"] = statuses.get("error", 0) + 1
+                return
+            latencies.append(time.perf_counter() - began)
+            received += len(body)
+
+        elapsed = await _run_workers(concurrency, duration, request)
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "megabytes_per_second": round(received / elapsed / (1024 * 1024), 1),
+        "latency_ms": percentiles(latencies),
+        "statuses": {str(status): count for status, count in statuses.items()},
+    }
+
+
+async def get_videos(url: str, paths: list[str], concurrency: int, duration: float) -> dict:
+    """Listagens de pastas aleatórias da biblioteca (e da raiz)."""
+    latencies, statuses = [], {}
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def request():
+            path = random.choice(paths)
+            began = time.perf_counter()
+            try:
+                async with session.get(f"{url}/api/get_videos", params={"path": path}) as resp:
+                    await resp.read()
+                    statuses[resp.status] = statuses.get(resp.status, 0) + 1
+            except aiohttp.ClientError:
+                statuses["error"] = statuses.get("error", 0) + 1
+                return
+            latencies.append(time.perf_counter() - began)
+
+        elapsed = await _run_workers(concurrency, duration, request)
+
+    return {
+        "concurrency": concurrency,
+        "folders": len(paths) - 1,
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "latency_ms": percentiles(latencies),
+        "statuses": {str(status): count for status, count in statuses.items()},
+    }
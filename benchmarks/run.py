@@ -0,0 +1,142 @@
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import http_load
+import socket_load
+from harness import REPO_DIR, CpuMeter, Server
+
+# --- Benchmarks do Watch Party ---
+# Sobe o servidor com uma biblioteca sintética, roda as cargas de Socket.IO e HTTP
+# e grava um JSON com os resultados e o commit testado. Dois resultados podem ser
+# comparados com --compare:
+#
+#   python benchmarks/run.py -o antes.json
+#   python benchmarks/run.py -o depois.json
+#   python benchmarks/run.py --compare antes.json depois.json
+
+
+def _git_revision() -> dict:
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=REPO_DIR, capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(status) if status is not None else None}
+
+
+async def _run(args, server: Server) -> dict:
+    results = {}
+    if "socket" in args.only:
+        print(f"Socket.IO: {args.clients} clientes em {args.rooms} salas por {args.duration}s...")
+        with CpuMeter(server) as cpu:
+            results["socket"] = await socket_load.run(server.url, args.clients, args.rooms, args.duration)
+        results["socket"]["cpu"] = cpu.result
+
+    if "video" in args.only:
+        print(f"/video: {args.http_concurrency} requisições com Range simultâneas por {args.duration}s...")
+        with CpuMeter(server) as cpu:
+            results["video"] = await http_load.video_ranges(
+                server.url, server.library["big_video"], server.library["big_size"],
+                args.http_concurrency, args.duration)
+        results["video"]["cpu"] = cpu.result
+
+    if "videos_api" in args.only:
+        print(f"/api/get_videos: {args.http_concurrency} requisições simultâneas por {args.duration}s...")
+        with CpuMeter(server) as cpu:
+            results["videos_api"] = await http_load.get_videos(
+                server.url, server.library["paths"], args.http_concurrency, args.duration)
+        results["videos_api"]["cpu"] = cpu.result
+    return results
+
+
+def run_benchmarks(args) -> dict:
+    print(f"Criando biblioteca sintética ({args.folders} pastas x {args.videos_per_folder} vídeos)...")
+    with Server((args.folders, args.videos_per_folder), args.big_video_mb) as server:
+        results = asyncio.run(_run(args, server))
+    return {
+        "meta": {
+            **_git_revision(),
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        },
+        "results": results,
+    }
+
+
+# --- Comparação ---
+
+def _flatten(data, prefix="") -> dict:
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(base_path: str, new_path: str):
+    """Tabela com cada métrica numérica dos dois resultados e a variação percentual."""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    base_flat, new_flat = _flatten(base["results"]), _flatten(new["results"])
+
+    print(f"base: {base['meta'].get('commit')}  novo: {new['meta'].get('commit')}")
+    width = max((len(name) for name in base_flat | new_flat), default=10)
+    for name in sorted(base_flat | new_flat):
+        old, current = base_flat.get(name), new_flat.get(name)
+        if old is None or current is None:
+            change = "-"
+        elif old == 0:
+            change = "=" if current == 0 else "novo"
+        else:
+            change = f"{(current - old) / abs(old) * 100:+.1f}%"
+        print(f"{name:<{width}}  {old if old is not None else '-':>12}  {current if current is not None else '-':>12}  {change:>8}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de sincronização, chat e streaming do Watch Party.")
+    parser.add_argument('-o', '--output', default=None, help="Arquivo JSON para os resultados (padrão: stdout)")
+    parser.add_argument('--compare', nargs=2, metavar=("BASE", "NOVO"),
+                        help="Compara dois arquivos de resultados em vez de rodar os benchmarks")
+    parser.add_argument('--only', nargs='+', choices=("socket", "video", "videos_api"),
+                        default=["socket", "video", "videos_api"], help="Cargas a rodar (padrão: todas)")
+    parser.add_argument('--clients', type=int, default=200, help="Clientes Socket.IO simulados (padrão: 200)")
+    parser.add_argument('--rooms', type=int, default=10, help="Salas entre as quais os clientes se dividem (padrão: 10)")
+    parser.add_argument('--duration', type=float, default=20.0, help="Segundos de cada carga (padrão: 20)")
+    parser.add_argument('--http-concurrency', type=int, default=32,
+                        help="Requisições HTTP simultâneas (padrão: 32)")
+    parser.add_argument('--folders', type=int, default=200, help="Pastas da biblioteca sintética (padrão: 200)")
+    parser.add_argument('--videos-per-folder', type=int, default=25, help="Vídeos por pasta (padrão: 25)")
+    parser.add_argument('--big-video-mb', type=int, default=256,
+                        help="Tamanho do vídeo usado nas requisições com Range (padrão: 256)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    report = run_benchmarks(args)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Resultados gravados em {args.output}")
+    else:
+        print(output)
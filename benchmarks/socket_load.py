@@ -0,0 +1,175 @@
+import asyncio
+import random
+import time
+
+import socketio
+
+from harness import percentiles
+
+# --- Carga no Socket.IO ---
+# Centenas de clientes python-socketio divididos em salas. Em cada sala o host
+# manda host_sync ("pause" no instante = número de sequência, assim o sync_event
+# que chega aos outros diz qual envio ele reflete), os demais pedem request_sync e
+# todos mandam mensagens no chat. Como clientes e medições estão no mesmo
+# processo, as latências usam o mesmo relógio de ponta a ponta.
+
+CONNECT_CONCURRENCY = 50
+# Um pouco acima da janela de agrupamento do host_sync (0.15 s), para medir a propagação
+# de cada envio e não a espera pelo fim da janela
+SYNC_INTERVAL = 0.25
+REQUEST_SYNC_INTERVAL = 2.0
+# O servidor aceita 1 mensagem/s por sid (rajada de 5)
+CHAT_INTERVAL = 1.5
+BENCH_VIDEO = "http://bench.invalid/video.mp4"  # URL externa: não gera prévias nem HLS
+
+
+class _Room:
+    def __init__(self, room_id: str):
+        self.room_id = room_id
+        self.seq = 0
+        self.sent_at = {}  # seq -> instante do host_sync
+
+
+class _Client:
+    def __init__(self, index: int, room: _Room, results: dict):
+        self.index = index
+        self.room = room
+        self.results = results
+        self.is_host = False
+        self.sync_requested_at = None
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.sio.on("sync_event", self._on_sync_event)
+        self.sio.on("force_sync", self._on_force_sync)
+        self.sio.on("new_message", self._on_message)
+        self.sio.on("set_host", self._on_set_host)
+        self.sio.on("get_host_time", self._on_get_host_time)
+
+    async def _on_set_host(self, *_):
+        self.is_host = True
+
+    async def _on_get_host_time(self, *_):
+        return {"time": float(self.room.seq), "paused": True, "rate": 1.0}
+
+    async def _on_sync_event(self, data):
+        if data.get("type") != "state":
+            return
+        sent_at = self.room.sent_at.get(int(round(data["time"])))
+        if sent_at is not None:
+            self.results["sync_propagation"].append(time.perf_counter() - sent_at)
+        else:
+            self.results["sync_unmatched"] += 1
+
+    async def _on_force_sync(self, _):
+        if self.sync_requested_at is not None:
+            self.results["request_sync_rtt"].append(time.perf_counter() - self.sync_requested_at)
+            self.sync_requested_at = None
+
+    async def _on_message(self, message):
+        if message.get("sender") == "System":
+            if "rápido demais" in message.get("text", ""):
+                self.results["chat_rate_limited"] += 1
+            return
+        sent_at = self.results["chat_sent_at"].get(message.get("text"))
+        if sent_at is not None:
+            self.results["chat_delivery"].append(time.perf_counter() - sent_at)
+
+    async def connect(self, url: str):
+        started = time.perf_counter()
+        await self.sio.connect(url, transports=["websocket"])
+        self.results["connect"].append(time.perf_counter() - started)
+
+    async def join(self):
+        await self.sio.emit("join_room", {"name": f"bench-{self.index}", "pfp": "", "room": self.room.room_id})
+
+    async def set_video(self):
+        await self.sio.emit("host_set_video", {"room": self.room.room_id, "video": BENCH_VIDEO})
+
+    async def host_loop(self, deadline: float):
+        await asyncio.sleep(random.uniform(0, SYNC_INTERVAL))
+        while time.perf_counter() < deadline:
+            self.room.seq += 1
+            self.room.sent_at[self.room.seq] = time.perf_counter()
+            await self.sio.emit("host_sync", {"type": "pause", "time": float(self.room.seq)})
+            self.results["host_syncs"] += 1
+            await asyncio.sleep(SYNC_INTERVAL)
+
+    async def viewer_loop(self, deadline: float):
+        await asyncio.sleep(random.uniform(0, REQUEST_SYNC_INTERVAL))
+        while time.perf_counter() < deadline:
+            if self.sync_requested_at is not None:
+                self.results["request_sync_lost"] += 1
+            self.sync_requested_at = time.perf_counter()
+            await self.sio.emit("request_sync")
+            await asyncio.sleep(REQUEST_SYNC_INTERVAL)
+
+    async def chat_loop(self, deadline: float):
+        await asyncio.sleep(random.uniform(0, CHAT_INTERVAL))
+        seq = 0
+        while time.perf_counter() < deadline:
+            seq += 1
+            text = f"bench {self.index}:{seq}"
+            self.results["chat_sent_at"][text] = time.perf_counter()
+            await self.sio.emit("send_message", text)
+            self.results["chat_sent"] += 1
+            await asyncio.sleep(CHAT_INTERVAL)
+
+
+async def run(url: str, clients: int, rooms: int, duration: float) -> dict:
+    """Conecta `clients` clientes em `rooms` salas e gera carga por `duration` s."""
+    results = {"connect": [], "sync_propagation": [], "request_sync_rtt": [], "chat_delivery": [],
+               "chat_sent_at": {}, "sync_unmatched": 0, "request_sync_lost": 0, "chat_rate_limited": 0,
+               "host_syncs": 0, "chat_sent": 0, "connect_errors": 0}
+    room_list = [_Room(f"bench-{i}") for i in range(rooms)]
+    members = [_Client(i, room_list[i % rooms], results) for i in range(clients)]
+
+    slots = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    async def connect(client):
+        async with slots:
+            try:
+                await client.connect(url)
+                return client
+            except Exception:
+                results["connect_errors"] += 1
+                return None
+
+    connected = [c for c in await asyncio.gather(*(connect(c) for c in members)) if c is not None]
+
+    # O primeiro de cada sala entra antes, para ser o host
+    first = {}
+    for client in connected:
+        first.setdefault(client.room.room_id, client)
+    await asyncio.gather(*(client.join() for client in first.values()))
+    await asyncio.sleep(0.5)
+    await asyncio.gather(*(client.join() for client in connected if client not in first.values()))
+    await asyncio.sleep(1.0)
+    # request_sync só é respondido com um vídeo na sala
+    await asyncio.gather(*(client.set_video() for client in connected if client.is_host))
+    await asyncio.sleep(0.5)
+
+    deadline = time.perf_counter() + duration
+    loops = []
+    for client in connected:
+        loops.append(client.chat_loop(deadline))
+        loops.append(client.host_loop(deadline) if client.is_host else client.viewer_loop(deadline))
+    await asyncio.gather(*loops)
+    # Últimas entregas em trânsito
+    await asyncio.sleep(1.0)
+
+    await asyncio.gather(*(client.sio.disconnect() for client in connected), return_exceptions=True)
+
+    return {
+        "clients": clients,
+        "connected": len(connected),
+        "rooms": rooms,
+        "connect_errors": results["connect_errors"],
+        "connect_ms": percentiles(results["connect"]),
+        "host_syncs": results["host_syncs"],
+        "sync_propagation_ms": percentiles(results["sync_propagation"]),
+        "sync_unmatched": results["sync_unmatched"],
+        "request_sync_rtt_ms": percentiles(results["request_sync_rtt"]),
+        "request_sync_lost": results["request_sync_lost"],
+        "chat_sent": results["chat_sent"],
+        "chat_delivery_ms": percentiles(results["chat_delivery"]),
+        "chat_rate_limited": results["chat_rate_limited"],
+    }
@@ -1,4 +1,11 @@
+import { onPresenceChange } from '../modules/presence.js';
+
 export async function initializeChat(socket, currentUserName, showNotification, getIsHost) {
+    // O histórico chega logo após o join_room, possivelmente antes do HTML do chat
+    let pendingHistory = null;
+    let renderHistory = (history) => { pendingHistory = history; };
+    socket.on('chat_history', (history) => renderHistory(history));
+
     // 1. Carrega o HTML do chat no container
     const chatContainer = document.getElementById('chat-container');
     if (!chatContainer) {
@@ -37,8 +44,8 @@ export async function initializeChat(socket, currentUserName, showNotification,
      }
     }
 
-    function addChatMessage(data) {
-     // data = { sender, pfp, text }
+    function createChatMessage(data) {
+     // data = { id, sender, pfp, text }
      const msg = document.createElement('p');
      msg.classList.add('chat-msg');
 
@@ -48,10 +55,51 @@ export async function initializeChat(socket, currentUserName, showNotification,
      }
 
      msg.innerHTML = `${pfpImg}<strong>${data.sender}:</strong> ${data.text}`;
-     chatBox.appendChild(msg);
+     return msg;
+    }
+
+    function addChatMessage(data) {
+     if (data.id !== undefined && oldestMessageId === null) oldestMessageId = data.id;
+     chatBox.appendChild(createChatMessage(data));
      chatBox.scrollTop = chatBox.scrollHeight;
     }
 
+    // --- Histórico ---
+    // O servidor manda as últimas mensagens ao entrar; as anteriores são pedidas
+    // página a página pelo botão no topo do chat.
+    let oldestMessageId = null;
+    const loadMoreBtn = document.createElement('button');
+    loadMoreBtn.className = 'chat-load-more';
+    loadMoreBtn.textContent = 'Carregar mensagens anteriores';
+
+    function prependHistory(messages, hasMore) {
+     const previousHeight = chatBox.scrollHeight;
+     const fragment = document.createDocumentFragment();
+     messages.forEach(message => fragment.appendChild(createChatMessage(message)));
+     loadMoreBtn.after(fragment);
+     if (messages.length) oldestMessageId = messages[0].id;
+     loadMoreBtn.style.display = hasMore ? 'block' : 'none';
+     // Mantém a mensagem que estava visível no mesmo lugar
+     chatBox.scrollTop += chatBox.scrollHeight - previousHeight;
+    }
+
+    loadMoreBtn.onclick = () => {
+     loadMoreBtn.disabled = true;
+     socket.emit('request_chat_history', { before: oldestMessageId }, ({ messages, has_more }) => {
+         loadMoreBtn.disabled = false;
+         prependHistory(messages, has_more);
+     });
+    };
+
+    renderHistory = ({ messages, has_more }) => {
+     // Cada (re)entrada na sala substitui o chat pelo histórico do servidor
+     chatBox.replaceChildren(loadMoreBtn);
+     oldestMessageId = null;
+     prependHistory(messages, has_more);
+     chatBox.scrollTop = chatBox.scrollHeight;
+    };
+    if (pendingHistory) renderHistory(pendingHistory);
+
     // --- Upload de Imagem ---
     async function handleImageUpload(file) {
      const formData = new FormData();
@@ -226,50 +274,77 @@ export async function initializeChat(socket, currentUserName, showNotification,
         }
     });
 
-    // --- Listeners de Eventos do Socket.IO ---
-    socket.on('update_users', (users) => {
-     userList.innerHTML = '';
-     for (const sid in users) {
-         const user = users[sid];
-         const li = document.createElement('div');
-         li.classList.add('user-item');
-         if (user.isHost) {
-             li.classList.add('chat-host');
-         }
+    // --- Lista de Usuários ---
+    function createUserItem(sid, user) {
+        const li = document.createElement('div');
+        li.classList.add('user-item');
+        if (user.isHost) {
+            li.classList.add('chat-host');
+        }
 
-         // Restaura classes WebRTC se a conexão já existe
-         const existingAudio = document.getElementById(`peer-audio-${sid}`);
-         if (existingAudio) {
-             li.classList.add('peer-connected');
-             if (existingAudio.muted) li.classList.add('peer-muted');
-         }
+        // Restaura classes WebRTC se a conexão já existe
+        const existingAudio = document.getElementById(`peer-audio-${sid}`);
+        if (existingAudio) {
+            li.classList.add('peer-connected');
+            if (existingAudio.muted) li.classList.add('peer-muted');
+        }
 
-         const pfpImg = user.pfp ? `<img src="${user.pfp}" alt="pfp" class="user-pfp">` : '';
-         li.innerHTML = `${pfpImg} <span class="user-name">${user.name}</span>`;
-         li.dataset.sid = sid; // Adiciona SID para manipulação externa (WebRTC UI)
-         
-         if (sid !== socket.id) {
-             const muteBtn = document.createElement('button');
-             muteBtn.className = 'peer-mute-btn';
-             if (existingAudio && existingAudio.muted) muteBtn.classList.add('muted');
-             muteBtn.title = "Mutar Áudio";
-             muteBtn.innerHTML = `
-                 <svg class="mic-on" xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24" fill="currentColor"><path d="M12 14c1.66 0 3-1.34 3-3V5c0-1.66-1.34-3-3-3S9 3.34 9 5v6c0 1.66 1.34 3 3 3z"></path><path d="M17 11c0 2.76-2.24 5-5 5s-5-2.24-5-5H5c0 3.53 2.8 6.47 6 6.92V21h2v-3.08c3.2-.45 6-3.39 6-6.92h-2z"></path></svg>
-                 <svg class="mic-off" xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24" fill="currentColor"><path d="M19 11h-1.7c0 .74-.16 1.43-.43 2.05l1.23 1.23c.56-.98.9-2.09.9-3.28zm-4.02.17c0-.06.02-.11.02-.17V5c0-1.66-1.34-3-3-3S9 3.34 9 5v.18l5.98 5.99zM4.27 3L3 4.27l6.01 6.01V11c0 1.66 1.34 3 3 3 .23 0 .44-.03.65-.08l1.66 1.66c-.71.33-1.5.52-2.31.52-2.76 0-5-2.24-5-5H5c0 3.53 2.8 6.47 6 6.92V21h2v-3.08c.91-.13 1.77-.45 2.54-.9L19.73 21 21 19.73 4.27 3z"></path></svg>
-             `;
-             muteBtn.onclick = (e) => {
-                 e.stopPropagation();
-                 document.dispatchEvent(new CustomEvent('togglePeerMute', { detail: { sid: sid } }));
-             };
-             li.appendChild(muteBtn);
-         }
+        const pfpImg = user.pfp ? `<img src="${user.pfp}" alt="pfp" class="user-pfp">` : '';
+        li.innerHTML = `${pfpImg} <span class="user-name">${user.name}</span>`;
+        li.dataset.sid = sid; // Adiciona SID para manipulação externa (WebRTC UI)
+        
+        if (sid !== socket.id) {
+            const muteBtn = document.createElement('button');
+            muteBtn.className = 'peer-mute-btn';
+            if (existingAudio && existingAudio.muted) muteBtn.classList.add('muted');
+            muteBtn.title = "Mutar Áudio";
+            muteBtn.innerHTML = `
+                <svg class="mic-on" xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24" fill="currentColor"><path d="M12 14c1.66 0 3-1.34 3-3V5c0-1.66-1.34-3-3-3S9 3.34 9 5v6c0 1.66 1.34 3 3 3z"></path><path d="M17 11c0 2.76-2.24 5-5 5s-5-2.24-5-5H5c0 3.53 2.8 6.47 6 6.92V21h2v-3.08c3.2-.45 6-3.39 6-6.92h-2z"></path></svg>
+                <svg class="mic-off" xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24" fill="currentColor"><path d="M19 11h-1.7c0 .74-.16 1.43-.43 2.05l1.23 1.23c.56-.98.9-2.09.9-3.28zm-4.02.17c0-.06.02-.11.02-.17V5c0-1.66-1.34-3-3-3S9 3.34 9 5v.18l5.98 5.99zM4.27 3L3 4.27l6.01 6.01V11c0 1.66 1.34 3 3 3 .23 0 .44-.03.65-.08l1.66 1.66c-.71.33-1.5.52-2.31.52-2.76 0-5-2.24-5-5H5c0 3.53 2.8 6.47 6 6.92V21h2v-3.08c.91-.13 1.77-.45 2.54-.9L19.73 21 21 19.73 4.27 3z"></path></svg>
+            `;
+            muteBtn.onclick = (e) => {
+                e.stopPropagation();
+                document.dispatchEvent(new CustomEvent('togglePeerMute', { detail: { sid: sid } }));
+            };
+            li.appendChild(muteBtn);
+        }
 
-         li.addEventListener('click', (e) => {
-             showUserContextMenu(e, sid, user);
-         });
-         
-         userList.appendChild(li);
-     }
+        li.addEventListener('click', (e) => {
+            showUserContextMenu(e, sid, user);
+        });
+
+        return li;
+    }
+
+    function renderUserList(users) {
+        userList.innerHTML = '';
+        for (const sid in users) {
+            userList.appendChild(createUserItem(sid, users[sid]));
+        }
+    }
+
+    function findUserItem(sid) {
+        return userList.querySelector(`.user-item[data-sid="${sid}"]`);
+    }
+
+    // --- Listeners de Eventos do Socket.IO ---
+    // Snapshot redesenha a lista; deltas mexem só nos itens afetados
+    onPresenceChange((users, changes) => {
+        if (!changes) {
+            renderUserList(users);
+            return;
+        }
+        for (const change of changes) {
+            if (change.op === 'join') {
+                findUserItem(change.sid)?.remove();
+                userList.appendChild(createUserItem(change.sid, change.user));
+            } else if (change.op === 'leave') {
+                findUserItem(change.sid)?.remove();
+            } else if (change.op === 'host') {
+                findUserItem(change.previous)?.classList.remove('chat-host');
+                findUserItem(change.sid)?.classList.add('chat-host');
+            }
+        }
     });
 
     socket.on('new_message', (data) => {
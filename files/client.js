@@ -3,11 +3,13 @@ import { showNotification } from './modules/notifications.js';
 import { setSocketIdGetter, closePeerConnection, handleAudioSignal } from './modules/webrtc.js';
 import { screenSharePeerConnections, closeScreenShareConnection, createScreenShareConnection,
          stopScreenShare, getScreenStream, handleScreenSignal } from './modules/screen-share.js';
-import { syncState, setupDubListeners, handleSyncState, handleSyncEvent, handleForceSync } from './modules/video-sync.js';
+import { syncState, setupDubListeners, handleSyncState, handleSyncEvent, handleForceSync, handleSeekPreviewsReady } from './modules/video-sync.js';
 import { updateStatusIndicator, setupHostUI } from './modules/host-ui.js';
+import { initPresence, onPresenceChange } from './modules/presence.js';
 
 // --- DOM & State ---
-const socket = io();
+// Só websocket: com vários workers o long-polling exigiria sessões fixas (sticky)
+const socket = io({ transports: ['websocket'] });
 const player = new Plyr('#player', { tooltips: { controls: true, seek: true } });
 const dubPlayer = document.getElementById('dub-player');
 const statusIndicator = document.getElementById('status-indicator');
@@ -20,13 +22,20 @@ const screenShareBtn = document.getElementById('screen-share-btn');
 const closeHostPanelBtn = document.getElementById('close-host-panel-btn');
 
 const isHostRef = { value: false };
-let clientState = { users: {} };
 
+const roomId = new URLSearchParams(window.location.search).get('room') || 'default';
 const userName = sessionStorage.getItem('userName');
 const userPfp = sessionStorage.getItem('userPfp');
-if (!userName) window.location.href = '/';
+if (!userName) window.location.href = `/${window.location.search}`;
 
-socket.emit('join_room', { name: userName, pfp: userPfp });
+initPresence(socket);
+// A cada conexão (inclusive reconexões após queda ou restart do servidor) entra de novo na sala
+socket.on('connect', () => {
+    socket.emit('join_room', { name: userName, pfp: userPfp, room: roomId });
+});
+
+// O painel do host controla a mesma sala
+document.getElementById('host-panel-button').href = `/host?room=${encodeURIComponent(roomId)}`;
 
 // Give webrtc.js access to the socket id for speech monitoring
 setSocketIdGetter(() => socket.id);
@@ -57,23 +66,18 @@ socket.on('remove_host', () => {
     statusIndicator.title = '';
 });
 
-socket.on('update_users', (users) => {
-    const previousUsers = clientState.users;
-    const previousHostSid = Object.keys(previousUsers).find(sid => previousUsers[sid].isHost);
+onPresenceChange((users, changes) => {
+    if (!changes) return;  // snapshot: nada de notificações para quem já estava na sala
 
-    for (const sid in users) {
-        if (!previousUsers[sid] && sid !== socket.id) {
-            showNotification(`<strong>${users[sid].name}</strong> entrou na sala.`, 'success');
+    for (const change of changes) {
+        if (change.op === 'join' && change.sid !== socket.id) {
+            showNotification(`<strong>${change.user.name}</strong> entrou na sala.`, 'success');
+        }
+        if (change.op === 'host' && change.sid !== socket.id && users[change.sid]) {
+            showNotification(`<strong>${users[change.sid].name}</strong> agora é o host.`, 'warning');
+            if (isHostRef.value) updateStatusIndicator(statusIndicator, false);
         }
     }
-
-    const newHostSid = Object.keys(users).find(sid => users[sid].isHost);
-    if (newHostSid && newHostSid !== previousHostSid && newHostSid !== socket.id) {
-        showNotification(`<strong>${users[newHostSid].name}</strong> agora é o host.`, 'warning');
-        if (isHostRef.value && newHostSid !== socket.id) updateStatusIndicator(statusIndicator, false);
-    }
-
-    clientState.users = users;
 });
 
 // --- Socket: Video Sync ---
@@ -89,8 +93,12 @@ socket.on('force_sync', (data) => {
     handleForceSync(data, player, isHostRef, statusIndicator);
 });
 
+socket.on('seek_previews_ready', (data) => {
+    handleSeekPreviewsReady(data, player);
+});
+
 socket.on('get_host_time', (callback) => {
-    if (isHostRef.value) callback({ time: player.currentTime, paused: player.paused });
+    if (isHostRef.value) callback({ time: player.currentTime, paused: player.paused, rate: player.speed });
 });
 
 // --- Socket: WebRTC & Screen Share ---
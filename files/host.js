@@ -1,4 +1,4 @@
-const socket = io();
+const socket = io({ transports: ['websocket'] });
 
 // --- Elementos do DOM ---
 const inviteLinkField = document.getElementById('invite-link-field');
@@ -9,19 +9,34 @@ const videoGrid = document.getElementById('video-grid');
 const videoUrlField = document.getElementById('video-url-field');
 const setUrlBtn = document.getElementById('set-url-btn');
 const breadcrumbsContainer = document.getElementById('breadcrumbs-container');
+const librarySearchField = document.getElementById('library-search-field');
+const sortSelect = document.getElementById('sort-select');
+const loadMoreBtn = document.getElementById('load-more-btn');
 const statusMessage = document.getElementById('status-message');
 
 // --- Estado ---
+const roomId = new URLSearchParams(window.location.search).get('room') || 'default';
 let currentPath = '';
 let statusTimeout;
+let searchTimeout;
+let listingId = 0; // descarta páginas de uma navegação anterior
+let nextCursor = null;
 
-function max(a, b) {
-    if (a > b) return a;
-    return b;
+const PAGE_SIZE = 200;
+
+function showStatus(message, type = 'success') {
+    if (!statusMessage) {
+        console[type === 'error' ? 'error' : 'log'](message);
+        return;
+    }
+    statusMessage.textContent = message;
+    statusMessage.dataset.type = type;
+    clearTimeout(statusTimeout);
+    statusTimeout = setTimeout(() => { statusMessage.textContent = ''; }, 4000);
 }
 
 // 1. Buscar o IP/Link do servidor
-fetch('/api/get_ip')
+fetch(`/api/get_ip?room=${encodeURIComponent(roomId)}`)
     .then(res => res.json())
     .then(data => {
         inviteLinkField.value = data.link;
@@ -45,77 +60,166 @@ copyLinkBtn.onclick = () => {
 setUrlBtn.onclick = () => {
     const url = videoUrlField.value.trim();
     if (url) {
-        socket.emit('host_set_video', url);
+        socket.emit('host_set_video', { room: roomId, video: url });
         showStatus(`Vídeo da URL definido!`, 'success');
         videoUrlField.value = '';
     }
 };
 
-// 4. Atualizar Banners
-updateBannersBtn.onclick = () => {
+// 4. Atualizar Banners (job em segundo plano)
+let bannerJobId = null;
+
+function setBannerButtonRunning(running, text) {
     const btnText = document.getElementById('update-banners-btn-text');
     const updateIcon = document.getElementById('update-icon');
     const spinnerIcon = document.getElementById('update-spinner');
 
-    btnText.textContent = 'Atualizando...';
-    updateBannersBtn.disabled = true;
-    updateIcon.classList.add('hidden');
-    spinnerIcon.classList.remove('hidden');
+    btnText.textContent = text;
+    updateIcon.classList.toggle('hidden', running);
+    spinnerIcon.classList.toggle('hidden', !running);
+}
 
-    fetch('/api/update_banners', { method: 'POST' })
+function pollBannerJob() {
+    fetch(`/api/update_banners/${bannerJobId}`)
         .then(res => res.json())
-        .then(data => {
-            showStatus(data.message || 'Banners atualizados.', 'success');
+        .then(job => {
+            if (job.status === 'running') {
+                const progress = job.total === null ? '' : ` ${job.done}/${job.total}`;
+                setBannerButtonRunning(true, `Atualizando...${progress} (cancelar)`);
+                setTimeout(pollBannerJob, 1000);
+                return;
+            }
+
+            bannerJobId = null;
+            setBannerButtonRunning(false, 'Atualizar Banners');
+            if (job.status === 'done') {
+                // "updated" traz só os nomes mais recentes; o total vem em updated_count
+                const others = (job.updated_count || 0) - job.updated.length;
+                showStatus(`Banners atualizados para: ${job.updated.join(', ')}${others > 0 ? ` e mais ${others}` : ''}`, 'success');
+            } else if (job.status === 'cancelled') {
+                showStatus('Atualização de banners cancelada.', 'error');
+            } else {
+                showStatus('Erro ao atualizar banners.', 'error');
+            }
             navigate(currentPath); // Recarrega a visualização atual
         })
-        .catch(() => showStatus('Erro ao atualizar banners.', 'error'))
-        .finally(() => {
-            btnText.textContent = 'Atualizar Banners';
-            updateBannersBtn.disabled = false;
-            updateIcon.classList.remove('hidden');
-            spinnerIcon.classList.add('hidden');
+        .catch(() => { if (bannerJobId) setTimeout(pollBannerJob, 3000); });
+}
+
+updateBannersBtn.onclick = () => {
+    // Um segundo clique enquanto o job roda cancela a atualização
+    if (bannerJobId) {
+        fetch(`/api/update_banners/${bannerJobId}`, { method: 'DELETE' });
+        return;
+    }
+
+    setBannerButtonRunning(true, 'Atualizando...');
+    fetch('/api/update_banners', { method: 'POST' })
+        .then(res => res.json())
+        .then(job => {
+            bannerJobId = job.job_id;
+            pollBannerJob();
+        })
+        .catch(() => {
+            showStatus('Erro ao atualizar banners.', 'error');
+            setBannerButtonRunning(false, 'Atualizar Banners');
         });
 };
 
 // 5. Navegação de arquivos
 function navigate(path = '') {
     currentPath = path;
-    fetch(`/api/get_videos?path=${encodeURIComponent(path)}`)
-        .then(res => res.json())
-        .then(data => {
-            renderBreadcrumb(path);
-            folderGrid.innerHTML = '';
-            videoGrid.innerHTML = '';
-
-            const folders = data.items.filter(item => item.type === 'folder');
-            const videos = data.items.filter(item => item.type === 'video');
-
-            if (folders.length > 0) {
-                folders.forEach(item => {
-                    const itemEl = createItemElement(item);
-                    folderGrid.appendChild(itemEl);
-                });
-            } else {
-                folderGrid.innerHTML = '<p class="col-span-full text-center text-gray-500">Nenhuma pasta encontrada.</p>';
-            }
+    librarySearchField.value = '';
+    renderBreadcrumb(path);
+    folderGrid.innerHTML = '';
+    videoGrid.innerHTML = '';
+    loadPage(++listingId, null);
+}
+
+// Busca uma página da pasta em NDJSON e desenha cada item assim que ele chega
+async function loadPage(id, cursor) {
+    const [sort, order] = sortSelect.value.split(':');
+    const params = new URLSearchParams({ path: currentPath, sort, order, limit: PAGE_SIZE, format: 'ndjson' });
+    if (cursor) params.set('cursor', cursor);
+    loadMoreBtn.classList.add('hidden');
 
-            if (videos.length > 0) {
-                videos.forEach(item => {
-                    const itemEl = createItemElement(item);
-                    videoGrid.appendChild(itemEl);
-                });
+    const res = await fetch(`/api/get_videos?${params}`);
+    if (!res.ok || id !== listingId) return;
+    const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+    let trailer = null;
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        if (id !== listingId) {
+            reader.cancel();
+            return;
+        }
+        const lines = (buffer + value).split('\n');
+        buffer = lines.pop();
+        lines.filter(line => line).forEach(line => {
+            const item = JSON.parse(line);
+            if (item.type === 'end') {
+                trailer = item;
             } else {
-                videoGrid.innerHTML = '<p class="col-span-full text-center text-gray-500">Nenhum vídeo encontrado.</p>';
+                (item.type === 'folder' ? folderGrid : videoGrid).appendChild(createItemElement(item));
             }
+        });
+    }
+
+    nextCursor = trailer && trailer.next_cursor;
+    loadMoreBtn.classList.toggle('hidden', !nextCursor);
+    if (!nextCursor) {
+        if (!folderGrid.children.length) folderGrid.innerHTML = '<p class="col-span-full text-center text-gray-500">Nenhuma pasta encontrada.</p>';
+        if (!videoGrid.children.length) videoGrid.innerHTML = '<p class="col-span-full text-center text-gray-500">Nenhum vídeo encontrado.</p>';
+    }
+}
+
+loadMoreBtn.addEventListener('click', () => loadPage(listingId, nextCursor));
+sortSelect.addEventListener('change', () => {
+    if (!librarySearchField.value.trim()) navigate(currentPath);
+});
 
-            // Renderiza vídeos
-            videos.forEach(item => {
-                const itemEl = createItemElement(item);
-                mediaGrid.appendChild(itemEl);
-            });
+function renderItems(items, emptyFolders, emptyVideos) {
+    listingId++;
+    loadMoreBtn.classList.add('hidden');
+    folderGrid.innerHTML = '';
+    videoGrid.innerHTML = '';
+    const folders = items.filter(item => item.type === 'folder');
+    const videos = items.filter(item => item.type === 'video');
+    folders.forEach(item => folderGrid.appendChild(createItemElement(item)));
+    videos.forEach(item => videoGrid.appendChild(createItemElement(item)));
+    if (folders.length === 0) folderGrid.innerHTML = `<p class="col-span-full text-center text-gray-500">${emptyFolders}</p>`;
+    if (videos.length === 0) videoGrid.innerHTML = `<p class="col-span-full text-center text-gray-500">${emptyVideos}</p>`;
+}
+
+// 6. Busca na biblioteca inteira (o campo vazio volta para a pasta atual)
+function search(query) {
+    fetch(`/api/search?q=${encodeURIComponent(query)}&limit=100`)
+        .then(res => res.json())
+        .then(data => {
+            if (librarySearchField.value.trim() !== query) return; // já foi digitada outra busca
+            const title = document.createElement('li');
+            title.className = 'font-medium';
+            title.textContent = `Resultados para "${query}"`;
+            breadcrumbsContainer.replaceChildren(title);
+            renderItems(data.items, 'Nenhuma pasta encontrada.', 'Nenhum vídeo encontrado.');
         });
 }
 
+librarySearchField.addEventListener('input', () => {
+    clearTimeout(searchTimeout);
+    const query = librarySearchField.value.trim();
+    searchTimeout = setTimeout(() => query ? search(query) : navigate(currentPath), 200);
+});
+
+function formatDuration(seconds) {
+    if (!seconds) return null;
+    const hours = Math.floor(seconds / 3600);
+    const minutes = Math.floor((seconds % 3600) / 60);
+    return hours ? `${hours}h${String(minutes).padStart(2, '0')}` : `${minutes || 1} min`;
+}
+
 function createItemElement(item) {
     const itemEl = document.createElement('div');
     itemEl.title = item.name; // Adiciona o nome completo como um tooltip nativo do navegador
@@ -158,15 +262,41 @@ function createItemElement(item) {
             banner.src = defaultFolderBanner;
         };
     } else if (item.type === 'video') {
-        const lastSlashIndex = max(item.path.lastIndexOf('/'), item.path.lastIndexOf('\\'));
-        const dirPath = lastSlashIndex === -1 ? '' : item.path.substring(0, lastSlashIndex);
-        const baseName = item.name.substring(0, item.name.lastIndexOf('.'));
-
-        banner.src = `/videos/${dirPath ? dirPath + '/' : ''}.previews/${baseName}_banner.png?`; // t=${new Date().getTime()}
+        // O backend informa qual variante do banner existe em .previews
+        banner.src = item.banner || defaultVideoBanner;
         banner.onerror = () => {
             banner.src = defaultVideoBanner;
         };
     }
+    // Metadados do IMDb (quando o job de banners já encontrou o título)
+    const metadata = item.metadata;
+    if (metadata) {
+        const details = [metadata.year, metadata.rating && `★ ${metadata.rating}`, (metadata.genres || []).slice(0, 2).join(', ')]
+            .filter(Boolean).join(' · ');
+        if (details) {
+            const metaEl = document.createElement('div');
+            metaEl.className = 'file-meta';
+            metaEl.textContent = details;
+            nameEl.appendChild(metaEl);
+        }
+        if (metadata.plot) itemEl.title = `${item.name}\n\n${metadata.plot}`;
+    }
+    // Duração, resolução e se o vídeo precisa ser recodificado (lidos pelo ffprobe)
+    if (item.type === 'video') {
+        const details = [formatDuration(item.duration), item.height && `${item.height}p`, item.video_codec]
+            .filter(Boolean).join(' · ');
+        if (details) {
+            const metaEl = document.createElement('div');
+            metaEl.className = 'file-meta';
+            metaEl.textContent = details;
+            nameEl.appendChild(metaEl);
+        }
+        if (item.playable === false) {
+            itemEl.classList.add('slow-playback');
+            itemEl.title = `${item.name}\n\nEste vídeo precisa ser recodificado (${item.video_codec || '?'}/${item.audio_codec || '?'}) e pode travar para todos.`;
+        }
+    }
+
     itemEl.appendChild(banner);
     itemEl.appendChild(nameEl);
     return itemEl;
@@ -218,7 +348,7 @@ function renderBreadcrumb(path) {
 }
 
 function setVideo(videoPath) {
-    socket.emit('host_set_video', videoPath);
+    socket.emit('host_set_video', { room: roomId, video: videoPath });
     const fileName = videoPath.split('/').pop();
     showStatus(`Vídeo "${fileName}" definido para todos!`, 'success');
 }
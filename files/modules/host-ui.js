@@ -3,6 +3,8 @@ import { stopScreenShare, getScreenStream, setScreenStream, createScreenShareCon
 import { peerConnections, getLocalStream } from './webrtc.js';
 import { syncState } from './video-sync.js';
 
+const SEEK_SYNC_DEBOUNCE_MS = 150;
+
 export function updateStatusIndicator(statusIndicator, isHost) {
     if (isHost) {
         statusIndicator.innerHTML = `<span class="host-label">⭐ Você é o Host</span>`;
@@ -56,7 +58,7 @@ export function setupHostUI({ socket, player, dubPlayer, dubDelayInput, statusIn
     player.on('play', () => {
         if (isHostRef.value && !syncState.isSyncing) {
             if (!player.muted) dubPlayer.pause(); else dubPlayer.play();
-            socket.emit('host_sync', { type: 'play', time: player.currentTime });
+            socket.emit('host_sync', { type: 'play', time: player.currentTime, rate: player.speed });
             return;
         }
         if (!isHostRef.value) {
@@ -73,7 +75,7 @@ export function setupHostUI({ socket, player, dubPlayer, dubDelayInput, statusIn
     player.on('pause', () => {
         if (isHostRef.value && !syncState.isSyncing) {
             dubPlayer.pause();
-            socket.emit('host_sync', { type: 'pause', time: player.currentTime });
+            socket.emit('host_sync', { type: 'pause', time: player.currentTime, rate: player.speed });
             return;
         }
         if (!isHostRef.value) {
@@ -84,10 +86,21 @@ export function setupHostUI({ socket, player, dubPlayer, dubDelayInput, statusIn
         }
     });
 
+    // Ao arrastar a barra de progresso, só a posição final é enviada
+    let seekSyncTimer = null;
     player.on('seeked', () => {
         if (isHostRef.value && !syncState.isSyncing) {
             dubPlayer.currentTime = player.currentTime + parseFloat(dubDelayInput.value);
-            socket.emit('host_sync', { type: 'seek', time: player.currentTime });
+            clearTimeout(seekSyncTimer);
+            seekSyncTimer = setTimeout(() => {
+                socket.emit('host_sync', { type: 'seek', time: player.currentTime, rate: player.speed });
+            }, SEEK_SYNC_DEBOUNCE_MS);
+        }
+    });
+
+    player.on('ratechange', () => {
+        if (isHostRef.value && !syncState.isSyncing) {
+            socket.emit('host_sync', { type: 'rate', time: player.currentTime, rate: player.speed });
         }
     });
 
@@ -0,0 +1,65 @@
+// Lista de usuários da sala, mantida a partir de um snapshot versionado e dos
+// deltas (join / leave / host) que o servidor envia depois dele.
+export const presence = {
+    version: -1,
+    users: {}
+};
+
+const listeners = [];
+let awaitingSnapshot = false;
+
+// callback(users, changes): changes é null quando a lista inteira foi substituída
+export function onPresenceChange(callback) {
+    listeners.push(callback);
+    if (presence.version >= 0) callback(presence.users, null);
+}
+
+function notify(changes) {
+    listeners.forEach(callback => callback(presence.users, changes));
+}
+
+function applyChange(change) {
+    switch (change.op) {
+        case 'join':
+            presence.users[change.sid] = change.user;
+            break;
+        case 'leave':
+            delete presence.users[change.sid];
+            break;
+        case 'host':
+            if (presence.users[change.previous]) presence.users[change.previous].isHost = false;
+            if (presence.users[change.sid]) presence.users[change.sid].isHost = true;
+            break;
+    }
+}
+
+export function initPresence(socket) {
+    // Ao reconectar a sala pode ter recomeçado (ex. restart do servidor): aceita qualquer snapshot
+    socket.on('disconnect', () => {
+        presence.version = -1;
+        awaitingSnapshot = false;
+    });
+
+    socket.on('presence_snapshot', ({ version, users }) => {
+        awaitingSnapshot = false;
+        if (version < presence.version) return;
+        presence.version = version;
+        presence.users = users;
+        notify(null);
+    });
+
+    socket.on('presence_delta', ({ version, changes }) => {
+        if (version <= presence.version) return;
+        if (version !== presence.version + 1) {
+            // Perdemos uma versão: a lista local não é confiável até chegar um snapshot
+            if (!awaitingSnapshot) {
+                awaitingSnapshot = true;
+                socket.emit('request_presence');
+            }
+            return;
+        }
+        changes.forEach(applyChange);
+        presence.version = version;
+        notify(changes);
+    });
+}
@@ -3,6 +3,7 @@ import { showNotification } from './notifications.js';
 
 // Shared mutable state — imported as a live reference by host-ui.js
 export const syncState = {
+    currentVideo: null,
     isSyncing: false,
     syncInterval: null,
     syncRequestTime: 0
@@ -11,15 +12,56 @@ export const syncState = {
 export async function loadMediaTracks(videoPath) {
     try {
         const response = await fetch(`/api/get_subtitles/${videoPath}`);
-        if (!response.ok) return { subtitles: [], dubs: [] };
+        if (!response.ok) return { subtitles: [], dubs: [], thumbnails: null };
         const data = await response.json();
-        return { subtitles: data.subtitles || [], dubs: data.dubs || [] };
+        return { subtitles: data.subtitles || [], dubs: data.dubs || [], thumbnails: data.thumbnails || null };
     } catch (error) {
         console.error("Erro ao buscar faixas de mídia:", error);
-        return { subtitles: [], dubs: [] };
+        return { subtitles: [], dubs: [], thumbnails: null };
     }
 }
 
+// Vídeos locais tocam pelo /video, ou pela playlist HLS (stream) quando o servidor
+// a oferece — via hls.js, ou nativamente no Safari.
+let activeHls = null;
+
+// O hls.js continua baixando segmentos até ser destruído, mesmo após trocar o vídeo
+export function stopHls() {
+    if (activeHls) {
+        activeHls.destroy();
+        activeHls = null;
+    }
+}
+
+export function setPlayerSource(player, video, stream, tracks) {
+    stopHls();
+
+    if (stream && window.Hls && Hls.isSupported()) {
+        player.source = { type: 'video', sources: [], tracks };
+        activeHls = new Hls();
+        activeHls.loadSource(stream);
+        activeHls.attachMedia(player.media);
+        return;
+    }
+
+    const nativeHls = stream && player.media.canPlayType('application/vnd.apple.mpegurl');
+    player.source = {
+        type: 'video',
+        sources: [{ src: nativeHls ? stream : `/video/${video}`, provider: 'html5' }],
+        tracks
+    };
+}
+
+// Pré-visualização ao passar o mouse na barra de progresso (sprites + WebVTT)
+export function applySeekPreviews(player, src) {
+    if (!src || typeof player.setPreviewThumbnails !== 'function') return;
+    player.setPreviewThumbnails({ enabled: true, src });
+}
+
+export function handleSeekPreviewsReady(data, player) {
+    if (data.video === syncState.currentVideo) applySeekPreviews(player, data.src);
+}
+
 export function setupDubControls(dubs, dubSelector, audioControlsContainer) {
     dubSelector.innerHTML = '';
     if (dubs && dubs.length > 1) {
@@ -51,6 +93,18 @@ export function setupDubListeners(dubSelector, dubVolume, dubDelayInput, dubPlay
         }
     });
 
+    // Trilhas extraídas sob demanda respondem 503 enquanto a extração não termina
+    dubPlayer.addEventListener('error', () => {
+        const src = dubSelector.options[dubSelector.selectedIndex]?.dataset.src;
+        if (!src || !src.startsWith('/api/audio_track/')) return;
+        setTimeout(() => {
+            if (dubSelector.options[dubSelector.selectedIndex]?.dataset.src !== src) return;
+            dubPlayer.src = src;
+            dubPlayer.currentTime = player.currentTime + parseFloat(dubDelayInput.value || 0);
+            if (!player.paused) dubPlayer.play();
+        }, 5000);
+    });
+
     dubVolume.addEventListener('input', (e) => {
         dubPlayer.volume = e.target.value;
     });
@@ -64,6 +118,8 @@ export function handleSyncState(state, player, dubSelector, audioControlsContain
     if (!state.video) return;
 
     syncState.isSyncing = true;
+    syncState.currentVideo = state.video;
+    stopHls();
 
     if (state.video.startsWith('http')) {
         player.source = {
@@ -74,17 +130,15 @@ export function handleSyncState(state, player, dubSelector, audioControlsContain
             }]
         };
     } else {
-        loadMediaTracks(state.video).then(({ subtitles, dubs }) => {
-            player.source = {
-                type: 'video',
-                sources: [{ src: `/video/${state.video}`, provider: 'html5' }],
-                tracks: subtitles
-            };
+        loadMediaTracks(state.video).then(({ subtitles, dubs, thumbnails }) => {
+            setPlayerSource(player, state.video, state.stream, subtitles);
+            applySeekPreviews(player, thumbnails);
             setupDubControls(dubs, dubSelector, audioControlsContainer);
         });
     }
 
     player.currentTime = state.time;
+    if (state.rate) player.speed = state.rate;
     if (state.paused) {
         player.pause();
     } else {
@@ -93,14 +147,52 @@ export function handleSyncState(state, player, dubSelector, audioControlsContain
     setTimeout(() => { syncState.isSyncing = false; }, 1000);
 }
 
+// Estado combinado (posição, pausa, velocidade) enviado pelo servidor após agrupar
+// os eventos do host. Se o player ainda está no meio de um seek, guarda só o
+// estado mais recente e o aplica quando o seek terminar, em vez de empilhar seeks.
+let pendingState = null;
+
+function applyRoomState(state, player, dubPlayer, dubDelayInput) {
+    if (player.media.seeking) {
+        if (!pendingState) {
+            player.once('seeked', () => {
+                const latest = pendingState;
+                pendingState = null;
+                applyRoomState(latest, player, dubPlayer, dubDelayInput);
+            });
+        }
+        pendingState = state;
+        return;
+    }
+
+    if (state.rate && player.speed !== state.rate) {
+        player.speed = state.rate;
+        dubPlayer.playbackRate = state.rate;
+    }
+    if (Math.abs(player.currentTime - state.time) > 1.5) {
+        player.currentTime = state.time;
+    }
+    dubPlayer.currentTime = player.currentTime + parseFloat(dubDelayInput.value);
+
+    if (state.paused) {
+        dubPlayer.pause();
+        player.pause();
+    } else {
+        if (!player.muted) dubPlayer.pause(); else dubPlayer.play();
+        player.play();
+    }
+}
+
 export function handleSyncEvent(data, player, dubPlayer, dubDelayInput, isHostRef, dubSelector, audioControlsContainer, getScreenStream, stopScreenShare) {
-    if (isHostRef.value && ['play', 'pause', 'seek'].includes(data.type)) return;
+    if (isHostRef.value && data.type === 'state') return;
 
     syncState.isSyncing = true;
 
     try {
         switch (data.type) {
             case 'set_video':
+                syncState.currentVideo = data.video;
+                stopHls();
                 if (isHostRef.value && getScreenStream()) stopScreenShare();
 
                 if (player.media.srcObject) {
@@ -121,12 +213,9 @@ export function handleSyncEvent(data, player, dubPlayer, dubDelayInput, isHostRe
                         sources: [{ src: data.video, provider: isVideoFromYoutube(data.video) ? 'youtube' : 'html5' }]
                     };
                 } else {
-                    loadMediaTracks(data.video).then(({ subtitles, dubs }) => {
-                        player.source = {
-                            type: 'video',
-                            sources: [{ src: `/video/${data.video}`, provider: 'html5' }],
-                            tracks: subtitles
-                        };
+                    loadMediaTracks(data.video).then(({ subtitles, dubs, thumbnails }) => {
+                        setPlayerSource(player, data.video, data.stream, subtitles);
+                        applySeekPreviews(player, thumbnails);
                         setupDubControls(dubs, dubSelector, audioControlsContainer);
                     });
                 }
@@ -135,21 +224,8 @@ export function handleSyncEvent(data, player, dubPlayer, dubDelayInput, isHostRe
                 player.currentTime = 0;
                 break;
 
-            case 'play':
-                if (!player.muted) dubPlayer.pause(); else dubPlayer.play();
-                player.play();
-                break;
-
-            case 'pause':
-                dubPlayer.pause();
-                player.pause();
-                break;
-
-            case 'seek':
-                if (Math.abs(player.currentTime - data.time) > 1.5) {
-                    player.currentTime = data.time;
-                }
-                dubPlayer.currentTime = player.currentTime + parseFloat(dubDelayInput.value);
+            case 'state':
+                applyRoomState(data, player, dubPlayer, dubDelayInput);
                 break;
         }
     } catch (e) {
@@ -163,10 +239,12 @@ export function handleForceSync(data, player, isHostRef, statusIndicator) {
     if (isHostRef.value || syncState.isSyncing) return;
 
     const ping = Date.now() - syncState.syncRequestTime;
-    const correctedTime = data.time + (ping / 2 / 1000);
+    const correctedTime = data.paused ? data.time : data.time + (ping / 2 / 1000) * (data.rate || 1);
 
     statusIndicator.innerHTML = `Ping: <span class="ping-value">${ping} ms</span>`;
 
+    if (data.rate && player.speed !== data.rate) player.speed = data.rate;
+
     if (Math.abs(player.currentTime - correctedTime) > 2) {
         syncState.isSyncing = true;
         player.currentTime = correctedTime;
@@ -183,10 +183,11 @@ form.onsubmit = async (event) => {
         formData.append('file', croppedBlob, 'avatar.png');
 
         try {
-            const res = await fetch('/api/upload_image', {
+            const res = await fetch('/api/upload_image?kind=avatar', {
                 method: 'POST',
                 body: formData
             });
+            if (!res.ok) throw new Error(`Upload falhou: ${res.status}`);
             const data = await res.json();
             pfpUrl = data.url || '';
         } catch (err) {
@@ -197,5 +198,6 @@ form.onsubmit = async (event) => {
     sessionStorage.setItem('userName', name);
     sessionStorage.setItem('userPfp', pfpUrl);
 
-    window.location.href = '/party';
+    // Mantém o ?room= do convite ao entrar na sala
+    window.location.href = `/party${window.location.search}`;
 };
@@ -2,18 +2,24 @@ import os
 import subprocess
 import json
 import sys
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Lista de extensões de vídeo comuns a serem verificadas
 VIDEO_EXTENSIONS = {'.mkv', '.mp4', '.avi', '.mov', '.wmv', '.flv', '.webm'}
 
-MAKE_SUBS = input("Gostaria de fazer as legendas? y/N ").upper() in "YS"
-MAKE_DUBS = input("Gostaria de fazer as dublagens? y/N ").upper() in "YS"
+# Legendas em imagem (PGS, DVD, DVB) não podem ser convertidas para WebVTT
+BITMAP_SUBTITLE_CODECS = {'hdmv_pgs_subtitle', 'dvd_subtitle', 'dvb_subtitle', 'xsub'}
+
+# Guarda tamanho/mtime de cada vídeo já processado para pular os que não mudaram
+MANIFEST_FILENAME = '.make_captions_manifest.json'
 
 
 def find_media_streams(video_path):
     """
     Usa o ffprobe para encontrar trilhas de legenda e áudio em um arquivo de vídeo.
-    Retorna uma lista de dicionários, cada um representando uma trilha.
+    Retorna uma lista de dicionários, cada um representando uma trilha, ou None se a análise falhar.
     """
     command = [
         'ffprobe',
@@ -29,25 +35,42 @@ def find_media_streams(video_path):
         return [s for s in streams if s.get('codec_type') in ['subtitle', 'audio']]
     except (subprocess.CalledProcessError, json.JSONDecodeError, FileNotFoundError) as e:
         print(f"  [ERRO] Falha ao analisar o vídeo '{os.path.basename(video_path)}': {e}", file=sys.stderr)
-        return []
+        return None
 
 
-def extract_subtitle(video_path, stream_index, output_path):
-    """
-    Usa o ffmpeg para extrair uma trilha de legenda específica para o formato VTT.
-    """
-    command = [
-        'ffmpeg',
-        '-i', video_path,
+def subtitle_output_args(stream_index, output_path):
+    """Argumentos de saída do ffmpeg para uma trilha de legenda em WebVTT."""
+    return [
         '-map', f'0:s:{stream_index}',  # Mapeia a trilha de legenda pelo índice
         '-map_metadata', '-1',  # Remove metadados para evitar problemas de conversão
         '-c:s', 'webvtt',  # Converte para o formato WebVTT
-        '-y',  # Sobrescreve o arquivo de saída se ele já existir
         output_path
     ]
+
+
+def audio_output_args(stream_index, output_path):
+    """Argumentos de saída do ffmpeg para uma trilha de áudio em MP3."""
+    return [
+        '-map', f'0:a:{stream_index}',  # Mapeia a trilha de áudio pelo índice relativo
+        '-map_metadata', '-1',  # Remove metadados para consistência
+        '-c:a', 'libmp3lame',  # Converte para o formato MP3
+        '-q:a', '2',  # Qualidade do MP3 (0-9, menor é melhor)
+        output_path
+    ]
+
+
+def _run_ffmpeg(video_path, output_args):
+    command = ['ffmpeg', '-v', 'error', '-nostdin', '-y', '-i', video_path] + output_args
+    # Usamos DEVNULL para não poluir o console com a saída do ffmpeg
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def extract_subtitle(video_path, stream_index, output_path):
+    """
+    Usa o ffmpeg para extrair uma trilha de legenda específica para o formato VTT.
+    """
     try:
-        # Usamos DEVNULL para não poluir o console com a saída do ffmpeg
-        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        _run_ffmpeg(video_path, subtitle_output_args(stream_index, output_path))
         print(f"    -> Legenda extraída para: {os.path.basename(output_path)}")
         return True
     except subprocess.CalledProcessError as e:
@@ -59,19 +82,8 @@ def extract_audio(video_path, stream_index, output_path):
     """
     Usa o ffmpeg para extrair uma trilha de áudio específica para o formato MP3.
     """
-    command = [
-        'ffmpeg',
-        '-i', video_path,
-        '-map', f'0:a:{stream_index}',  # Mapeia a trilha de áudio pelo índice relativo
-        '-map_metadata', '-1',  # Remove metadados para consistência
-        '-c:a', 'libmp3lame',  # Converte para o formato MP3
-        '-q:a', '2',  # Qualidade do MP3 (0-9, menor é melhor)
-        '-y',  # Sobrescreve o arquivo de saída se ele já existir
-        output_path
-    ]
     try:
-        # Usamos DEVNULL para não poluir o console com a saída do ffmpeg
-        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        _run_ffmpeg(video_path, audio_output_args(stream_index, output_path))
         print(f"    -> Dublagem extraída para: {os.path.basename(output_path)}")
         return True
     except subprocess.CalledProcessError as e:
@@ -79,74 +91,210 @@ def extract_audio(video_path, stream_index, output_path):
         return False
 
 
-def process_videos_in_directory(root_dir):
+def extract_all(video_path, outputs):
+    """
+    Extrai todas as trilhas pedidas com uma única execução do ffmpeg, que lê o
+    arquivo de origem uma só vez e grava todas as saídas.
+    outputs = [("sub" | "dub", índice, caminho_de_saída), ...]
+    Se a execução conjunta falhar, tenta trilha a trilha para salvar o que der.
+    Retorna {caminho_de_saída: extraída}, conferindo se cada arquivo existe mesmo.
+    """
+    output_args = []
+    for kind, index, output_path in outputs:
+        builder = subtitle_output_args if kind == "sub" else audio_output_args
+        output_args += builder(index, output_path)
+
+    try:
+        _run_ffmpeg(video_path, output_args)
+        results = {output_path: _output_exists(output_path) for _, _, output_path in outputs}
+        for output_path, ok in results.items():
+            if ok:
+                print(f"    -> Extraído: {os.path.basename(output_path)}")
+        return results
+    except subprocess.CalledProcessError:
+        print(f"  [AVISO] Extração conjunta falhou para '{os.path.basename(video_path)}', tentando trilha a trilha.",
+              file=sys.stderr)
+
+    results = {}
+    for kind, index, output_path in outputs:
+        extract = extract_subtitle if kind == "sub" else extract_audio
+        results[output_path] = extract(video_path, index, output_path) and _output_exists(output_path)
+    return results
+
+
+def _output_exists(output_path):
+    return os.path.isfile(output_path) and os.path.getsize(output_path) > 0
+
+
+def process_video(video_path, make_subs, make_dubs):
     """
-    Varre o diretório e subdiretórios em busca de vídeos e extrai suas legendas e dublagens.
+    Analisa um vídeo e extrai suas legendas e dublagens.
+    Retorna {"sub" | "dub": {nome_da_saída: extraída}}, ou None se o vídeo não pôde ser analisado.
+    """
+    dirpath, filename = os.path.split(video_path)
+    base_filename = os.path.splitext(filename)[0]
+    print(f"Verificando vídeo: {filename}")
+
+    all_streams = find_media_streams(video_path)
+    if all_streams is None:
+        return None
+    subtitle_streams = [s for s in all_streams if s.get('codec_type') == 'subtitle']
+    audio_streams = [s for s in all_streams if s.get('codec_type') == 'audio']
+
+    if not subtitle_streams and len(audio_streams) <= 1:
+        print(f"  - {filename}: nenhuma mídia extra (legendas ou dublagens) encontrada.")
+        return {"sub": {}, "dub": {}}
+
+    outputs = []
+
+    # --- Legendas ---
+    if subtitle_streams and make_subs:
+        subs_dir = os.path.join(dirpath, '.subs')
+        os.makedirs(subs_dir, exist_ok=True)
+        for i, stream in enumerate(subtitle_streams):
+            if stream.get('codec_name') in BITMAP_SUBTITLE_CODECS:
+                print(f"  - {filename}: trilha de legenda {i} é imagem ({stream.get('codec_name')}), ignorada.")
+                continue
+            lang = stream.get('tags', {}).get('language', 'und')
+            outputs.append(("sub", i, os.path.join(subs_dir, f"{base_filename}.track_{i}.{lang}.vtt")))
+
+    # --- Dublagens ---
+    # Só extrai se houver mais de uma faixa de áudio (considerando que a primeira é a original)
+    if len(audio_streams) > 1 and make_dubs:
+        dubs_dir = os.path.join(dirpath, '.dubs')
+        os.makedirs(dubs_dir, exist_ok=True)
+        for i, stream in enumerate(audio_streams):
+            lang = stream.get('tags', {}).get('language', 'und')
+            outputs.append(("dub", i, os.path.join(dubs_dir, f"{base_filename}.track_{i}.{lang}.mp3")))
+
+    tracks = {"sub": {}, "dub": {}}
+    if not outputs:
+        return tracks
+    print(f"  - {filename}: extraindo {len(outputs)} trilha(s).")
+    results = extract_all(video_path, outputs)
+    for kind, _, output_path in outputs:
+        tracks[kind][os.path.basename(output_path)] = results[output_path]
+    return tracks
+
+
+def load_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def process_videos_in_directory(root_dir, make_subs, make_dubs, workers=None, force=False):
+    """
+    Varre o diretório e subdiretórios em busca de vídeos e extrai suas legendas e dublagens,
+    processando vários vídeos em paralelo. Vídeos cujo tamanho e mtime não mudaram desde
+    a última execução (com as mesmas opções) são pulados.
     """
     print(f"Iniciando busca por vídeos em: {os.path.abspath(root_dir)}\n")
-    videos_found = 0
-    subs_extracted = 0
-    dubs_extracted = 0
+    manifest_path = os.path.join(root_dir, MANIFEST_FILENAME)
+    manifest = {} if force else load_manifest(manifest_path)
+    manifest_lock = threading.Lock()
 
-    for dirpath, _, filenames in os.walk(root_dir):
+    pending = []
+    videos_found = 0
+    skipped = 0
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        # Não desce em .subs, .dubs, .previews etc.
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
         for filename in filenames:
             # Pega a extensão do arquivo e a converte para minúsculas
-            file_ext = os.path.splitext(filename)[1].lower()
-
-            if file_ext not in VIDEO_EXTENSIONS:
+            if os.path.splitext(filename)[1].lower() not in VIDEO_EXTENSIONS:
                 continue
 
             videos_found += 1
             video_path = os.path.join(dirpath, filename)
-            print(f"Verificando vídeo: {filename}")
+            key = os.path.relpath(video_path, root_dir).replace('\\', '/')
+            st = os.stat(video_path)
+            stamp = {"size": st.st_size, "mtime": st.st_mtime}
 
-            all_streams = find_media_streams(video_path)
-            subtitle_streams = [s for s in all_streams if s.get('codec_type') == 'subtitle']
-            audio_streams = [s for s in all_streams if s.get('codec_type') == 'audio']
+            previous = manifest.get(key)
+            if (previous and previous["size"] == stamp["size"] and previous["mtime"] == stamp["mtime"]
+                    and (previous.get("subs") or not make_subs) and (previous.get("dubs") or not make_dubs)):
+                skipped += 1
+                continue
+            pending.append((key, video_path, stamp))
 
-            if not subtitle_streams and len(audio_streams) <= 1:
-                print("  - Nenhuma mídia extra (legendas ou dublagens) encontrada.")
+    subs_extracted = 0
+    dubs_extracted = 0
+    workers = workers or os.cpu_count() or 2
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_video, video_path, make_subs, make_dubs): (key, stamp)
+                   for key, video_path, stamp in pending}
+        for done_count, future in enumerate(as_completed(futures), start=1):
+            key, stamp = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"  [ERRO] Falha ao processar '{key}': {e}", file=sys.stderr)
                 continue
+            # Vídeos que não puderam ser analisados ficam fora do manifesto para serem tentados de novo
+            if result is None:
+                continue
+            subs_extracted += sum(result["sub"].values())
+            dubs_extracted += sum(result["dub"].values())
+            # Um tipo só conta como feito se todas as trilhas pedidas foram gravadas;
+            # as que falharam ficam registradas e o vídeo é tentado de novo na próxima execução
+            subs_done = make_subs and all(result["sub"].values())
+            dubs_done = make_dubs and all(result["dub"].values())
+            failed = sorted(name for tracks in result.values() for name, ok in tracks.items() if not ok)
+            for name in failed:
+                print(f"  [AVISO] Trilha não extraída: {name}", file=sys.stderr)
+
+            with manifest_lock:
+                previous = manifest.get(key, {})
+                same_file = previous.get("size") == stamp["size"] and previous.get("mtime") == stamp["mtime"]
+                manifest[key] = {
+                    **stamp,
+                    "subs": subs_done or (not make_subs and same_file and previous.get("subs", False)),
+                    "dubs": dubs_done or (not make_dubs and same_file and previous.get("dubs", False)),
+                    "tracks": {
+                        **(previous.get("tracks", {}) if same_file else {}),
+                        **{name: ok for tracks in result.values() for name, ok in tracks.items()},
+                    },
+                }
+                # Salva de tempos em tempos para não perder o progresso se a execução for interrompida
+                if done_count % 20 == 0:
+                    save_manifest(manifest_path, manifest)
 
-            # --- Processa Legendas ---
-            if subtitle_streams and MAKE_SUBS:
-                print(f"  - Encontradas {len(subtitle_streams)} trilha(s) de legenda.")
-                subs_dir = os.path.join(dirpath, '.subs')
-                os.makedirs(subs_dir, exist_ok=True)
-
-                for i, stream in enumerate(subtitle_streams):
-                    lang = stream.get('tags', {}).get('language', 'und')
-                    base_filename = os.path.splitext(filename)[0]
-                    output_filename = f"{base_filename}.track_{i}.{lang}.vtt"
-                    output_path = os.path.join(subs_dir, output_filename)
-
-                    if extract_subtitle(video_path, i, output_path):
-                        subs_extracted += 1
-
-            # --- Processa Dublagens ---
-            # Só extrai se houver mais de uma faixa de áudio (considerando que a primeira é a original)
-            if len(audio_streams) > 1 and MAKE_DUBS:
-                print(f"  - Encontradas {len(audio_streams)} trilha(s) de áudio (possíveis dublagens).")
-                dubs_dir = os.path.join(dirpath, '.dubs')
-                os.makedirs(dubs_dir, exist_ok=True)
-
-                for i, stream in enumerate(audio_streams):
-                    lang = stream.get('tags', {}).get('language', 'und')
-                    base_filename = os.path.splitext(filename)[0]
-                    output_filename = f"{base_filename}.track_{i}.{lang}.mp3"
-                    output_path = os.path.join(dubs_dir, output_filename)
-
-                    if extract_audio(video_path, i, output_path):
-                        dubs_extracted += 1
+    save_manifest(manifest_path, manifest)
 
     print("\n--- Resumo da Operação ---")
-    print(f"Vídeos encontrados: {videos_found}")
+    print(f"Vídeos encontrados: {videos_found} (sem mudanças, pulados: {skipped})")
     print(f"Arquivos de legenda (.vtt) extraídos: {subs_extracted}")
     print(f"Arquivos de dublagem (.mp3) extraídos: {dubs_extracted}")
     print("--------------------------")
 
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Extrai legendas (WebVTT) e dublagens (MP3) embutidas nos vídeos para .subs e .dubs.")
+    parser.add_argument('root_dir', nargs='?', default='.',
+                        help="Diretório de vídeos a varrer (padrão: diretório atual)")
+    parser.add_argument('--subs', action='store_true', help="Extrai as legendas")
+    parser.add_argument('--dubs', action='store_true', help="Extrai as dublagens")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="Vídeos processados em paralelo (padrão: número de núcleos)")
+    parser.add_argument('--force', action='store_true',
+                        help="Ignora o manifesto e reprocessa todos os vídeos")
+    args = parser.parse_args(argv)
+    if not args.subs and not args.dubs:
+        parser.error("escolha ao menos uma opção: --subs e/ou --dubs")
+    return args
+
+
 if __name__ == "__main__":
-    # O script começa a busca a partir do diretório atual
-    current_directory = '.'
-    process_videos_in_directory(current_directory)
+    args = parse_args()
+    process_videos_in_directory(args.root_dir, args.subs, args.dubs, workers=args.workers, force=args.force)
@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import os
+import subprocess
+import tempfile
+import time
+from urllib.parse import quote
+
+import library_index
+import media_probe
+import metrics
+from config import CACHE_DIR, VIDEO_DIR, AUDIO_CACHE_MB
+from disk_cache import DiskCache
+from executors import run_in
+from thumbnails import FFMPEG
+
+# --- Dublagens sob Demanda ---
+# As trilhas de áudio extras de um vídeo (lidas pelo ffprobe) são servidas uma a
+# uma, só quando alguém as escolhe no player: o ffmpeg copia a trilha (sem
+# recodificar, quando o navegador suporta o codec) para um MP4 fragmentado só de
+# áudio, que já toca enquanto é gravado: o pedido é respondido assim que o
+# primeiro fragmento sai, acompanhando o arquivo até o fim da extração. Os
+# arquivos prontos ficam num DiskCache com limite de tamanho (LRU), indexado por
+# (vídeo, tamanho, mtime, trilha), e são servidos com Range.
+
+MAX_JOBS = 2                # extrações simultâneas
+TRACK_WAIT_TIMEOUT = 120    # s que um pedido espera pelo primeiro fragmento
+FRAGMENT_MICROSECONDS = 2_000_000  # duração mínima de cada fragmento (toda amostra de áudio é keyframe)
+# Codecs que o navegador toca dentro de MP4; os outros (AC3, DTS, ...) viram AAC
+COPY_AUDIO_CODECS = {"aac", "mp3", "opus"}
+
+cache = DiskCache("audio", AUDIO_CACHE_MB * 1024 * 1024)
+_jobs = {}          # chave do cache -> asyncio.Task
+_partials = {}      # chave do cache -> arquivo temporário sendo gravado
+_processes = set()  # ffmpeg em execução (encerrados no shutdown)
+_job_slots = asyncio.Semaphore(MAX_JOBS)
+
+
+def track_url(rel_video: str, index: int) -> str:
+    return f"/api/audio_track/{quote(rel_video.replace(os.sep, '/'))}?track=a{index}"
+
+
+def _audio_streams(info: dict | None) -> list[dict]:
+    return [s for s in info["streams"] if s["codec_type"] == "audio"] if info else []
+
+
+async def list_tracks(rel_video: str) -> list[dict] | None:
+    """
+    Trilhas de áudio extras do vídeo ({lang, label, src}). A primeira trilha é a
+    que o próprio vídeo toca, então não entra. None se o vídeo não pôde ser lido.
+    """
+    if not FFMPEG:
+        return None
+    info = await media_probe.probe(rel_video)
+    if info is None:
+        return None
+    tracks = []
+    for i, stream in enumerate(_audio_streams(info)):
+        if i == 0:
+            continue
+        lang = stream["language"] or "dub"
+        tracks.append({"lang": lang, "label": stream["title"] or lang.upper(), "src": track_url(rel_video, i)})
+    return tracks
+
+
+def _source_key(rel_video: str, index: int) -> tuple[str, str] | None:
+    source = os.path.abspath(os.path.join(VIDEO_DIR, rel_video))
+    if not library_index.inside_video_dir(source) or not os.path.isfile(source):
+        return None
+    stat_result = os.stat(source)
+    return source, DiskCache.make_key(rel_video, stat_result.st_size, stat_result.st_mtime_ns, f"a{index}")
+
+
+def _temp_output() -> str:
+    fd, path = tempfile.mkstemp(prefix=".audio-", suffix=".m4a", dir=CACHE_DIR)
+    os.close(fd)
+    return path
+
+
+def _store(tmp_path: str, key: str):
+    """Move a trilha pronta para o cache e a contabiliza. Bloqueante: pool 'disk'."""
+    os.replace(tmp_path, cache.path(key))
+    cache.commit(key)
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def _run_ffmpeg(args: list[str]) -> bool:
+    # Popen + poll, como no hls: funciona com qualquer event loop sem prender uma thread
+    process = subprocess.Popen([FFMPEG, '-v', 'error', '-nostdin', '-y', *args],
+                               stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _processes.add(process)
+    try:
+        while process.poll() is None:
+            await asyncio.sleep(0.5)
+    finally:
+        if process.poll() is None:
+            process.kill()
+        _processes.discard(process)
+    return process.returncode == 0
+
+
+def _written(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+async def _extract(rel_video: str, source: str, key: str, index: int, codec: str | None):
+    tmp_path = await run_in("disk", _temp_output)
+    _partials[key] = tmp_path
+    try:
+        async with _job_slots:
+            started = time.monotonic()
+            copy = codec in COPY_AUDIO_CODECS
+            codec_args = ['-c:a', 'copy'] if copy else ['-c:a', 'aac', '-b:a', '192k', '-ac', '2']
+            metrics.log_event("audio_track_started", video=rel_video, track=index, codec=codec,
+                              mode="copy" if copy else "transcode")
+            ok = await _run_ffmpeg(['-i', source, '-map', f'0:a:{index}', '-vn', '-sn', '-dn', *codec_args,
+                                    '-map_metadata', '-1',
+                                    '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+                                    '-min_frag_duration', str(FRAGMENT_MICROSECONDS), '-f', 'mp4', tmp_path])
+        if not ok:
+            metrics.log_event("audio_track_failed", level=logging.WARNING, video=rel_video, track=index)
+            return
+        await run_in("disk", _store, tmp_path, key)
+        metrics.log_event("audio_track_ready", video=rel_video, track=index,
+                          seconds=round(time.monotonic() - started, 1))
+    except Exception as e:
+        metrics.log_event("audio_track_failed", level=logging.ERROR, video=rel_video, track=index, error=repr(e))
+    finally:
+        _partials.pop(key, None)
+        await run_in("disk", _remove_quietly, tmp_path)
+        _jobs.pop(key, None)
+
+
+async def find_track(rel_video: str, track: str) -> tuple[str, str, object] | None:
+    """
+    Trilha de áudio ("a<n>" = n-ésima trilha de áudio) em MP4, extraindo-a se
+    preciso: (caminho, caminho_final, done). Pronta, caminho == caminho_final e
+    done é None; em extração, caminho é o arquivo ainda sendo gravado e done()
+    diz quando ele terminou (ver GrowingFileResponse). None se a trilha não
+    existe ou a extração falhou; TimeoutError se nem o primeiro fragmento saiu.
+    """
+    if not FFMPEG or not track.startswith("a") or not track[1:].isdigit():
+        return None
+    index = int(track[1:])
+    found = await run_in("disk", _source_key, rel_video, index)
+    if found is None:
+        return None
+    source, key = found
+
+    final_path = cache.path(key)
+    if key not in _jobs and await run_in("disk", cache.has, key):
+        await run_in("disk", cache.touch, key)
+        return final_path, final_path, None
+
+    task = _jobs.get(key)
+    if task is None:
+        streams = _audio_streams(await media_probe.probe(rel_video))
+        if index >= len(streams):
+            return None
+        task = _jobs[key] = asyncio.create_task(_extract(rel_video, source, key, index, streams[index]["codec_name"]))
+
+    deadline = time.monotonic() + TRACK_WAIT_TIMEOUT
+    while not task.done():
+        partial = _partials.get(key)
+        if partial and await run_in("disk", _written, partial) > 0:
+            return partial, final_path, task.done
+        if time.monotonic() > deadline:
+            raise asyncio.TimeoutError()
+        await asyncio.sleep(0.5)
+    return (final_path, final_path, None) if await run_in("disk", cache.has, key) else None
+
+
+def stop_all():
+    """Encerra as extrações em andamento (chamado no shutdown)."""
+    for task in list(_jobs.values()):
+        task.cancel()
+    for process in list(_processes):
+        process.kill()
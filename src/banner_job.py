@@ -0,0 +1,288 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+import imdb_metadata
+import library_index
+import media_probe
+import metrics
+from config import VIDEO_DIR, data_path
+from executors import run_in, POOLS
+from server_setup import try_lock_file
+from thumbnails import extract_thumbnail, find_video_banner
+
+CHECKPOINT_FILE = data_path("banner_job.json")
+LOCK_FILE = data_path("banner_job.lock")      # travado pelo worker que está rodando o job
+CANCEL_FILE = data_path("banner_job.cancel")  # id do job cujo cancelamento outro worker pediu
+CHECKPOINT_INTERVAL = 2.0  # s entre gravações do checkpoint
+MAX_UPDATED_NAMES = 50     # nomes guardados em "updated" (o total vai em "updated_count")
+
+# --- Job de Geração de Banners ---
+# Roda em segundo plano: pôsteres do IMDb para pastas (ver imdb_metadata) e
+# thumbnails para vídeos. O progresso é salvo em CHECKPOINT_FILE para que um
+# restart retome o job.
+#
+# Com vários workers só um roda o job: quem travar LOCK_FILE. O checkpoint é
+# também o status compartilhado: os outros workers respondem status a partir
+# dele e pedem o cancelamento por CANCEL_FILE, que o dono confere a cada
+# gravação do checkpoint.
+
+_job = None          # job deste worker (o em andamento ou o último)
+
+
+# --- Checkpoint ---
+
+def _load_checkpoint() -> dict | None:
+    try:
+        with open(CHECKPOINT_FILE, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _write_checkpoint(data: dict) -> bool:
+    """Grava o checkpoint e diz se outro worker pediu o cancelamento do job."""
+    tmp_path = f"{CHECKPOINT_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, CHECKPOINT_FILE)
+    try:
+        with open(CANCEL_FILE, 'r') as f:
+            return f.read().strip() == data["job_id"]
+    except FileNotFoundError:
+        return False
+
+
+async def _save_checkpoint(job: dict) -> bool:
+    job["checkpointed_at"] = time.monotonic()
+    return await run_in("disk", _write_checkpoint, {**job_status(job), "completed": sorted(job["completed"])})
+
+
+def _request_cancel(job_id: str):
+    with open(CANCEL_FILE, 'w') as f:
+        f.write(job_id)
+
+
+def _finish(lock_file):
+    """Libera o job para outros workers. Bloqueante: pool 'disk'."""
+    try:
+        os.remove(CANCEL_FILE)
+    except FileNotFoundError:
+        pass
+    lock_file.close()
+
+
+# --- Execução ---
+
+def _collect_work(completed: set) -> tuple[list, list]:
+    """Lista pastas sem pôster e vídeos sem thumbnail que ainda não foram processados."""
+    folders, videos = [], []
+    for rel_dir, entry in library_index.walk():
+        previews = set(entry["sidecars"][".previews"])
+        if rel_dir and "banner.png" not in previews and f"dir:{rel_dir}" not in completed:
+            folders.append(rel_dir)
+        for video in entry["videos"]:
+            base_name, _ = os.path.splitext(video["name"])
+            rel_video = os.path.join(rel_dir, video["name"])
+            if not find_video_banner(previews, base_name) and f"video:{rel_video}" not in completed:
+                videos.append(rel_video)
+    return folders, videos
+
+
+async def _process_folder(job: dict, rel_dir: str):
+    dir_name = os.path.basename(rel_dir)
+    preview_dir = os.path.join(VIDEO_DIR, rel_dir, ".previews")
+    banner_path = os.path.join(preview_dir, "banner.png")
+
+    metadata = await imdb_metadata.lookup(dir_name)
+    if metadata and metadata.get("poster_url"):
+        response = await imdb_metadata.get_client().get(metadata["poster_url"])
+        response.raise_for_status()
+        await run_in("disk", os.makedirs, preview_dir, exist_ok=True)
+        await run_in("disk", _write_file, banner_path, response.content)
+        _add_updated(job, dir_name)
+
+
+async def _process_video(job: dict, rel_video: str):
+    root, filename = os.path.split(os.path.join(VIDEO_DIR, rel_video))
+    base_name, _ = os.path.splitext(filename)
+    preview_dir = os.path.join(root, ".previews")
+
+    await run_in("disk", os.makedirs, preview_dir, exist_ok=True)
+    metrics.log_event("banner_thumbnail_started", video=rel_video)
+    info = await media_probe.probe(rel_video)
+    if await run_in("decode", extract_thumbnail, os.path.join(root, filename), preview_dir, base_name,
+                    info["duration"] if info else None):
+        _add_updated(job, base_name)
+
+
+def _add_updated(job: dict, name: str):
+    job["updated"].append(name)  # deque com maxlen: só os mais recentes
+    job["updated_count"] += 1
+
+
+def _write_file(dest_path: str, contents: bytes):
+    with open(dest_path, "wb") as f:
+        f.write(contents)
+
+
+async def _worker(job: dict, queue: list, key_prefix: str, handler):
+    while queue:
+        item = queue.pop()
+        try:
+            await handler(item)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job["errors"] += 1
+            metrics.log_event("banner_item_failed", level=logging.WARNING, job_id=job["id"], item=item,
+                              error=repr(e))
+        # Falhas também contam como concluídas: não adianta tentar de novo a cada restart
+        job["completed"].add(f"{key_prefix}:{item}")
+        job["done"] += 1
+        if time.monotonic() - job["checkpointed_at"] > CHECKPOINT_INTERVAL and await _save_checkpoint(job):
+            job["task"].cancel()  # cancelamento pedido por outro worker
+
+
+async def _run_job(job: dict):
+    try:
+        folders, videos = await run_in("disk", _collect_work, job["completed"])
+        job["total"] = len(folders) + len(videos)
+        await _save_checkpoint(job)
+
+        workers = [_worker(job, folders, "dir", lambda d: _process_folder(job, d))
+                   for _ in range(imdb_metadata.IMDB_MAX_CONCURRENCY)]
+        workers += [_worker(job, videos, "video", lambda v: _process_video(job, v))
+                    for _ in range(POOLS["decode"]["workers"])]
+        await asyncio.gather(*workers)
+
+        job["status"] = "done"
+    except asyncio.CancelledError:
+        job["status"] = "cancelled"
+    except Exception as e:
+        metrics.log_event("banner_job_failed", level=logging.ERROR, job_id=job["id"], error=repr(e))
+        job["status"] = "failed"
+    finally:
+        job["finished_at"] = time.time()
+        await _save_checkpoint(job)
+        await run_in("disk", _finish, job.pop("lock"))
+
+
+def _claim() -> tuple:
+    """
+    (arquivo de lock, checkpoint) se este worker pode rodar o job; (None,
+    checkpoint) se outro worker já o está rodando. Bloqueante: pool 'disk'.
+    """
+    return try_lock_file(LOCK_FILE), _load_checkpoint()
+
+
+async def start_job() -> dict:
+    """
+    Inicia um job de banners e retorna o status. Se já há um rodando (neste
+    ou em outro worker) retorna o dele; um job interrompido por um restart
+    (checkpoint "running" sem dono) é retomado.
+    """
+    global _job
+    if _job and _job["status"] == "running":
+        return job_status(_job)
+
+    lock_file, checkpoint = await run_in("disk", _claim)
+    if lock_file is None:
+        # O dono pode ainda não ter gravado o primeiro checkpoint
+        for _ in range(20):
+            if checkpoint and checkpoint.get("status") == "running":
+                break
+            await asyncio.sleep(0.1)
+            checkpoint = await run_in("disk", _load_checkpoint)
+        return _checkpoint_status(checkpoint or {})
+
+    resume = checkpoint if checkpoint and checkpoint.get("status") == "running" else None
+    if resume:
+        metrics.log_event("banner_job_resumed", job_id=resume["job_id"], completed=len(resume.get("completed", [])))
+    job = {
+        "id": resume["job_id"] if resume else uuid.uuid4().hex[:12],
+        "status": "running",
+        "total": None,
+        "done": 0,
+        "errors": 0,
+        "updated": deque(maxlen=MAX_UPDATED_NAMES),
+        "updated_count": 0,
+        "completed": set(resume["completed"]) if resume else set(),
+        "started_at": time.time(),
+        "finished_at": None,
+        "checkpointed_at": 0.0,
+        "lock": lock_file,
+    }
+    _job = job
+    await _save_checkpoint(job)
+    job["task"] = asyncio.create_task(_run_job(job))
+    return job_status(job)
+
+
+async def _current_checkpoint(job_id: str) -> dict | None:
+    checkpoint = await run_in("disk", _load_checkpoint)
+    return checkpoint if checkpoint and checkpoint.get("job_id") == job_id else None
+
+
+async def cancel_job(job_id: str) -> dict | None:
+    if _job and _job["id"] == job_id:
+        if _job["status"] == "running":
+            _job["task"].cancel()
+        return job_status(_job)
+    # Rodando em outro worker: o dono vê o pedido na próxima gravação do checkpoint
+    checkpoint = await _current_checkpoint(job_id)
+    if checkpoint is None:
+        return None
+    if checkpoint.get("status") == "running":
+        await run_in("disk", _request_cancel, job_id)
+    return _checkpoint_status(checkpoint)
+
+
+async def get_job(job_id: str) -> dict | None:
+    """Status do job: o deste worker ou, se outro worker o roda, o do checkpoint."""
+    if _job and _job["id"] == job_id:
+        return job_status(_job)
+    checkpoint = await _current_checkpoint(job_id)
+    return _checkpoint_status(checkpoint) if checkpoint else None
+
+
+def job_status(job: dict) -> dict:
+    """Visão pública (serializável) do job."""
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "total": job["total"],
+        "done": job["done"],
+        "errors": job["errors"],
+        "updated": list(job["updated"]),
+        "updated_count": job["updated_count"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+
+
+def _checkpoint_status(checkpoint: dict) -> dict:
+    """job_status a partir do checkpoint (checkpoints antigos só têm id, status e concluídos)."""
+    return {
+        "job_id": checkpoint.get("job_id"),
+        "status": checkpoint.get("status", "failed"),
+        "total": checkpoint.get("total"),
+        "done": checkpoint.get("done", len(checkpoint.get("completed", []))),
+        "errors": checkpoint.get("errors", 0),
+        "updated": checkpoint.get("updated", []),
+        "updated_count": checkpoint.get("updated_count", 0),
+        "started_at": checkpoint.get("started_at"),
+        "finished_at": checkpoint.get("finished_at"),
+    }
+
+
+async def resume_pending_job():
+    """Retoma o job interrompido por um restart, se houver um checkpoint em andamento."""
+    checkpoint = await run_in("disk", _load_checkpoint)
+    if checkpoint and checkpoint.get("status") == "running":
+        await start_job()
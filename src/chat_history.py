@@ -0,0 +1,83 @@
+import time
+
+import state
+
+# --- Histórico do Chat ---
+# Cada sala guarda as mensagens mais recentes em um buffer circular limitado por
+# quantidade e por bytes, para quem entra depois ver a conversa. O histórico fica
+# no backend de estado (ver state_backend), então todos os workers enxergam o
+# mesmo, e some junto com a sala.
+HISTORY_MAX_MESSAGES = 200
+HISTORY_MAX_BYTES = 256 * 1024  # por sala
+HISTORY_PAGE_SIZE = 50
+MAX_MESSAGE_CHARS = 4000
+
+# Controle de flood: balde de fichas por sid. Cada mensagem gasta uma ficha e o
+# balde recupera FLOOD_RATE fichas por segundo, até FLOOD_BURST. Os baldes ficam
+# no processo: os eventos de um sid chegam sempre ao worker que tem a conexão.
+FLOOD_RATE = 1.0
+FLOOD_BURST = 5
+
+_buckets = {}    # sid -> [fichas, último abastecimento]
+_stats = {"received": 0, "rate_limited": 0, "rejected": 0, "broadcast": 0,
+          "recipients": 0, "history_pages": 0, "evicted": 0}
+
+
+async def add_message(room_id, message) -> dict:
+    """Guarda a mensagem no histórico da sala, com um id crescente, e a retorna."""
+    message, evicted = await state.backend.append_chat(room_id, message, HISTORY_MAX_MESSAGES, HISTORY_MAX_BYTES)
+    _stats["evicted"] += evicted
+    return message
+
+
+async def history_page(room_id, before=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Até `limit` mensagens anteriores ao id `before` (ou as mais recentes),
+    em ordem cronológica, e se ainda há mensagens mais antigas.
+    """
+    _stats["history_pages"] += 1
+    return await state.backend.chat_page(room_id, before, limit)
+
+
+def allow_message(sid) -> bool:
+    """Gasta uma ficha do balde do sid; False se ele está mandando rápido demais."""
+    now = time.monotonic()
+    bucket = _buckets.setdefault(sid, [FLOOD_BURST, now])
+    bucket[0] = min(FLOOD_BURST, bucket[0] + (now - bucket[1]) * FLOOD_RATE)
+    bucket[1] = now
+    if bucket[0] < 1:
+        _stats["rate_limited"] += 1
+        return False
+    bucket[0] -= 1
+    return True
+
+
+def forget_sid(sid):
+    _buckets.pop(sid, None)
+
+
+def count_received():
+    _stats["received"] += 1
+
+
+def count_rejected():
+    _stats["rejected"] += 1
+
+
+def count_broadcast(recipients: int):
+    """Uma mensagem repassada para `recipients` sockets (o custo real do fan-out)."""
+    _stats["broadcast"] += 1
+    _stats["recipients"] += recipients
+
+
+async def chat_stats() -> dict:
+    """
+    Contadores de mensagens e do fan-out deste worker, e o tamanho dos
+    históricos (quando o backend sabe informar sem varrer tudo).
+    """
+    broadcast = _stats["broadcast"] or 1
+    stats = {**_stats, "avg_fanout": round(_stats["recipients"] / broadcast, 2)}
+    usage = await state.backend.chat_usage()
+    if usage is not None:
+        stats.update(rooms=usage["rooms"], history_messages=usage["messages"], history_bytes=usage["bytes"])
+    return stats
@@ -8,13 +8,32 @@ import json
 # Garante que os diretórios existam
 os.makedirs("files", exist_ok=True)
 os.makedirs("cache", exist_ok=True)
+os.makedirs("data", exist_ok=True)
 os.makedirs("videos", exist_ok=True)  # Diretório padrão de vídeos
 
 SAVE_FILE = "save.json"
 CLOUDFLARE_FILE = "cloudflare.json"
-CACHE_DIR = "cache"
+CACHE_DIR = "cache"  # servido em /cache: só conteúdo que pode ser público
+DATA_DIR = "data"    # estado interno (bancos SQLite, locks, checkpoints): nunca servido
 FILES_DIR = "files"
 
+
+def data_path(name: str) -> str:
+    """
+    Caminho de um arquivo de estado interno em DATA_DIR. Versões antigas o
+    guardavam em CACHE_DIR (servido publicamente): se ele ainda estiver lá, é
+    movido junto com os arquivos auxiliares do SQLite (-wal, -shm, -journal).
+    """
+    path = os.path.join(DATA_DIR, name)
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        legacy = os.path.join(CACHE_DIR, name + suffix)
+        if os.path.exists(legacy) and not os.path.exists(path + suffix):
+            try:
+                os.replace(legacy, path + suffix)
+            except OSError:
+                pass  # outro worker já moveu
+    return path
+
 # --- Configurações Gerais (save.json) ---
 config = {"port": 8000, "video_dir": "videos"}
 
@@ -36,6 +55,23 @@ PORT = config["port"]
 VIDEO_DIR = config["video_dir"]
 USE_CLOUDFLARE = config["use_cloudflare"]
 
+# Streaming HLS: "auto" (só contêineres que o navegador não toca, ex. MKV/AVI),
+# "always" (todos os vídeos locais) ou "off"
+HLS_MODE = config.get("hls_mode", "auto")
+HLS_CACHE_MB = config.get("hls_cache_mb", 4096)  # limite do cache de segmentos
+UPLOAD_CACHE_MB = config.get("upload_cache_mb", 512)  # limite das imagens enviadas (avatares e chat)
+SUBTITLE_CACHE_MB = config.get("subtitle_cache_mb", 256)  # limite das legendas convertidas para WebVTT
+AUDIO_CACHE_MB = config.get("audio_cache_mb", 2048)  # limite das trilhas de áudio (dublagens) extraídas
+
+# Vários workers: o estado das salas precisa de um backend compartilhado
+# ("sqlite" ou "redis", em vez de "memory") e o Socket.IO de uma fila de
+# mensagens (ex. "redis://localhost:6379/0") para os eventos chegarem a
+# sockets conectados em outros workers.
+WORKERS = config.get("workers", 1)
+STATE_BACKEND = config.get("state_backend", "memory")
+REDIS_URL = config.get("redis_url", "redis://localhost:6379/0")
+MESSAGE_QUEUE = config.get("message_queue")
+
 if not os.path.isdir(VIDEO_DIR):
     print(f"Aviso: Diretório de vídeos '{VIDEO_DIR}' não encontrado. O servidor pode falhar ao iniciar.")
     # exit(1) # Opcional: Impedir saída abrupta se quiser criar a pasta dinamicamente
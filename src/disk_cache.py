@@ -0,0 +1,170 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+from config import CACHE_DIR, data_path
+
+# --- Cache em Disco com Limite de Tamanho ---
+# Métodos bloqueantes (fazem I/O): chame-os pelo pool 'disk'.
+
+
+def _disk_usage(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+def _remove(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class DiskCache:
+    """
+    Entradas (arquivos ou diretórios) em CACHE_DIR/<name>/<chave>, com remoção
+    das menos usadas recentemente quando o total passa de max_bytes.
+
+    Uma entrada só entra na contagem depois do commit(); enquanto está sendo
+    gerada ela não é candidata à remoção. Com `marker`, entradas que são
+    diretórios só contam como prontas quando o arquivo marker existe dentro
+    delas (o commit o cria), para que outros workers não as vejam pela metade.
+
+    O disco é a fonte da verdade, compartilhada entre os workers: has() confere
+    a entrada no disco, o mtime guarda o último uso (touch) e a remoção reescaneia
+    a pasta sob um lock entre processos, sem apagar entradas usadas há menos de
+    IN_USE_GRACE s (outro worker pode estar servindo-as). O índice em memória só
+    guarda os tamanhos já medidos e a visão da última varredura (stats).
+    """
+
+    IN_USE_GRACE = 120  # s desde o último uso em que uma entrada não é removida
+
+    def __init__(self, name: str, max_bytes: int, marker: str | None = None):
+        self.name = name
+        self.root = os.path.join(CACHE_DIR, name)
+        self.max_bytes = max_bytes
+        self.marker = marker
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # chave -> bytes, do menos ao mais recente (última varredura)
+        self._total = 0
+        os.makedirs(self.root, exist_ok=True)
+        self._rescan()
+
+    def _is_committed(self, path: str) -> bool:
+        if self.marker and os.path.isdir(path):
+            return os.path.isfile(os.path.join(path, self.marker))
+        return os.path.exists(path)
+
+    def _rescan(self) -> list[tuple[float, str]]:
+        """Relê as entradas prontas do disco; retorna [(mtime, chave)] da menos à mais recente."""
+        found = []
+        for key in os.listdir(self.root):
+            if key.startswith("."):
+                continue
+            path = self.path(key)
+            try:
+                if self._is_committed(path):
+                    found.append((os.stat(path).st_mtime, key))
+            except OSError:
+                pass
+        found.sort()
+        with self._lock:
+            known = self._entries
+        sizes = {key: known[key] if key in known else _disk_usage(self.path(key)) for _, key in found}
+        with self._lock:
+            self._entries = OrderedDict((key, sizes[key]) for _, key in found)
+            self._total = sum(sizes.values())
+        return found
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Chave estável (e segura como nome de arquivo) a partir de partes quaisquer."""
+        return hashlib.sha1("\0".join(map(str, parts)).encode("utf-8")).hexdigest()[:24]
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def has(self, key: str) -> bool:
+        """Se a entrada está pronta no disco (de qualquer worker)."""
+        committed = self._is_committed(self.path(key))
+        if not committed:
+            with self._lock:
+                self._total -= self._entries.pop(key, 0)
+        return committed
+
+    def keys(self) -> list[str]:
+        """Todas as entradas no disco, prontas ou ainda sendo geradas."""
+        return [key for key in os.listdir(self.root) if not key.startswith(".")]
+
+    def touch(self, key: str):
+        """Marca a entrada como usada agora."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        try:
+            os.utime(self.path(key))
+        except OSError:
+            pass
+
+    def commit(self, key: str):
+        """Marca uma entrada recém-gerada como pronta e remove as antigas até caber no limite."""
+        path = self.path(key)
+        if self.marker and os.path.isdir(path):
+            open(os.path.join(path, self.marker), "w").close()
+        size = _disk_usage(path)
+        with self._lock:
+            self._total += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            over = self._total > self.max_bytes
+        if over:
+            self._evict(keep=key)
+
+    def _evict(self, keep: str):
+        # Import tardio: este módulo também é importado nos processos do pool 'decode'
+        from server_setup import try_lock_file
+
+        lock = try_lock_file(data_path(f"cache_{self.name}.lock"))
+        if lock is None:
+            return  # outro worker está removendo agora
+        try:
+            now = time.time()
+            evicted = []
+            for mtime, old_key in self._rescan():
+                with self._lock:
+                    if self._total <= self.max_bytes:
+                        break
+                    if old_key == keep or now - mtime < self.IN_USE_GRACE:
+                        continue
+                    self._total -= self._entries.pop(old_key, 0)
+                _remove(self.path(old_key))
+                evicted.append(old_key)
+        finally:
+            lock.close()
+        if evicted:
+            metrics.log_event("cache_evicted", cache=self.name, entries=len(evicted),
+                              bytes=self._total, max_bytes=self.max_bytes)
+
+    def discard(self, key: str):
+        """Remove a entrada (completa ou não) do disco."""
+        with self._lock:
+            self._total -= self._entries.pop(key, 0)
+        _remove(self.path(key))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._total, "max_bytes": self.max_bytes}
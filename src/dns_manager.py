@@ -3,93 +3,88 @@ import logging
 
 import aiohttp
 
+import ip_discovery
 from config import CF_API_TOKEN, CF_ZONE_ID, CF_RECORD_NAME, CF_PROXIED, CF_INTERVAL
 
 # Configuração básica de log para ver o que está acontecendo
 logging.basicConfig(level=logging.INFO, format='[DNS] %(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+BASE_URL = "https://api.cloudflare.com/client/v4"
+_record = None  # {"id", "content"} do registro AAAA, guardado depois da primeira busca
 
-async def get_public_ipv6():
-    """Obtém o endereço IPv6 público atual usando a API do ipify."""
-    try:
-        async with aiohttp.ClientSession() as session:
-            # Usamos api64 para garantir suporte a IPv6
-            async with session.get('https://api64.ipify.org?format=json', timeout=10) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    return data.get('ip')
-                else:
-                    logger.error(f"Erro ao obter IP: Status {resp.status}")
-                    return None
-    except Exception as e:
-        logger.error(f"Falha ao conectar serviço de IP: {e}")
-        return None
-
-
-async def update_cloudflare_record(session, current_ip):
-    """Atualiza o registro AAAA na Cloudflare se o IP tiver mudado."""
 
-    headers = {
+def _headers() -> dict:
+    return {
         "Authorization": f"Bearer {CF_API_TOKEN}",
         "Content-Type": "application/json"
     }
 
-    base_url = "https://api.cloudflare.com/client/v4"
 
-    # 1. Obter o ID do registro DNS atual (precisamos do ID para atualizar)
-    # Procuramos por um registro AAAA (IPv6) com o nome configurado
-    search_url = f"{base_url}/zones/{CF_ZONE_ID}/dns_records?type=AAAA&name={CF_RECORD_NAME}"
+async def _find_record(session):
+    """Busca o registro AAAA com o nome configurado (precisamos do ID para atualizar)."""
+    search_url = f"{BASE_URL}/zones/{CF_ZONE_ID}/dns_records?type=AAAA&name={CF_RECORD_NAME}"
+    async with session.get(search_url, headers=_headers()) as resp:
+        data = await resp.json()
 
-    try:
-        async with session.get(search_url, headers=headers) as resp:
-            data = await resp.json()
-
-            if not data.get('success'):
-                logger.error(f"Erro ao buscar registro DNS: {data.get('errors')}")
-                return
+    if not data.get('success'):
+        logger.error(f"Erro ao buscar registro DNS: {data.get('errors')}")
+        return None
 
-            records = data.get('result', [])
-            if not records:
-                logger.warning(
-                    f"Nenhum registro AAAA encontrado para {CF_RECORD_NAME}. Crie-o manualmente primeiro.")
-                return
+    records = data.get('result', [])
+    if not records:
+        logger.warning(
+            f"Nenhum registro AAAA encontrado para {CF_RECORD_NAME}. Crie-o manualmente primeiro.")
+        return None
+    return {"id": records[0]['id'], "content": records[0]['content']}
 
-            record = records[0]
-            record_id = record['id']
-            existing_ip = record['content']
 
-            # 2. Verificar se precisa atualizar
-            if existing_ip == current_ip:
-                # logger.info("IP não mudou. Nenhuma ação necessária.")
+async def update_cloudflare_record(session, current_ip):
+    """
+    Atualiza o registro AAAA na Cloudflare se o IP tiver mudado. O ID e o
+    conteúdo do registro ficam guardados, então com o IP igual ao último
+    enviado a API nem é chamada.
+    """
+    global _record
+    try:
+        if _record is None:
+            _record = await _find_record(session)
+            if _record is None:
                 return
 
-            logger.info(f"IP mudou de {existing_ip} para {current_ip}. Atualizando Cloudflare...")
-
-            # 3. Atualizar o registro
-            update_url = f"{base_url}/zones/{CF_ZONE_ID}/dns_records/{record_id}"
-            payload = {
-                "type": "AAAA",
-                "name": CF_RECORD_NAME,
-                "content": current_ip,
-                "proxied": CF_PROXIED
-            }
-
-            async with session.put(update_url, headers=headers, json=payload) as update_resp:
-                update_data = await update_resp.json()
-                if update_data.get('success'):
-                    logger.info(f"Sucesso! DNS atualizado para {current_ip}")
-                else:
-                    logger.error(f"Falha ao atualizar DNS: {update_data.get('errors')}")
+        if _record["content"] == current_ip:
+            return
+
+        logger.info(f"IP mudou de {_record['content']} para {current_ip}. Atualizando Cloudflare...")
+
+        update_url = f"{BASE_URL}/zones/{CF_ZONE_ID}/dns_records/{_record['id']}"
+        payload = {
+            "type": "AAAA",
+            "name": CF_RECORD_NAME,
+            "content": current_ip,
+            "proxied": CF_PROXIED
+        }
+
+        async with session.put(update_url, headers=_headers(), json=payload) as update_resp:
+            update_data = await update_resp.json()
+            if update_data.get('success'):
+                _record["content"] = current_ip
+                logger.info(f"Sucesso! DNS atualizado para {current_ip}")
+            else:
+                # O registro pode ter sido apagado ou recriado: busca o ID de novo na próxima vez
+                _record = None
+                logger.error(f"Falha ao atualizar DNS: {update_data.get('errors')}")
 
     except Exception as e:
+        _record = None
         logger.error(f"Erro na comunicação com a Cloudflare: {e}")
 
 
 async def start_dns_updater():
     """
-    Função principal loop que verifica e atualiza o DNS periodicamente.
-    Deve ser iniciada como uma Task no asyncio.
+    Loop que mantém o registro AAAA igual ao IPv6 descoberto por ip_discovery.
+    Acorda quando o IPv6 muda, e a cada CF_INTERVAL para repetir uma
+    atualização que falhou. Deve ser iniciada como uma Task no asyncio.
     """
     if not CF_API_TOKEN or not CF_ZONE_ID:
         logger.warning("Configurações da Cloudflare incompletas. O atualizador de DNS não será iniciado.")
@@ -97,15 +92,20 @@ async def start_dns_updater():
 
     logger.info(f"Iniciando monitoramento de DNS para {CF_RECORD_NAME} (Intervalo: {CF_INTERVAL}s)")
 
+    changed = asyncio.Event()
+    ip_discovery.add_listener(lambda family, old, new: family == "ipv6" and changed.set())
+    await ip_discovery.wait_ready(timeout=None)
+
     async with aiohttp.ClientSession() as session:
         while True:
-            current_ipv6 = await get_public_ipv6()
-
+            changed.clear()
+            current_ipv6 = ip_discovery.get_addresses()["ipv6"]
             if current_ipv6:
-                # Verifica se é um IPv6 válido (simples verificação de :)
-                if ":" in current_ipv6:
-                    await update_cloudflare_record(session, current_ipv6)
-                else:
-                    logger.warning(f"IP obtido não parece ser IPv6: {current_ipv6}")
-
-            await asyncio.sleep(CF_INTERVAL)
\ No newline at end of file
+                await update_cloudflare_record(session, current_ipv6)
+            else:
+                logger.warning("Nenhum IPv6 público encontrado. O DNS não será atualizado.")
+
+            try:
+                await asyncio.wait_for(changed.wait(), CF_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
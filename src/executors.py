@@ -0,0 +1,139 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+
+import metrics
+
+# --- Executores para Trabalho Bloqueante ---
+# Rotas async não podem chamar código bloqueante direto: enquanto ele roda, todo o
+# tráfego do Socket.IO congela. Cada tipo de trabalho tem seu próprio pool limitado:
+#   network -> requisições HTTP síncronas
+#   disk    -> leitura/escrita de arquivos e varredura de pastas
+#   state   -> operações do backend de estado das salas (SQLite), que ficam na
+#              frente de cada evento do Socket.IO e não podem esperar atrás de
+#              varreduras de pastas no pool 'disk'
+#   probe   -> execuções do ffprobe (media_probe); o número de workers é o limite
+#              de ffprobe simultâneos no processo
+#   decode  -> decodificação de vídeo/imagem (CPU), em processos separados
+
+POOLS = {
+    "network": {"kind": "thread", "workers": 8},
+    "disk": {"kind": "thread", "workers": 4},
+    "state": {"kind": "thread", "workers": 2},
+    "probe": {"kind": "thread", "workers": 2},
+    "decode": {"kind": "process", "workers": max(1, (os.cpu_count() or 2) - 1)},
+}
+
+# Quantas tarefas por worker podem esperar na fila antes de quem chama ter que aguardar
+QUEUE_FACTOR = 4
+
+_executors = {}
+_slots = {}
+_stats = {
+    name: {"in_flight": 0, "completed": 0, "failed": 0,
+           "wait_seconds": 0.0, "run_seconds": 0.0, "max_latency": 0.0}
+    for name in POOLS
+}
+
+
+QUEUE_DEPTH = metrics.Gauge("watchparty_executor_queue_depth", "Tarefas esperando um worker livre, por pool.",
+                            ("pool",))
+IN_FLIGHT = metrics.Gauge("watchparty_executor_in_flight", "Tarefas na fila ou rodando, por pool.", ("pool",))
+TASK_SECONDS = metrics.Histogram("watchparty_executor_task_seconds",
+                                 "Tempo de cada tarefa do pool, da submissão ao resultado.", ("pool",))
+TASK_FAILURES = metrics.Counter("watchparty_executor_failures_total", "Tarefas que levantaram exceção, por pool.",
+                                ("pool",))
+
+
+def _collect():
+    for name, stats in _stats.items():
+        IN_FLIGHT.set(stats["in_flight"], name)
+        QUEUE_DEPTH.set(max(0, stats["in_flight"] - POOLS[name]["workers"]), name)
+
+
+metrics.add_collector(_collect)
+
+
+def _get_executor(pool: str):
+    if pool not in _executors:
+        spec = POOLS[pool]
+        if spec["kind"] == "process":
+            # spawn (o padrão no Windows) em todo lugar: com fork os processos herdariam o
+            # socket do servidor e os handlers de sinal do uvicorn, e continuariam
+            # segurando a porta se sobrevivessem ao servidor
+            _executors[pool] = ProcessPoolExecutor(max_workers=spec["workers"],
+                                                   mp_context=multiprocessing.get_context("spawn"))
+        else:
+            _executors[pool] = ThreadPoolExecutor(max_workers=spec["workers"], thread_name_prefix=f"wp-{pool}")
+    return _executors[pool]
+
+
+def _get_slots(pool: str) -> asyncio.Semaphore:
+    if pool not in _slots:
+        _slots[pool] = asyncio.Semaphore(POOLS[pool]["workers"] * QUEUE_FACTOR)
+    return _slots[pool]
+
+
+def _timed_call(func, args, kwargs):
+    # Roda no worker: devolve o instante de início para medir o tempo de fila
+    started_at = time.time()
+    return started_at, func(*args, **kwargs)
+
+
+async def run_in(pool: str, func, *args, **kwargs):
+    """
+    Executa func(*args, **kwargs) no pool indicado ('network', 'disk', 'state', 'probe' ou 'decode')
+    e aguarda o resultado sem bloquear o event loop.
+    No pool 'decode' func e argumentos precisam ser serializáveis (pickle).
+    """
+    stats = _stats[pool]
+    submitted_at = time.time()
+    stats["in_flight"] += 1
+    try:
+        async with _get_slots(pool):
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(_get_executor(pool), partial(_timed_call, func, args, kwargs))
+            try:
+                started_at, result = await future
+            except BaseException:
+                stats["failed"] += 1
+                TASK_FAILURES.inc(pool)
+                raise
+    finally:
+        stats["in_flight"] -= 1
+
+    finished_at = time.time()
+    stats["completed"] += 1
+    stats["wait_seconds"] += max(0.0, started_at - submitted_at)
+    stats["run_seconds"] += finished_at - started_at
+    stats["max_latency"] = max(stats["max_latency"], finished_at - submitted_at)
+    TASK_SECONDS.observe(finished_at - submitted_at, pool)
+    return result
+
+
+def executor_stats() -> dict:
+    """Profundidade de fila e latências acumuladas de cada pool."""
+    report = {}
+    for name, stats in _stats.items():
+        done = stats["completed"] or 1
+        report[name] = {
+            "workers": POOLS[name]["workers"],
+            "in_flight": stats["in_flight"],
+            # Tarefas além da quantidade de workers estão esperando na fila
+            "queue_depth": max(0, stats["in_flight"] - POOLS[name]["workers"]),
+            "completed": stats["completed"],
+            "failed": stats["failed"],
+            "avg_wait_ms": round(stats["wait_seconds"] / done * 1000, 2),
+            "avg_run_ms": round(stats["run_seconds"] / done * 1000, 2),
+            "max_latency_ms": round(stats["max_latency"] * 1000, 2),
+        }
+    return report
+
+
+def shutdown():
+    for executor in _executors.values():
+        executor.shutdown(wait=False, cancel_futures=True)
+    _executors.clear()
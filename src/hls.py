@@ -0,0 +1,308 @@
+import asyncio
+import logging
+import os
+import re
+import subprocess
+import time
+
+import library_index
+import media_probe
+import metrics
+from config import VIDEO_DIR, HLS_MODE, HLS_CACHE_MB, data_path
+from disk_cache import DiskCache
+from executors import run_in
+from server_setup import try_lock_file
+from thumbnails import FFMPEG
+
+# --- Streaming HLS sob Demanda ---
+# No primeiro pedido da playlist o vídeo é segmentado pelo ffmpeg em segundo
+# plano, copiando os codecs quando o navegador os suporta (remux, bem mais
+# rápido que o tempo real) e transcodificando só quando necessário. A playlist
+# é do tipo "event": o cliente começa a tocar assim que o primeiro segmento fica
+# pronto. Os segmentos ficam num DiskCache com limite de tamanho (LRU).
+# Com vários workers, cada chave tem um lock de arquivo: só o worker que o
+# segura roda o ffmpeg e pode apagar a pasta; os outros esperam pela playlist.
+
+PLAYLIST_NAME = "index.m3u8"
+SEGMENT_SECONDS = 6
+MAX_JOBS = 2                 # segmentações simultâneas
+PLAYLIST_WAIT_TIMEOUT = 30   # s esperando o primeiro segmento
+INCOMPLETE_GRACE = 120       # s sem novos segmentos até uma segmentação incompleta ser considerada interrompida
+COMPLETE_MARKER = ".complete"
+FAILED_MARKER = ".failed"    # a última segmentação da pasta falhou: pode ser refeita
+LOCK_DIR = data_path("hls_locks")
+SEGMENT_NAME = re.compile(r"^seg_\d{5}\.ts$")
+
+# Contêineres que o navegador toca direto pelo /video
+NATIVE_EXTENSIONS = {".mp4", ".m4v", ".webm", ".mov"}
+# Codecs que podem ir para os segmentos sem transcodificar
+COPY_VIDEO_CODECS = {"h264"}
+COPY_AUDIO_CODECS = {"aac", "mp3"}
+# Codecs que os navegadores decodificam num arquivo tocado direto
+BROWSER_VIDEO_CODECS = {"h264", "vp8", "vp9", "av1"}
+BROWSER_AUDIO_CODECS = {"aac", "mp3", "opus", "vorbis", "flac"}
+
+cache = DiskCache("hls", HLS_CACHE_MB * 1024 * 1024, marker=COMPLETE_MARKER)
+_jobs = {}          # chave do cache -> asyncio.Task
+_processes = set()  # ffmpeg em execução (encerrados no shutdown)
+_job_slots = asyncio.Semaphore(MAX_JOBS)
+
+
+def discard_incomplete():
+    """
+    Remove as segmentações interrompidas (ex. por um restart), que não são
+    aproveitadas. Roda uma vez no startup, só no worker com o lock de singleton;
+    pastas alteradas há menos de INCOMPLETE_GRACE s ainda têm um ffmpeg
+    escrevendo (de um worker que não reiniciou) e ficam. Bloqueante: pool 'disk'.
+    """
+    for key in cache.keys():
+        out_dir = cache.path(key)
+        if _is_complete(out_dir) or _recently_written(out_dir):
+            continue
+        claim = _claim(key)
+        if claim is None:
+            continue  # outro worker está segmentando
+        try:
+            cache.discard(key)
+        finally:
+            claim.close()
+
+
+def wants_hls(rel_video: str) -> bool:
+    """Se o vídeo deve ser entregue por HLS em vez do arquivo inteiro."""
+    if HLS_MODE == "off" or not FFMPEG or not rel_video or rel_video.startswith("http") or rel_video == "screen-share":
+        return False
+    return HLS_MODE == "always" or os.path.splitext(rel_video)[1].lower() not in NATIVE_EXTENSIONS
+
+
+def stream_url(rel_video: str) -> str | None:
+    """URL da playlist HLS do vídeo, ou None se ele deve ser tocado direto."""
+    return f"/hls/{rel_video}/{PLAYLIST_NAME}".replace("\\", "/") if wants_hls(rel_video) else None
+
+
+async def _probe_codecs(source: str) -> tuple[str | None, str | None]:
+    """Codecs da primeira trilha de vídeo e de áudio (do cache do media_probe)."""
+    info = await media_probe.probe_path(source)
+    return (info["video_codec"], info["audio_codec"]) if info else (None, None)
+
+
+def playback_mode(rel_video: str, info: dict | None) -> str | None:
+    """
+    Como o vídeo chega ao navegador: "direct" (o arquivo pelo /video), "remux"
+    (HLS copiando o vídeo, rápido), "transcode" (HLS recodificando, mais lento
+    que o tempo real em muitas máquinas) ou "unsupported". None se os codecs
+    ainda não são conhecidos.
+    """
+    if info is None:
+        return None
+    video_codec, audio_codec = info["video_codec"], info["audio_codec"]
+    if wants_hls(rel_video):
+        return "remux" if video_codec in COPY_VIDEO_CODECS else "transcode"
+    ten_bit = "10" in (info.get("pix_fmt") or "")
+    if video_codec in BROWSER_VIDEO_CODECS and not (video_codec == "h264" and ten_bit) \
+            and (audio_codec is None or audio_codec in BROWSER_AUDIO_CODECS):
+        return "direct"
+    return "unsupported"
+
+
+def _codec_args(video_codec: str | None, audio_codec: str | None, transcode: bool) -> list[str]:
+    args = ['-map', '0:v:0', '-map', '0:a:0?', '-sn']
+    if not transcode and video_codec in COPY_VIDEO_CODECS:
+        args += ['-c:v', 'copy']
+    else:
+        # Keyframes alinhados aos segmentos para que o seek caia sempre no início de um
+        args += ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '21', '-pix_fmt', 'yuv420p',
+                 '-force_key_frames', f"expr:gte(t,n_forced*{SEGMENT_SECONDS})"]
+    if not transcode and audio_codec in COPY_AUDIO_CODECS:
+        args += ['-c:a', 'copy']
+    else:
+        args += ['-c:a', 'aac', '-b:a', '192k', '-ac', '2']
+    return args
+
+
+def _reset_dir(out_dir: str):
+    if os.path.isdir(out_dir):
+        for filename in os.listdir(out_dir):
+            os.remove(os.path.join(out_dir, filename))
+    os.makedirs(out_dir, exist_ok=True)
+
+
+def _is_complete(out_dir: str) -> bool:
+    return os.path.exists(os.path.join(out_dir, COMPLETE_MARKER))
+
+
+def _has_failed(out_dir: str) -> bool:
+    return os.path.exists(os.path.join(out_dir, FAILED_MARKER))
+
+
+def _mark_failed(out_dir: str):
+    open(os.path.join(out_dir, FAILED_MARKER), "w").close()
+
+
+def _recently_written(out_dir: str) -> bool:
+    """Se a pasta mudou há menos de INCOMPLETE_GRACE s (um ffmpeg pode estar escrevendo nela)."""
+    try:
+        return time.time() - os.path.getmtime(out_dir) < INCOMPLETE_GRACE
+    except OSError:
+        return False
+
+
+def _claim(key: str):
+    """
+    Lock entre os workers da segmentação de uma chave (ver try_lock_file): o
+    arquivo aberto, ou None se outro worker o segura. Bloqueante: pool 'disk'.
+    """
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    return try_lock_file(os.path.join(LOCK_DIR, f"{key}.lock"))
+
+
+def _can_start(out_dir: str) -> bool:
+    """
+    Com o lock na mão: se a pasta pode ser apagada e refeita. Não se já está
+    completa (outro worker terminou antes do lock) nem se ainda está sendo
+    escrita sem ter falhado (ex. um ffmpeg de um worker que caiu).
+    """
+    if _is_complete(out_dir):
+        return False
+    return _has_failed(out_dir) or not _recently_written(out_dir)
+
+
+def _playlist_ready(out_dir: str) -> bool | None:
+    """True se a playlist existe, False se a segmentação da pasta falhou, None se ainda não há playlist."""
+    if _has_failed(out_dir):
+        return False
+    return True if os.path.exists(os.path.join(out_dir, PLAYLIST_NAME)) else None
+
+
+async def _run_ffmpeg(source: str, out_dir: str, codec_args: list[str]) -> bool:
+    command = [
+        FFMPEG, '-v', 'error', '-nostdin', '-y', '-i', source, *codec_args,
+        '-f', 'hls', '-hls_time', str(SEGMENT_SECONDS), '-hls_playlist_type', 'event',
+        '-hls_segment_filename', os.path.join(out_dir, 'seg_%05d.ts'),
+        os.path.join(out_dir, PLAYLIST_NAME)
+    ]
+    # Popen + poll em vez de asyncio.create_subprocess_exec: funciona com qualquer
+    # event loop (inclusive o SelectorEventLoop no Windows) sem prender uma thread.
+    with open(os.path.join(out_dir, "ffmpeg.log"), "wb") as log:
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=log)
+    _processes.add(process)
+    try:
+        while process.poll() is None:
+            await asyncio.sleep(0.5)
+    finally:
+        if process.poll() is None:
+            process.kill()
+        _processes.discard(process)
+    return process.returncode == 0
+
+
+async def _generate(key: str, rel_video: str, source: str, claim):
+    """
+    Segmenta o vídeo em cache.path(key), já esvaziada por quem pegou o lock da
+    chave (claim), que é liberado no fim.
+    """
+    out_dir = cache.path(key)
+    try:
+        async with _job_slots:
+            started = time.monotonic()
+            video_codec, audio_codec = await _probe_codecs(source)
+            attempts = [False, True] if video_codec in COPY_VIDEO_CODECS else [True]
+            for transcode in attempts:
+                metrics.log_event("hls_started", video=rel_video, mode="transcode" if transcode else "copy")
+                if await _run_ffmpeg(source, out_dir, _codec_args(video_codec, audio_codec, transcode)):
+                    await run_in("disk", cache.commit, key)
+                    metrics.log_event("hls_ready", video=rel_video, seconds=round(time.monotonic() - started, 1))
+                    return True
+                await run_in("disk", _reset_dir, out_dir)
+            await run_in("disk", _mark_failed, out_dir)
+            metrics.log_event("hls_failed", level=logging.WARNING, video=rel_video,
+                              ffmpeg_log=os.path.join(out_dir, "ffmpeg.log"))
+            return False
+    except Exception as e:
+        metrics.log_event("hls_failed", level=logging.ERROR, video=rel_video, error=repr(e))
+        try:
+            await run_in("disk", _mark_failed, out_dir)
+        except OSError:
+            pass
+        return False
+    finally:
+        claim.close()
+        _jobs.pop(key, None)
+
+
+def _source_key(rel_video: str) -> tuple[str, str] | None:
+    source = os.path.abspath(os.path.join(VIDEO_DIR, rel_video))
+    if not library_index.inside_video_dir(source) or not os.path.isfile(source):
+        return None
+    stat_result = os.stat(source)
+    return source, DiskCache.make_key(rel_video, stat_result.st_size, stat_result.st_mtime_ns)
+
+
+async def prepare_playlist(rel_video: str) -> str | None:
+    """
+    Caminho da playlist HLS do vídeo, iniciando a segmentação se preciso e
+    esperando até que o primeiro segmento esteja disponível. Se outro worker
+    já está segmentando o vídeo, só espera pela playlist dele.
+    """
+    if not FFMPEG:
+        return None
+    found = await run_in("disk", _source_key, rel_video)
+    if found is None:
+        return None
+    source, key = found
+    out_dir = cache.path(key)
+    playlist = os.path.join(out_dir, PLAYLIST_NAME)
+
+    if key not in _jobs and await run_in("disk", _is_complete, out_dir):
+        await run_in("disk", cache.touch, key)
+        return playlist
+    if key not in _jobs:
+        claim = await run_in("disk", _claim, key)
+        if claim is not None:
+            try:
+                # Esvazia a pasta antes de esperar por ela: uma playlist velha não pode ser servida
+                started = await run_in("disk", _can_start, out_dir)
+                if started:
+                    await run_in("disk", _reset_dir, out_dir)
+            except BaseException:
+                claim.close()
+                raise
+            if started:
+                _jobs[key] = asyncio.create_task(_generate(key, rel_video, source, claim))
+            else:
+                claim.close()
+
+    task = _jobs.get(key)
+    deadline = time.monotonic() + PLAYLIST_WAIT_TIMEOUT
+    while True:
+        finished = task is not None and task.done()
+        ready = await run_in("disk", _playlist_ready, out_dir)
+        if ready is not None:
+            return playlist if ready else None
+        if finished or time.monotonic() > deadline:
+            return None
+        await asyncio.sleep(0.2)
+
+
+async def find_segment(rel_video: str, segment_name: str) -> str | None:
+    """Caminho de um segmento já gerado do vídeo."""
+    if not SEGMENT_NAME.match(segment_name):
+        return None
+    found = await run_in("disk", _source_key, rel_video)
+    if found is None:
+        return None
+    _, key = found
+    path = os.path.join(cache.path(key), segment_name)
+    if not await run_in("disk", os.path.isfile, path):
+        return None
+    if key not in _jobs:
+        await run_in("disk", cache.touch, key)
+    return path
+
+
+def stop_all():
+    """Encerra as segmentações em andamento (chamado no shutdown)."""
+    for task in list(_jobs.values()):
+        task.cancel()
+    for process in list(_processes):
+        process.kill()
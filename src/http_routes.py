@@ -1,194 +1,327 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
 import os
+import stat
 import mimetypes
 import fastapi
-import hashlib
-import cv2
-import random
-import requests
-from bs4 import BeautifulSoup
-from imdb import Cinemagoer
 from fastapi.staticfiles import StaticFiles
-from starlette.responses import FileResponse, JSONResponse
-from starlette.requests import Request
-from config import FILES_DIR, CACHE_DIR, VIDEO_DIR, PORT
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from config import CACHE_DIR, VIDEO_DIR, PORT
+import audio_tracks
+import banner_job
+import chat_history
+import hls
+import imdb_metadata
+import ip_discovery
+import library_index
+import media_probe
+import metrics
+import search_index
+import static_assets
+import subtitles as subtitle_tracks
+import uploads
+from executors import run_in, executor_stats
 from server_setup import app
-from utils import get_public_ip
-
-def _get_high_res_imdb_url(url: str) -> str:
-    """
-    Converte uma URL de thumbnail do IMDb para sua versão de alta resolução.
-    Ex: https://.../MV5BM...@@._V1_..._.jpg -> https://.../MV5BM...@@.jpg
-    """
-    if url and "@@" in url:
-        base_url = url.split("@@")[0]
-        return base_url + "@@._V1_.jpg"
-    return url
-
-def _fetch_imdb_poster_url(title: str) -> str | None:
-    """
-    Busca um título no IMDb, faz scraping da página do resultado principal
-    e retorna a URL do pôster em alta resolução.
-    """
-    print(f"Buscando imagem no IMDb para '{title}'...")
-    ia = Cinemagoer()
-    movies = ia.search_movie(title)
-
-    if not movies:
-        print(f"Nenhum resultado encontrado no IMDb para '{title}'.")
-        return None
-
-    first_result_id = movies[0].movieID
-    movie_page_url = f"https://www.imdb.com/title/tt{first_result_id}/"
-
-    headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"}
-    response = requests.get(movie_page_url, headers=headers)
-    response.raise_for_status()
-
-    soup = BeautifulSoup(response.text, 'html.parser')
-    image_tag = soup.select_one('div[data-testid="hero-media__poster"] img')
-    if image_tag:
-        # Prioriza o srcset para obter a melhor resolução
-        if image_tag.get('srcset'):
-            srcset = image_tag['srcset']
-            # url1 1000w, url2 1500w, ...
-            sources = [s.strip() for s in srcset.split(',')]
-
-            valid_sources = []
-            link: str = ""
-            size: int = 0
-
-            for name in sources:
-                if name.startswith("https://"):
-                    link = name
-                    continue
-                elif name.endswith("w"):
-                    size = int(name[name.find(" "):-1])
-                    valid_sources.append((link, size))
-
-            best_source_url = max(valid_sources, key=lambda item: item[1])[0]
-            return _get_high_res_imdb_url(best_source_url)
-
-        if image_tag.get('src'):
-            return _get_high_res_imdb_url(image_tag['src'])
-    return None
+from streaming import GrowingFileResponse, RangeFileResponse
+from thumbnails import find_video_banner, seek_preview_vtt_name
+from state import normalize_room_id, DEFAULT_ROOM
 
 
 # 1. Servir páginas principais
 @app.get("/")
-async def get_index():
-    return FileResponse(os.path.join(FILES_DIR, "index.html"))
+async def get_index(request: fastapi.Request):
+    return static_assets.asset_response(request, "index.html")
 
 
 @app.get("/party")
-async def get_party():
-    return FileResponse(os.path.join(FILES_DIR, "party.html"))
+async def get_party(request: fastapi.Request):
+    return static_assets.asset_response(request, "party.html")
 
 
 @app.get("/host")
-async def get_host_page():
-    return FileResponse(os.path.join(FILES_DIR, "host.html"))
+async def get_host_page(request: fastapi.Request):
+    return static_assets.asset_response(request, "host.html")
 
 
 # 3. Endpoint de Streaming de Vídeo
-@app.get("/video/{video_path:path}")
-async def stream_video(video_path: str, request: Request):
+# Vídeos e arquivos auxiliares (banners, legendas, dublagens) passam pelo mesmo
+# caminho de streaming com suporte a Range, em vez de um StaticFiles separado.
+@app.api_route("/video/{video_path:path}", methods=["GET", "HEAD"])
+@app.api_route("/videos/{video_path:path}", methods=["GET", "HEAD"])
+async def stream_video(video_path: str):
     # Sanitize and validate path to prevent directory traversal
     full_video_path = os.path.abspath(os.path.join(VIDEO_DIR, video_path))
-    if not full_video_path.startswith(os.path.abspath(VIDEO_DIR)):
+    if not library_index.inside_video_dir(full_video_path):
         return JSONResponse(status_code=403, content={"message": "Acesso negado"})
 
-    if not os.path.exists(full_video_path):
+    try:
+        stat_result = os.stat(full_video_path)
+    except (FileNotFoundError, NotADirectoryError):
+        return JSONResponse(status_code=404, content={"message": "Video não encontrado"})
+    if not stat.S_ISREG(stat_result.st_mode):
         return JSONResponse(status_code=404, content={"message": "Video não encontrado"})
 
     media_type, _ = mimetypes.guess_type(full_video_path)
-    return FileResponse(
-        full_video_path,
-        media_type=media_type or "video/mp4",
-        headers={"Accept-Ranges": "bytes"}
-    )
+    return RangeFileResponse(full_video_path, stat_result, media_type=media_type or "video/mp4")
+
+
+# Streaming HLS: /hls/<vídeo>/index.m3u8 e /hls/<vídeo>/seg_00000.ts
+@app.api_route("/hls/{video_path:path}", methods=["GET", "HEAD"])
+async def stream_hls(video_path: str):
+    rel_video, _, filename = video_path.rpartition("/")
+    if filename == hls.PLAYLIST_NAME:
+        playlist = await hls.prepare_playlist(rel_video)
+        if playlist is None:
+            return JSONResponse(status_code=404, content={"message": "Video não encontrado"})
+        # A playlist cresce enquanto a segmentação não termina
+        return FileResponse(playlist, media_type="application/vnd.apple.mpegurl", headers={"Cache-Control": "no-cache"})
+
+    segment = await hls.find_segment(rel_video, filename)
+    if segment is None:
+        return JSONResponse(status_code=404, content={"message": "Segmento não encontrado"})
+    stat_result = await run_in("disk", os.stat, segment)
+    return RangeFileResponse(segment, stat_result, media_type="video/mp2t", route="hls")
 
 
 # 4. Endpoints de API
 
 @app.post("/api/upload_image")
-async def upload_image(file: fastapi.UploadFile):
-    contents = await file.read()
+async def upload_image(request: fastapi.Request, kind: str = "chat"):
+    # kind: "avatar" (quadrado, tamanhos pequenos) ou "chat"
+    if kind not in uploads.KINDS:
+        return JSONResponse(status_code=400, content={"message": "Tipo de imagem inválido"})
+    # Recusa antes de receber o corpo quando o tamanho declarado já passa do limite
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > uploads.MAX_UPLOAD_BYTES + uploads.MULTIPART_OVERHEAD:
+        return JSONResponse(status_code=413, content={"message": "Imagem grande demais"})
+
+    # O corpo é lido em streaming (sem request.form()): o limite vale também sem Content-Length
+    try:
+        image = await uploads.store_image(request.stream(), request.headers.get("content-type", ""), kind)
+    except uploads.UploadTooLarge:
+        return JSONResponse(status_code=413, content={"message": "Imagem grande demais"})
+    except uploads.InvalidUpload:
+        return JSONResponse(status_code=400, content={"message": "Nenhum arquivo enviado"})
+    if image is None:
+        return JSONResponse(status_code=415, content={"message": "Formato de imagem não suportado"})
+    return image
 
-    file_hash = hashlib.sha256(contents).hexdigest()
-    _, ext = os.path.splitext(file.filename or "")
 
-    hashed_filename = f"{file_hash}{ext}"
-    dest_path = os.path.join(CACHE_DIR, hashed_filename)
+@app.get("/uploads/{key}/{name}")
+async def get_uploaded_image(key: str, name: str):
+    path = await uploads.find_variant(key, name)
+    if path is None:
+        return JSONResponse(status_code=404, content={"message": "Imagem não encontrada"})
+    # A chave vem do conteúdo: a mesma URL nunca muda de imagem
+    return FileResponse(path, media_type="image/webp",
+                        headers={"Cache-Control": "public, max-age=31536000, immutable"})
 
-    os.makedirs(CACHE_DIR, exist_ok=True)
-    
-    if not os.path.exists(dest_path):
-        with open(dest_path, "wb") as buffer:
-            buffer.write(contents)
-        print(f"Imagem salva em {dest_path}")
-        
-    return {"url": f"/{CACHE_DIR}/{hashed_filename}"}
 
+def _relative_to_video_dir(full_path: str) -> str:
+    rel = os.path.relpath(full_path, os.path.abspath(VIDEO_DIR))
+    return "" if rel == "." else rel
 
-@app.get("/api/get_videos")
-async def list_videos(path: str = ""):
-    # Sanitize and validate path
-    current_path = os.path.abspath(os.path.join(VIDEO_DIR, path))
-    if not current_path.startswith(os.path.abspath(VIDEO_DIR)) or not os.path.isdir(current_path):
-        return JSONResponse(status_code=404, content={"message": "Caminho não encontrado"})
 
+def _preview_url(rel_dir: str, filename: str) -> str:
+    return os.path.join("/videos", rel_dir, ".previews", filename).replace("\\", "/")
+
+
+LISTING_SORT_KEYS = ("name", "mtime", "size", "duration")
+NDJSON_CHUNK_ITEMS = 100  # itens por bloco no modo NDJSON
+DURATION_SORT_WAIT = 2.0  # s que a ordenação por duração espera pelos probes que faltam
+
+
+def _encode_cursor(item: dict, position: int) -> str:
+    data = json.dumps({"type": item["type"], "name": item["name"], "pos": position}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> dict | None:
     try:
-        items = []
-        # Ignora arquivos/pastas que começam com '.'
-        dir_items = [item for item in os.listdir(current_path) if not item.startswith('.')]
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return data if isinstance(data.get("pos"), int) and data["pos"] >= 0 else None
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+def _cursor_start(items: list[dict], cursor: dict) -> int:
+    # Continua logo depois do último item entregue, mesmo que itens tenham entrado
+    # ou saído antes dele; se ele sumiu, usa a posição em que estava
+    for i, item in enumerate(items):
+        if item["name"] == cursor.get("name") and item["type"] == cursor.get("type"):
+            return i + 1
+    return min(cursor["pos"], len(items))
 
-        for item_name in sorted(dir_items):
-            item_path = os.path.join(current_path, item_name)
-            relative_item_path = os.path.join(path, item_name)
 
-            if os.path.isdir(item_path):
-                items.append({"name": item_name, "type": "folder", "path": relative_item_path})
-            elif item_name.lower().endswith((".mp4", ".mkv", ".webm", ".avi")):
-                items.append({"name": item_name, "type": "video", "path": relative_item_path})
+def _sort_items(folders: list[dict], videos: list[dict], sort: str, descending: bool) -> list[dict]:
+    """Pastas primeiro (por nome), depois os vídeos pela chave pedida; sem o valor, vão para o fim."""
+    folders = sorted(folders, key=lambda item: item["name"], reverse=descending and sort == "name")
+    if sort == "name":
+        return folders + sorted(videos, key=lambda item: item["name"], reverse=descending)
+    known = [item for item in videos if item.get(sort) is not None]
+    unknown = [item for item in videos if item.get(sort) is None]
+    known.sort(key=lambda item: (item[sort], item["name"]), reverse=descending)
+    unknown.sort(key=lambda item: item["name"])
+    return folders + known + unknown
 
-        return {"items": items}
-    except FileNotFoundError:
-        return JSONResponse(status_code=500, content={"message": f"Diretório de vídeo não encontrado: {VIDEO_DIR}"})
+
+async def _media_summaries(rel_dir: str, entry: dict, wait: bool) -> dict:
+    """
+    {nome: duração, codecs, resolução e se toca sem travar} dos vídeos da pasta,
+    do cache do media_probe. Os que faltam são lidos em segundo plano e aparecem
+    nas próximas listagens; com wait=True (ordenar por duração) a resposta espera
+    por eles no máximo DURATION_SORT_WAIT, e os que não chegarem a tempo vão para
+    o fim da lista.
+    """
+    rel_videos = {video["name"]: os.path.join(rel_dir, video["name"]) for video in entry["videos"]}
+    full_paths = {name: os.path.abspath(os.path.join(VIDEO_DIR, rel_video)) for name, rel_video in rel_videos.items()}
+    infos = await run_in("disk", media_probe.cached_many, list(full_paths.values()))
+    missing = [name for name, full_path in full_paths.items() if full_path not in infos]
+    if missing:
+        tasks = media_probe.schedule([rel_videos[name] for name in missing])
+        if wait and tasks:
+            # Os probes continuam em segundo plano depois do prazo
+            done, _ = await asyncio.wait(tasks.values(), timeout=DURATION_SORT_WAIT)
+            infos.update((path, task.result()) for path, task in tasks.items()
+                         if task in done and not task.cancelled() and task.exception() is None and task.result())
+
+    summaries = {}
+    for name, rel_video in rel_videos.items():
+        info = infos.get(full_paths[name])
+        mode = hls.playback_mode(rel_video, info)
+        summaries[name] = {
+            "duration": info["duration"] if info else None,
+            "video_codec": info["video_codec"] if info else None,
+            "audio_codec": info["audio_codec"] if info else None,
+            "width": info["width"] if info else None,
+            "height": info["height"] if info else None,
+            "bit_rate": info["bit_rate"] if info else None,
+            "playback": mode,
+            "playable": mode in ("direct", "remux") if mode else None,
+        }
+    return summaries
+
+
+def _listing_etag(entry: dict, metadata: dict, media: dict, *params) -> str:
+    digest = hashlib.sha1(json.dumps(
+        [entry["folders"], entry["videos"], entry["sidecars"][".previews"], metadata, media, params],
+        sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+    return f'W/"{digest[:32]}"'
+
+
+def _ndjson_listing(items: list[dict], trailer: dict):
+    """Uma linha JSON por item, em blocos, e por fim {"type": "end", total, next_cursor}."""
+    for i in range(0, len(items), NDJSON_CHUNK_ITEMS):
+        yield "".join(json.dumps(item) + "\n" for item in items[i:i + NDJSON_CHUNK_ITEMS])
+    yield json.dumps({"type": "end", **trailer}) + "\n"
+
+
+@app.get("/api/get_videos")
+async def list_videos(request: fastapi.Request, path: str = "", sort: str = "name", order: str = "asc",
+                      limit: int | None = None, cursor: str | None = None, format: str = "json"):
+    """
+    Conteúdo de uma pasta, pastas primeiro. `sort` (name, mtime, size, duration) e
+    `order` (asc, desc) ordenam os vídeos; com `limit`, a resposta traz uma página
+    e o `next_cursor` da seguinte. Com format=ndjson (ou Accept:
+    application/x-ndjson) os itens saem um por linha, para a interface ir
+    desenhando enquanto recebe. Respostas têm ETag: uma pasta que não mudou
+    responde 304. Os vídeos trazem duração, codecs e `playable` (ver
+    _media_summaries) assim que o ffprobe os lê.
+    """
+    # Sanitize and validate path
+    current_path = os.path.abspath(os.path.join(VIDEO_DIR, path))
+    if not library_index.inside_video_dir(current_path):
+        return JSONResponse(status_code=404, content={"message": "Caminho não encontrado"})
+    if sort not in LISTING_SORT_KEYS or order not in ("asc", "desc") or (limit is not None and limit < 1):
+        return JSONResponse(status_code=400, content={"message": "Parâmetros de listagem inválidos"})
+    position = _decode_cursor(cursor) if cursor else None
+    if cursor and position is None:
+        return JSONResponse(status_code=400, content={"message": "Cursor inválido"})
+    ndjson = format == "ndjson" or "application/x-ndjson" in request.headers.get("accept", "")
+
+    entry = await run_in("disk", library_index.get_dir, _relative_to_video_dir(current_path))
+    if entry is None:
+        return JSONResponse(status_code=404, content={"message": "Caminho não encontrado"})
+
+    # Metadados do IMDb já em cache (o job de banners os busca); nada de rede aqui
+    metadata = await run_in("disk", imdb_metadata.cached_many, entry["folders"])
+    media = await _media_summaries(_relative_to_video_dir(current_path), entry, wait=sort == "duration")
+    etag = _listing_etag(entry, metadata, media, path, sort, order, limit, cursor, ndjson)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in {tag.strip() for tag in if_none_match.split(",")}:
+        return fastapi.Response(status_code=304, headers=headers)
+
+    folders = [{"name": name, "type": "folder", "path": os.path.join(path, name), "metadata": metadata.get(name)}
+               for name in entry["folders"]]
+    previews = entry["sidecars"][".previews"]
+    videos = []
+    for video in entry["videos"]:
+        banner = find_video_banner(previews, os.path.splitext(video["name"])[0])
+        videos.append({
+            "name": video["name"],
+            "type": "video",
+            "path": os.path.join(path, video["name"]),
+            "banner": _preview_url(path, banner) if banner else None,
+            "size": video["size"],
+            "mtime": video["mtime"],
+            **media[video["name"]]
+        })
+
+    items = _sort_items(folders, videos, sort, order == "desc")
+    total = len(items)
+    start = _cursor_start(items, position) if position else 0
+    end = total if limit is None else min(start + limit, total)
+    items = items[start:end]
+    next_cursor = _encode_cursor(items[-1], end) if end < total and items else None
+
+    if ndjson:
+        return StreamingResponse(_ndjson_listing(items, {"total": total, "next_cursor": next_cursor}),
+                                 media_type="application/x-ndjson", headers=headers)
+    return JSONResponse({"items": items, "total": total, "next_cursor": next_cursor}, headers=headers)
+
+
+@app.get("/api/search")
+async def search_library(q: str = "", limit: int = 50, type: str | None = None):
+    """Busca pastas e vídeos pelo nome em toda a biblioteca (ver search_index)."""
+    if type not in (None, "folder", "video"):
+        return JSONResponse(status_code=400, content={"message": "Tipo inválido"})
+    # Logo após a inicialização a primeira indexação pode ainda estar em andamento
+    await search_index.wait_ready(timeout=5)
+    return {"items": search_index.search(q, limit, type)}
 
 
 @app.get("/api/get_subtitles/{video_path:path}")
 async def get_subtitles(video_path: str):
     """
-    Encontra os arquivos de legenda (.vtt) e dublagem para um determinado vídeo.
+    Encontra as legendas (já em .vtt, avulsas ou embutidas) e as dublagens de um vídeo.
     """
     # Sanitize and validate path
     full_video_path = os.path.abspath(os.path.join(VIDEO_DIR, video_path))
-    if not full_video_path.startswith(os.path.abspath(VIDEO_DIR)) or not os.path.isfile(full_video_path):
+    if not library_index.inside_video_dir(full_video_path) or not os.path.isfile(full_video_path):
         return JSONResponse(status_code=404, content={"message": "Vídeo não encontrado"})
 
-    video_dir = os.path.dirname(full_video_path)
+    index_dir = _relative_to_video_dir(os.path.dirname(full_video_path))
     video_base_name = os.path.splitext(os.path.basename(full_video_path))[0]
     relative_video_dir = os.path.dirname(video_path)
 
-    # --- Legendas ---
-    subs_dir = os.path.join(video_dir, ".subs")
-    subtitles = []
-    if os.path.isdir(subs_dir):
-        for filename in os.listdir(subs_dir):
-            if filename.lower().endswith(".vtt") and filename.startswith(video_base_name):
-                parts = os.path.splitext(filename)[0].split('.')
-                lang_code = "pt"
-                if len(parts) > 2:
-                    lang_code = parts[-1] if len(parts[-1]) == 2 else parts[-2]
+    entry = await run_in("disk", library_index.get_dir, index_dir)
+    sidecars = entry["sidecars"] if entry else {}
 
-                subtitle_src = os.path.join("/videos", relative_video_dir, ".subs", filename).replace("\\", "/")
-                subtitles.append({"lang": lang_code, "label": lang_code.upper(), "src": subtitle_src})
+    # --- Legendas ---
+    # Inclui trilhas embutidas e legendas avulsas, convertidas sob demanda (ver subtitles)
+    subtitles = await subtitle_tracks.list_tracks(_relative_to_video_dir(full_video_path), entry) if entry else []
 
     # --- Dublagens ---
-    dubs_dir = os.path.join(video_dir, ".dubs")
-    dubs = []
-    if os.path.isdir(dubs_dir):
-        for filename in os.listdir(dubs_dir):
+    # Trilhas de áudio do próprio vídeo, extraídas sob demanda (ver audio_tracks);
+    # sem ffmpeg, usa as dublagens já extraídas em .dubs pelo make_captions
+    dubs = await audio_tracks.list_tracks(_relative_to_video_dir(full_video_path))
+    if dubs is None:
+        dubs = []
+        for filename in sidecars.get(".dubs", []):
             if filename.lower().endswith((".mp3", ".aac", ".ogg")) and filename.startswith(video_base_name):
                 parts = os.path.splitext(filename)[0].split('.')
                 lang_code = "dub"
@@ -209,87 +342,115 @@ async def get_subtitles(video_path: str):
         "src": None
     })
 
-    print(f"Mídia encontrada para '{video_path}': {len(subtitles)} legendas, {len(dubs) -1} dublagens.")
-    return {"subtitles": subtitles, "dubs": dubs}
+    # --- Pré-visualização do seek (sprites + WebVTT) ---
+    thumbnails = None
+    if seek_preview_vtt_name(video_base_name) in sidecars.get(".previews", []):
+        thumbnails = _preview_url(relative_video_dir, seek_preview_vtt_name(video_base_name))
+
+    metrics.log_event("media_listed", level=logging.DEBUG, video=video_path, subtitles=len(subtitles),
+                      dubs=len(dubs) - 1)
+    return {"subtitles": subtitles, "dubs": dubs, "thumbnails": thumbnails}
+
+
+@app.get("/api/subtitle_track/{video_path:path}")
+async def get_subtitle_track(video_path: str, track: str):
+    """Uma trilha de legenda em WebVTT, extraída ou convertida no primeiro pedido."""
+    try:
+        path = await subtitle_tracks.find_track(video_path, track)
+    except asyncio.TimeoutError:
+        return JSONResponse(status_code=503, content={"message": "Legenda ainda em conversão"},
+                            headers={"Retry-After": "5"})
+    if path is None:
+        return JSONResponse(status_code=404, content={"message": "Legenda não encontrada"})
+    stat_result = await run_in("disk", os.stat, path)
+    return RangeFileResponse(path, stat_result, media_type="text/vtt", route="subtitles")
+
+
+@app.get("/api/audio_track/{video_path:path}")
+async def get_audio_track(video_path: str, track: str):
+    """
+    Uma trilha de áudio do vídeo em MP4 (com Range), extraída no primeiro pedido.
+    Durante a extração o MP4 fragmentado já é servido enquanto cresce.
+    """
+    try:
+        found = await audio_tracks.find_track(video_path, track)
+    except asyncio.TimeoutError:
+        return JSONResponse(status_code=503, content={"message": "Trilha de áudio ainda em extração"},
+                            headers={"Retry-After": "10"})
+    if found is None:
+        return JSONResponse(status_code=404, content={"message": "Trilha de áudio não encontrada"})
+    path, final_path, done = found
+    if done is not None:
+        return GrowingFileResponse(path, done, final_path, media_type="audio/mp4", route="audio")
+    stat_result = await run_in("disk", os.stat, path)
+    return RangeFileResponse(path, stat_result, media_type="audio/mp4", route="audio")
 
 
 @app.get("/api/get_ip")
-async def get_ip_address():
-    ip = get_public_ip()
+async def get_ip_address(room: str = ""):
+    # Logo após a inicialização a primeira descoberta pode ainda estar em andamento
+    await ip_discovery.wait_ready()
+    ip = ip_discovery.get_public_ip()
     link = f"http://[{ip}]:{PORT}/" if ":" in ip else f"http://{ip}:{PORT}/"
+    room_id = normalize_room_id(room)
+    if room_id != DEFAULT_ROOM:
+        link += f"?room={room_id}"
     return {"ip": ip, "link": link}
 
 
-@app.post("/api/update_banners")
+@app.post("/api/update_banners", status_code=202)
 async def update_banners():
     """
-    Percorre recursivamente o diretório de vídeos, buscando pôsteres para pastas (séries)
-    e gerando thumbnails para arquivos de vídeo.
-    Salva as imagens em uma subpasta '.previews'.
+    Inicia (ou retorna o já em andamento) o job em segundo plano que percorre o
+    diretório de vídeos, buscando pôsteres para pastas (séries) e gerando
+    thumbnails para arquivos de vídeo. As imagens vão para a subpasta '.previews'.
     """
-    updated_banners = []
-
-    for root, dirs, files in os.walk(VIDEO_DIR):
-        # Ignora pastas .previews e outras pastas ocultas
-        dirs[:] = [d for d in dirs if not d.startswith('.')]
-
-        # 1. Processa pastas (para séries/temporadas)
-        # Apenas processa a pasta se ela não for a raiz de vídeos
-        if root != VIDEO_DIR:
-            dir_name = os.path.basename(root)
-            preview_dir = os.path.join(root, ".previews")
-            banner_path = os.path.join(preview_dir, "banner.png")
-
-            if not os.path.exists(banner_path):
-                os.makedirs(preview_dir, exist_ok=True)
-                image_url = _fetch_imdb_poster_url(dir_name)
-                if image_url:
-                    try:
-                        image_response = requests.get(image_url)
-                        image_response.raise_for_status()
-                        with open(banner_path, "wb") as f:
-                            f.write(image_response.content)
-                        updated_banners.append(dir_name)
-                    except Exception as e:
-                        print(f"Erro ao baixar o banner para {dir_name}: {e}")
-
-        # 2. Processa arquivos de vídeo
-        for filename in files:
-            if not filename.lower().endswith((".mp4", ".mkv", ".webm", ".avi")):
-                continue
-
-            base_name, _ = os.path.splitext(filename)
-            video_path = os.path.join(root, filename)
-            preview_dir = os.path.join(root, ".previews")
-            banner_path = os.path.join(preview_dir, f"{base_name}_banner.png")
-
-            if os.path.exists(banner_path):
-                continue
-
-            os.makedirs(preview_dir, exist_ok=True)
-            try:
-                print(f"Gerando thumbnail para o vídeo '{filename}'...")
-                cap = cv2.VideoCapture(video_path)
-                if not cap.isOpened():
-                    print(f"Erro ao abrir o vídeo {filename}")
-                    continue
-
-                total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-                # Captura um frame entre 10% e 70% do vídeo
-                random_frame_number = random.randint(int(total_frames * 0.1), int(total_frames * 0.7))
-                cap.set(cv2.CAP_PROP_POS_FRAMES, random_frame_number)
-
-                success, frame = cap.read()
-                if success:
-                    cv2.imwrite(banner_path, frame)
-                    updated_banners.append(base_name)
-                cap.release()
-            except Exception as e:
-                print(f"Erro ao gerar thumbnail para {base_name}: {e}")
-
-    return {"message": f"Banners atualizados para: {', '.join(updated_banners)}"}
+    return await banner_job.start_job()
+
+
+@app.get("/api/update_banners/{job_id}")
+async def get_banner_job(job_id: str):
+    job = await banner_job.get_job(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"message": "Job não encontrado"})
+    return job
+
+
+@app.delete("/api/update_banners/{job_id}")
+async def cancel_banner_job(job_id: str):
+    job = await banner_job.cancel_job(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"message": "Job não encontrado"})
+    return job
+
+
+@app.get("/api/executors")
+async def get_executor_stats():
+    """Profundidade de fila e latência dos pools de trabalho bloqueante."""
+    return executor_stats()
+
+
+@app.get("/api/chat")
+async def get_chat_stats():
+    """Mensagens recebidas/bloqueadas, custo do fan-out e memória do histórico do chat."""
+    return await chat_history.chat_stats()
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Métricas deste worker no formato de texto do Prometheus."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 app.mount(f"/{CACHE_DIR}", StaticFiles(directory=CACHE_DIR), name="cache")
-app.mount("/videos", StaticFiles(directory=VIDEO_DIR), name="videos") # Para servir os banners
-app.mount("/", StaticFiles(directory=FILES_DIR, html=True), name="static")
+
+
+# Demais arquivos do cliente (JS, CSS, imagens), comprimidos e versionados por static_assets
+@app.api_route("/{asset_path:path}", methods=["GET", "HEAD"])
+async def get_static_asset(request: fastapi.Request, asset_path: str):
+    if asset_path == "" or asset_path.endswith("/"):
+        asset_path += "index.html"
+    response = static_assets.asset_response(request, asset_path)
+    if response is None:
+        return JSONResponse(status_code=404, content={"message": "Arquivo não encontrado"})
+    return response
@@ -0,0 +1,221 @@
+import asyncio
+import html
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from urllib.parse import quote
+
+import httpx
+
+import metrics
+from config import data_path
+from executors import run_in
+
+# --- Metadados do IMDb ---
+# Busca título, ano, nota, gêneros, sinopse e pôster de um nome de pasta e guarda
+# o resultado em SQLite, indexado pelo título normalizado. Resultados vazios
+# também ficam guardados (por menos tempo), para que uma pasta sem
+# correspondência não seja buscada de novo a cada execução do job de banners.
+#
+# A busca usa o endpoint JSON de sugestões do IMDb (o mesmo da caixa de busca do
+# site). A página do título só é baixada para ler o bloco JSON-LD, sem montar a
+# árvore HTML inteira. Todas as requisições passam por um único cliente HTTP com
+# pool de conexões.
+
+DB_PATH = data_path("imdb_metadata.sqlite3")
+FOUND_TTL = 30 * 24 * 3600   # s até rebuscar um título encontrado
+MISS_TTL = 7 * 24 * 3600     # s até tentar de novo um título sem resultado
+
+# Limites do scraping do IMDb: requisições simultâneas e intervalo mínimo entre elas
+IMDB_MAX_CONCURRENCY = 4
+IMDB_MIN_INTERVAL = 0.5
+
+IMDB_HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+                "Accept-Language": "en-US,en;q=0.8"}
+SUGGESTION_URL = "https://v3.sg.media-imdb.com/suggestion/x/{query}.json"
+TITLE_URL = "https://www.imdb.com/title/{imdb_id}/"
+# Só resultados que são títulos (filmes, séries...), não pessoas ou listas
+TITLE_ID_RE = re.compile(r"^tt\d+$")
+_JSON_LD_RE = re.compile(r'<script type="application/ld\+json">(.*?)</script>', re.DOTALL)
+
+_db = None
+_lock = threading.Lock()
+_client = None
+_rate_lock = asyncio.Lock()
+_next_request_at = 0.0
+
+
+def _get_db():
+    global _db
+    if _db is None:
+        _db = sqlite3.connect(DB_PATH, check_same_thread=False)
+        _db.execute("CREATE TABLE IF NOT EXISTS titles (key TEXT PRIMARY KEY, found INTEGER NOT NULL, "
+                    "data TEXT, fetched_at REAL NOT NULL)")
+        _db.commit()
+    return _db
+
+
+def normalize_title(title: str) -> str:
+    """Chave de cache: sem acentos, tags ([1080p], {…}), pontuação ou maiúsculas."""
+    title = unicodedata.normalize("NFKD", title)
+    title = "".join(c for c in title if not unicodedata.combining(c))
+    title = re.sub(r"\[[^\]]*\]|\{[^}]*\}", " ", title.casefold())
+    return " ".join(re.sub(r"[\W_]+", " ", title).split())
+
+
+def get_high_res_url(url: str) -> str:
+    """
+    Converte uma URL de thumbnail do IMDb para sua versão de alta resolução.
+    Ex: https://.../MV5BM...@@._V1_..._.jpg -> https://.../MV5BM...@@.jpg
+    """
+    if url and "@@" in url:
+        base_url = url.split("@@")[0]
+        return base_url + "@@._V1_.jpg"
+    return url
+
+
+# --- Cache (bloqueante: pool 'disk') ---
+
+def _read_cached(key: str):
+    """(encontrado, dados) se a entrada ainda vale, ou None se precisa buscar."""
+    with _lock:
+        row = _get_db().execute("SELECT found, data, fetched_at FROM titles WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        return None
+    found, data, fetched_at = row
+    if time.time() - fetched_at > (FOUND_TTL if found else MISS_TTL):
+        return None
+    return bool(found), json.loads(data) if data else None
+
+
+def _write_cached(key: str, metadata: dict | None):
+    with _lock:
+        db = _get_db()
+        db.execute("INSERT OR REPLACE INTO titles (key, found, data, fetched_at) VALUES (?, ?, ?, ?)",
+                   (key, metadata is not None, json.dumps(metadata) if metadata else None, time.time()))
+        db.commit()
+
+
+def cached_many(titles: list[str]) -> dict:
+    """Metadados já em cache (mesmo vencidos) de vários títulos: {título: dados}. Não acessa a rede."""
+    keys = {normalize_title(title): title for title in titles}
+    if not keys:
+        return {}
+    with _lock:
+        rows = _get_db().execute(
+            f"SELECT key, data FROM titles WHERE found = 1 AND key IN ({','.join('?' * len(keys))})",
+            list(keys)).fetchall()
+    return {keys[key]: json.loads(data) for key, data in rows}
+
+
+# --- Rede ---
+
+def get_client() -> httpx.AsyncClient:
+    """Cliente HTTP compartilhado (pool de conexões) para o IMDb e os pôsteres."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=30, follow_redirects=True, headers=IMDB_HEADERS,
+                                    limits=httpx.Limits(max_connections=IMDB_MAX_CONCURRENCY,
+                                                        max_keepalive_connections=IMDB_MAX_CONCURRENCY))
+    return _client
+
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _rate_limited():
+    """Espera até que uma nova requisição ao IMDb seja permitida."""
+    global _next_request_at
+    async with _rate_lock:
+        now = time.monotonic()
+        wait = _next_request_at - now
+        _next_request_at = max(now, _next_request_at) + IMDB_MIN_INTERVAL
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+
+def _parse_suggestion(payload: dict) -> dict | None:
+    """Primeiro título da resposta do endpoint de sugestões."""
+    for item in payload.get("d", []):
+        if not TITLE_ID_RE.match(item.get("id", "")):
+            continue
+        image = item.get("i") or {}
+        return {
+            "imdb_id": item["id"],
+            "title": item.get("l"),
+            "year": item.get("y"),
+            "kind": item.get("q"),
+            "poster_url": get_high_res_url(image.get("imageUrl")) if image.get("imageUrl") else None,
+        }
+    return None
+
+
+def _parse_json_ld(page: str) -> dict:
+    """Nota, gêneros, sinopse e pôster do bloco JSON-LD da página de um título."""
+    match = _JSON_LD_RE.search(page)
+    if not match:
+        return {}
+    try:
+        data = json.loads(match.group(1))
+    except json.JSONDecodeError:
+        return {}
+    info = {}
+    rating = (data.get("aggregateRating") or {}).get("ratingValue")
+    if rating is not None:
+        info["rating"] = rating
+    genres = data.get("genre")
+    if genres:
+        info["genres"] = genres if isinstance(genres, list) else [genres]
+    if data.get("description"):
+        info["plot"] = html.unescape(data["description"])
+    if data.get("image"):
+        info["poster_url"] = get_high_res_url(data["image"])
+    return info
+
+
+async def _fetch(title: str) -> dict | None:
+    client = get_client()
+    metrics.log_event("imdb_lookup", title=title)
+    await _rate_limited()
+    response = await client.get(SUGGESTION_URL.format(query=quote(normalize_title(title)[:60])))
+    response.raise_for_status()
+    metadata = _parse_suggestion(response.json())
+    if metadata is None:
+        metrics.log_event("imdb_not_found", title=title)
+        return None
+
+    # Detalhes são um bônus: sem eles o resultado da busca já basta
+    try:
+        await _rate_limited()
+        response = await client.get(TITLE_URL.format(imdb_id=metadata["imdb_id"]))
+        response.raise_for_status()
+        metadata.update(_parse_json_ld(response.text))
+    except httpx.HTTPError as e:
+        metrics.log_event("imdb_title_page_failed", level=logging.WARNING, title=title, error=repr(e))
+    return metadata
+
+
+async def lookup(title: str) -> dict | None:
+    """
+    Metadados de um título ({imdb_id, title, year, kind, poster_url, rating,
+    genres, plot}), do cache ou do IMDb. None se o IMDb não tem o título.
+    Erros de rede são propagados e não entram no cache.
+    """
+    key = normalize_title(title)
+    if not key:
+        return None
+    cached = await run_in("disk", _read_cached, key)
+    if cached is not None:
+        return cached[1]
+
+    metadata = await _fetch(title)
+    await run_in("disk", _write_cached, key, metadata)
+    return metadata
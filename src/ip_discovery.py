@@ -0,0 +1,174 @@
+import asyncio
+import ipaddress
+import logging
+import socket
+import time
+
+import aiohttp
+
+import metrics
+from executors import run_in
+
+# --- Descoberta do IP Público ---
+# Um único serviço assíncrono guarda o IPv4 e o IPv6 públicos do servidor e os
+# atualiza em segundo plano. O /api/get_ip e o atualizador de DNS só leem os
+# valores guardados, sem esperar a rede.
+# O IPv6 global vem das interfaces locais, sem nenhuma requisição. Os serviços
+# externos só são usados para o IPv4 (que atrás de NAT não aparece nas
+# interfaces) e para o IPv6 quando nenhuma interface tem um endereço global.
+
+REFRESH_INTERVAL = 300  # s entre atualizações
+RETRY_INTERVAL = 30     # s até tentar de novo quando nenhum endereço foi encontrado
+LOOKUP_TIMEOUT = 5      # s por serviço externo
+READY_TIMEOUT = 3       # s que o /api/get_ip espera pela primeira atualização
+FALLBACK_IP = "127.0.0.1"
+
+LOOKUP_URLS = {
+    "ipv4": ("https://api.ipify.org", "https://ipv4.icanhazip.com"),
+    "ipv6": ("https://api6.ipify.org", "https://ipv6.icanhazip.com"),
+}
+IF_INET6_FILE = "/proc/net/if_inet6"
+# Flags de /proc/net/if_inet6: endereços temporários (privacidade) mudam sozinhos,
+# os outros ainda não valem ou estão saindo de uso
+IFA_F_TEMPORARY = 0x01
+IFA_F_UNUSABLE = 0x08 | 0x20 | 0x40  # dadfailed, deprecated, tentative
+# Qualquer endereço IPv6 global serve: um connect UDP só consulta a tabela de rotas
+ROUTE_PROBE_ADDRESS = ("2001:4860:4860::8888", 80)
+
+_addresses = {"ipv4": None, "ipv6": None}
+_updated_at = None
+_ready = asyncio.Event()
+_listeners = []      # callbacks(family, old_ip, new_ip) chamados quando um endereço muda
+_session = None
+
+
+def _is_global_ipv6(address: str) -> bool:
+    try:
+        ip = ipaddress.IPv6Address(address)
+    except ValueError:
+        return False
+    return ip.is_global and not ip.ipv4_mapped
+
+
+def _ipv6_from_proc() -> str | None:
+    """IPv6 global de /proc/net/if_inet6 (Linux), preferindo os estáveis aos temporários."""
+    try:
+        with open(IF_INET6_FILE) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    stable, temporary = [], []
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 5:
+            continue
+        raw, flags = fields[0], int(fields[4], 16)
+        address = str(ipaddress.IPv6Address(int(raw, 16)))
+        if flags & IFA_F_UNUSABLE or not _is_global_ipv6(address):
+            continue
+        (temporary if flags & IFA_F_TEMPORARY else stable).append(address)
+    candidates = stable or temporary
+    return candidates[0] if candidates else None
+
+
+def _ipv6_from_route() -> str | None:
+    """Endereço de origem que o sistema usaria para sair por IPv6. Nenhum pacote é enviado."""
+    try:
+        with socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) as sock:
+            sock.connect(ROUTE_PROBE_ADDRESS)
+            address = sock.getsockname()[0].split("%")[0]
+    except OSError:
+        return None
+    return address if _is_global_ipv6(address) else None
+
+
+def local_global_ipv6() -> str | None:
+    """IPv6 global das interfaces locais, sem acessar a rede. Bloqueante: pool 'disk'."""
+    return _ipv6_from_proc() or _ipv6_from_route()
+
+
+def _get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=LOOKUP_TIMEOUT))
+    return _session
+
+
+async def _lookup(family: str) -> str | None:
+    """Pergunta o endereço aos serviços externos de `family`, um de cada vez."""
+    for url in LOOKUP_URLS[family]:
+        try:
+            async with _get_session().get(url) as resp:
+                if resp.status != 200:
+                    continue
+                address = (await resp.text()).strip()
+            ipaddress.IPv4Address(address) if family == "ipv4" else ipaddress.IPv6Address(address)
+            return address
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            continue
+    return None
+
+
+async def _discover_ipv6() -> str | None:
+    return await run_in("disk", local_global_ipv6) or await _lookup("ipv6")
+
+
+def _set(family: str, address: str | None):
+    old = _addresses[family]
+    if address == old:
+        return
+    _addresses[family] = address
+    metrics.log_event("public_ip_changed", family=family, address=address, previous=old)
+    for listener in _listeners:
+        try:
+            listener(family, old, address)
+        except Exception as e:
+            metrics.log_event("public_ip_listener_failed", level=logging.ERROR, error=repr(e))
+
+
+async def refresh():
+    """Atualiza os dois endereços agora."""
+    global _updated_at
+    ipv4, ipv6 = await asyncio.gather(_lookup("ipv4"), _discover_ipv6())
+    _set("ipv4", ipv4)
+    _set("ipv6", ipv6)
+    _updated_at = time.time()
+    _ready.set()
+
+
+async def run(interval: float = REFRESH_INTERVAL):
+    """Loop de atualização em segundo plano. Deve ser iniciado como uma Task no asyncio."""
+    try:
+        while True:
+            try:
+                await refresh()
+            except Exception as e:
+                metrics.log_event("public_ip_refresh_failed", level=logging.ERROR, error=repr(e))
+            found = _addresses["ipv4"] or _addresses["ipv6"]
+            await asyncio.sleep(interval if found else min(interval, RETRY_INTERVAL))
+    finally:
+        if _session is not None:
+            await _session.close()
+
+
+def add_listener(callback):
+    """Registra callback(family, old_ip, new_ip), chamado quando o IPv4 ou o IPv6 muda."""
+    _listeners.append(callback)
+
+
+async def wait_ready(timeout: float | None = READY_TIMEOUT) -> bool:
+    """Espera a primeira atualização terminar. False se o timeout venceu antes."""
+    try:
+        await asyncio.wait_for(_ready.wait(), timeout)
+    except asyncio.TimeoutError:
+        return False
+    return True
+
+
+def get_addresses() -> dict:
+    return {**_addresses, "updated_at": _updated_at}
+
+
+def get_public_ip() -> str:
+    """IP público guardado, priorizando IPv6."""
+    return _addresses["ipv6"] or _addresses["ipv4"] or FALLBACK_IP
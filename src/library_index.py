@@ -0,0 +1,287 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+from config import VIDEO_DIR, data_path
+
+logging.getLogger("watchfiles").setLevel(logging.WARNING)
+
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".webm", ".avi")
+# Legendas avulsas ao lado dos vídeos (ex. "Filme.pt.srt")
+SUBTITLE_EXTENSIONS = (".srt", ".vtt", ".ass", ".ssa")
+# Pastas auxiliares geradas ao lado dos vídeos
+SIDECAR_DIRS = (".subs", ".dubs", ".previews")
+
+DB_PATH = data_path("library_index.sqlite3")
+# Incrementado quando o formato das entradas muda: entradas persistidas de outra versão são reescaneadas
+INDEX_VERSION = 2
+
+# Tempo (s) em que uma entrada é considerada válida sem nem checar o mtime.
+# Com o watcher ativo as mudanças invalidam a entrada na hora, então o
+# intervalo pode ser bem maior.
+REVALIDATE_INTERVAL = 2.0
+WATCHED_REVALIDATE_INTERVAL = 300.0
+
+# --- Índice da Biblioteca ---
+# Cache em memória (e persistido em SQLite) do conteúdo de cada pasta de vídeos,
+# indexado pelo mtime da pasta e das suas pastas auxiliares. Só refaz o listdir
+# de uma pasta quando ela (ou .subs/.dubs/.previews) muda.
+
+_entries = {}        # rel_dir -> entrada (ver _scan_dir)
+_checked_at = {}     # rel_dir -> time.monotonic() da última validação
+_generation = {}     # rel_dir -> contador de invalidações (invalidate)
+_scanning = {}       # rel_dir -> threading.Event da revalidação em andamento
+_lock = threading.Lock()      # só para ler/trocar os dicts acima, nunca durante I/O
+_db_lock = threading.Lock()   # a conexão SQLite é compartilhada entre as threads
+_db = None
+_listeners = []      # callbacks(rel_dir, old_entry, new_entry) chamados a cada rescan
+_watching = False
+_stop_watching = None
+
+
+def _get_db():
+    """Conexão do índice persistido. Só com _db_lock."""
+    global _db
+    if _db is None:
+        _db = sqlite3.connect(DB_PATH, check_same_thread=False)
+        _db.execute("CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, stamp TEXT NOT NULL, data TEXT NOT NULL)")
+        _db.commit()
+    return _db
+
+
+def _abs(rel_dir: str) -> str:
+    return os.path.join(VIDEO_DIR, rel_dir) if rel_dir else VIDEO_DIR
+
+
+def _stamp(rel_dir: str):
+    """mtime da pasta e das pastas auxiliares, ou None se a pasta não existe."""
+    base = _abs(rel_dir)
+    try:
+        stamp = [os.stat(base).st_mtime_ns]
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    for side in SIDECAR_DIRS:
+        try:
+            stamp.append(os.stat(os.path.join(base, side)).st_mtime_ns)
+        except FileNotFoundError:
+            stamp.append(0)
+    return stamp
+
+
+def _scan_dir(rel_dir: str, stamp) -> dict:
+    base = _abs(rel_dir)
+    folders, videos, subtitles = [], [], []
+    sidecars = {side: [] for side in SIDECAR_DIRS}
+
+    with os.scandir(base) as it:
+        for entry in it:
+            if entry.name in sidecars:
+                try:
+                    sidecars[entry.name] = sorted(os.listdir(entry.path))
+                except OSError:
+                    pass
+                continue
+            # Ignora arquivos/pastas que começam com '.'
+            if entry.name.startswith('.'):
+                continue
+            try:
+                if entry.is_dir():
+                    folders.append(entry.name)
+                elif entry.name.lower().endswith(VIDEO_EXTENSIONS):
+                    st = entry.stat()
+                    videos.append({"name": entry.name, "size": st.st_size, "mtime": st.st_mtime})
+                elif entry.name.lower().endswith(SUBTITLE_EXTENSIONS):
+                    subtitles.append(entry.name)
+            except OSError:
+                continue
+
+    folders.sort()
+    videos.sort(key=lambda v: v["name"])
+    subtitles.sort()
+    return {"stamp": stamp, "version": INDEX_VERSION, "folders": folders, "videos": videos,
+            "subtitles": subtitles, "sidecars": sidecars}
+
+
+def inside_video_dir(path: str) -> bool:
+    """Se o caminho (absoluto ou relativo ao cwd) é VIDEO_DIR ou fica dentro dela."""
+    root = os.path.abspath(VIDEO_DIR)
+    path = os.path.abspath(path)
+    return path == root or path.startswith(root + os.sep)
+
+
+def video_path(rel_video: str) -> str | None:
+    """
+    Caminho absoluto de um vídeo relativo a VIDEO_DIR, ou None se ele sai da
+    pasta (ex. "../") ou não é um arquivo. Bloqueante: pool 'disk'.
+    """
+    path = os.path.abspath(os.path.join(VIDEO_DIR, rel_video))
+    if path == os.path.abspath(VIDEO_DIR) or not inside_video_dir(path) or not os.path.isfile(path):
+        return None
+    return path
+
+
+def _notify(rel_dir, old, new):
+    for listener in _listeners:
+        try:
+            listener(rel_dir, old, new)
+        except Exception as e:
+            metrics.log_event("library_listener_failed", level=logging.ERROR, folder=rel_dir, error=repr(e))
+
+
+def add_listener(callback):
+    """Registra um callback(rel_dir, entrada_antiga, entrada_nova) para mudanças no índice."""
+    _listeners.append(callback)
+
+
+def get_dir(rel_dir: str = "") -> dict | None:
+    """
+    Retorna a entrada do índice de uma pasta (relativa a VIDEO_DIR),
+    revalidando pelo mtime e reescaneando somente se ela mudou.
+    Retorna None se a pasta não existir.
+    """
+    rel_dir = rel_dir.strip("/\\")
+    while True:
+        now = time.monotonic()
+        with _lock:
+            entry = _entries.get(rel_dir)
+            interval = WATCHED_REVALIDATE_INTERVAL if _watching else REVALIDATE_INTERVAL
+            if entry is not None and now - _checked_at.get(rel_dir, 0) < interval:
+                return entry
+            scanning = _scanning.get(rel_dir)
+            if scanning is None:
+                scanning = _scanning[rel_dir] = threading.Event()
+                generation = _generation.get(rel_dir, 0)
+                break
+        # Outra thread já está revalidando esta pasta: espera e usa o resultado dela
+        scanning.wait()
+
+    try:
+        return _revalidate(rel_dir, entry, generation, now)
+    finally:
+        with _lock:
+            _scanning.pop(rel_dir, None)
+        scanning.set()
+
+
+def _revalidate(rel_dir: str, entry: dict | None, generation: int, now: float) -> dict | None:
+    """stat (e, se mudou, scandir) da pasta fora do _lock; só a troca da entrada é feita com ele."""
+    stamp = _stamp(rel_dir)
+    if stamp is None:
+        with _lock:
+            removed = _entries.pop(rel_dir, None)
+            _checked_at.pop(rel_dir, None)
+        if removed is not None:
+            with _db_lock:
+                _get_db().execute("DELETE FROM dirs WHERE path = ?", (rel_dir,))
+                _get_db().commit()
+            _notify(rel_dir, removed, None)
+        return None
+
+    if entry is None:
+        # Tenta reaproveitar o que foi persistido numa execução anterior
+        with _db_lock:
+            row = _get_db().execute("SELECT stamp, data FROM dirs WHERE path = ?", (rel_dir,)).fetchone()
+        if row and json.loads(row[0]) == stamp:
+            data = json.loads(row[1])
+            if data.get("version") == INDEX_VERSION:
+                entry = {**data, "stamp": stamp}
+
+    old = changed = None
+    if entry is None or entry["stamp"] != stamp:
+        old, changed = entry, True
+        entry = _scan_dir(rel_dir, stamp)
+        data = {k: v for k, v in entry.items() if k != "stamp"}
+        with _db_lock:
+            _get_db().execute("INSERT OR REPLACE INTO dirs (path, stamp, data) VALUES (?, ?, ?)",
+                              (rel_dir, json.dumps(stamp), json.dumps(data)))
+            _get_db().commit()
+
+    with _lock:
+        _entries[rel_dir] = entry
+        # Invalidada durante o scan: o resultado pode estar velho, o próximo acesso revalida
+        if _generation.get(rel_dir, 0) == generation:
+            _checked_at[rel_dir] = now
+    if changed:
+        _notify(rel_dir, old, entry)
+    return entry
+
+
+def sidecars(rel_dir: str, kind: str) -> list[str]:
+    """Lista os arquivos de uma pasta auxiliar (.subs, .dubs ou .previews) de uma pasta."""
+    entry = get_dir(rel_dir)
+    if entry is None:
+        return []
+    return entry["sidecars"].get(kind, [])
+
+
+def walk(rel_dir: str = ""):
+    """Percorre a árvore como os.walk, usando o índice: yield (rel_dir, entrada)."""
+    pending = [rel_dir]
+    while pending:
+        current = pending.pop()
+        entry = get_dir(current)
+        if entry is None:
+            continue
+        yield current, entry
+        pending.extend(os.path.join(current, name) for name in reversed(entry["folders"]))
+
+
+def invalidate(rel_dir: str, rescan: bool = False):
+    """
+    Força a revalidação do mtime da pasta no próximo acesso.
+    Com rescan=True a pasta é reescaneada mesmo sem mudança de mtime
+    (ex.: um vídeo dentro dela mudou de tamanho).
+    """
+    rel_dir = rel_dir.strip("/\\")
+    with _lock:
+        _checked_at.pop(rel_dir, None)
+        _generation[rel_dir] = _generation.get(rel_dir, 0) + 1
+        if rescan and rel_dir in _entries:
+            _entries[rel_dir]["stamp"] = None
+
+
+async def watch_library():
+    """
+    Invalida entradas do índice a partir de eventos do sistema de arquivos (watchfiles).
+    Sem watchfiles, o índice continua correto, apenas revalidando pelo mtime.
+    Deve ser iniciada como uma Task no asyncio.
+    """
+    global _watching, _stop_watching
+    try:
+        from watchfiles import awatch
+    except ImportError:
+        metrics.log_event("library_watcher_unavailable", reason="watchfiles não instalado; só checagem de mtime")
+        return
+
+    root = os.path.abspath(VIDEO_DIR)
+    _stop_watching = asyncio.Event()
+    try:
+        async for changes in awatch(root, recursive=True, yield_on_timeout=True, rust_timeout=1000,
+                                    stop_event=_stop_watching):
+            _watching = True
+            for _, changed_path in changes:
+                rel = os.path.relpath(os.path.dirname(changed_path), root)
+                rel = "" if rel == "." else rel
+                # Mudanças dentro de .subs/.dubs/.previews afetam a pasta do vídeo
+                head, tail = os.path.split(rel)
+                if tail in SIDECAR_DIRS:
+                    rel = head
+                invalidate(rel, rescan=True)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        metrics.log_event("library_watcher_failed", level=logging.ERROR, error=repr(e))
+    finally:
+        _watching = False
+        _checked_at.clear()
+
+
+def stop_watching():
+    """Encerra o watcher da biblioteca (a thread do watchfiles termina no próximo timeout)."""
+    if _stop_watching is not None:
+        _stop_watching.set()
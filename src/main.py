@@ -1,16 +1,34 @@
 import uvicorn
 import asyncio
-from config import PORT, VIDEO_DIR
+from config import PORT, VIDEO_DIR, WORKERS, STATE_BACKEND, MESSAGE_QUEUE
 from server_setup import socket_app
 from dns_manager import start_dns_updater
+from state import reset_presence
 import http_routes                     # Importante para importar as rotas
 import socket_events                   # Importante para importar as rotas
 
 
+def worker_count() -> int:
+    """Número de workers do uvicorn, caindo para 1 se o estado não puder ser compartilhado."""
+    if WORKERS <= 1:
+        return 1
+    if STATE_BACKEND == "memory" or not MESSAGE_QUEUE:
+        print("Aviso: 'workers' > 1 exige 'state_backend' sqlite/redis e uma 'message_queue'. Usando 1 worker.")
+        return 1
+    return WORKERS
+
 
 if __name__ == "__main__":
     print("--- Watch Party Server Iniciando ---")
     print(f"Configurações: Porta={PORT}, Diretório de Vídeos={VIDEO_DIR}")
     print(f"Para configurar, acesse: http://localhost:{PORT}/host")
 
-    uvicorn.run(socket_app, host="::", port=PORT, log_level="error")
\ No newline at end of file
+    # Salas persistidas voltam sem usuários: os clientes reentram ao reconectar
+    asyncio.run(reset_presence())
+
+    workers = worker_count()
+    if workers > 1:
+        print(f"Iniciando {workers} workers (estado: {STATE_BACKEND}, fila: {MESSAGE_QUEUE})")
+        uvicorn.run("main:socket_app", host="::", port=PORT, log_level="error", workers=workers)
+    else:
+        uvicorn.run(socket_app, host="::", port=PORT, log_level="error")
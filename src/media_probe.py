@@ -0,0 +1,241 @@
+import asyncio
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+import library_index
+from config import VIDEO_DIR, data_path
+from executors import run_in
+from thumbnails import FFPROBE
+
+# --- Metadados das Mídias (ffprobe) ---
+# Duração, codecs, resolução, bitrate e trilhas de um vídeo, lidos pelo ffprobe
+# uma vez por versão do arquivo (caminho, tamanho, mtime). Os resultados ficam
+# persistidos em SQLite (sobrevivem a reinícios e são compartilhados entre os
+# workers), com um LRU em memória na frente. O ffprobe só roda no pool 'probe'
+# (probe_path), que limita quantos rodam ao mesmo tempo; as listagens pedem os
+# que faltam em segundo plano (schedule) em vez de esperar por eles.
+
+PROBE_TIMEOUT = 15       # s por execução do ffprobe
+PROBE_CACHE_ENTRIES = 2048
+PROBE_RETRY_AFTER = 600  # s até tentar de novo um arquivo que o ffprobe não conseguiu ler
+DB_PATH = data_path("media_probe.sqlite3")
+# Incrementado quando o formato dos resultados muda: os persistidos de outra versão são refeitos
+PROBE_VERSION = 2
+
+_cache = OrderedDict()   # (caminho, tamanho, mtime_ns) -> resultado, do menos ao mais recente
+_lock = threading.Lock()
+_db = None
+_pending = {}            # caminho -> asyncio.Task dos probes agendados
+_failed = OrderedDict()  # (caminho, tamanho, mtime_ns) que o ffprobe não conseguiu ler -> quando falhou
+
+
+def _get_db():
+    global _db
+    if _db is None:
+        _db = sqlite3.connect(DB_PATH, check_same_thread=False)
+        _db.execute("CREATE TABLE IF NOT EXISTS probes (path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                    "mtime_ns INTEGER NOT NULL, version INTEGER NOT NULL, data TEXT NOT NULL)")
+        _db.commit()
+    return _db
+
+
+def _int_or_none(value) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse(payload: dict) -> dict:
+    streams = []
+    for stream in payload.get("streams", []):
+        tags = stream.get("tags") or {}
+        disposition = stream.get("disposition") or {}
+        streams.append({
+            "index": stream.get("index"),
+            "codec_type": stream.get("codec_type"),
+            "codec_name": stream.get("codec_name"),
+            "language": tags.get("language"),
+            "title": tags.get("title"),
+            "default": bool(disposition.get("default")),
+            "forced": bool(disposition.get("forced")),
+            "width": _int_or_none(stream.get("width")),
+            "height": _int_or_none(stream.get("height")),
+            "pix_fmt": stream.get("pix_fmt"),
+        })
+    fmt = payload.get("format", {})
+    try:
+        duration = float(fmt.get("duration"))
+    except (TypeError, ValueError):
+        duration = None
+    video = next((s for s in streams if s["codec_type"] == "video"), None)
+    audio = next((s for s in streams if s["codec_type"] == "audio"), None)
+    return {
+        "duration": duration,
+        "bit_rate": _int_or_none(fmt.get("bit_rate")),
+        "video_codec": video["codec_name"] if video else None,
+        "audio_codec": audio["codec_name"] if audio else None,
+        "width": video["width"] if video else None,
+        "height": video["height"] if video else None,
+        "pix_fmt": video["pix_fmt"] if video else None,
+        "streams": streams,
+    }
+
+
+def _run_ffprobe(path: str) -> dict | None:
+    try:
+        result = subprocess.run(
+            [FFPROBE, '-v', 'error', '-show_entries',
+             'format=duration,bit_rate:stream=index,codec_type,codec_name,width,height,pix_fmt'
+             ':stream_tags=language,title:stream_disposition=default,forced',
+             '-of', 'json', path],
+            capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+        if result.returncode != 0:
+            return None
+        return _parse(json.loads(result.stdout))
+    except (subprocess.SubprocessError, json.JSONDecodeError, OSError):
+        return None
+
+
+def _remember(key: tuple, info: dict):
+    with _lock:
+        _cache[key] = info
+        _cache.move_to_end(key)
+        while len(_cache) > PROBE_CACHE_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def _lookup(key: tuple) -> dict | None:
+    """Resultado em memória ou persistido para (caminho, tamanho, mtime_ns). Bloqueante: pool 'disk'."""
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+        row = _get_db().execute("SELECT size, mtime_ns, version, data FROM probes WHERE path = ?",
+                                (key[0],)).fetchone()
+    if row is None or tuple(row[:3]) != (key[1], key[2], PROBE_VERSION):
+        return None
+    info = json.loads(row[3])
+    _remember(key, info)
+    return info
+
+
+def _file_key(path: str) -> tuple | None:
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    return path, stat_result.st_size, stat_result.st_mtime_ns
+
+
+def cached(path: str) -> dict | None:
+    """Resultado do probe_file já em cache, sem rodar o ffprobe. Bloqueante: pool 'disk'."""
+    key = _file_key(path)
+    return _lookup(key) if key else None
+
+
+def cached_many(paths: list[str]) -> dict:
+    """{caminho: resultado} dos arquivos que já estão no cache (uma consulta só). Bloqueante: pool 'disk'."""
+    keys = {path: key for path in paths if (key := _file_key(path))}
+    found, missing = {}, []
+    with _lock:
+        for path, key in keys.items():
+            if key in _cache:
+                found[path] = _cache[key]
+            else:
+                missing.append(path)
+        # Em blocos, abaixo do limite de parâmetros do SQLite
+        for i in range(0, len(missing), 500):
+            chunk = missing[i:i + 500]
+            rows = _get_db().execute(
+                f"SELECT path, size, mtime_ns, version, data FROM probes WHERE path IN ({','.join('?' * len(chunk))})",
+                chunk).fetchall()
+            for path, size, mtime_ns, version, data in rows:
+                if (path, size, mtime_ns) == keys[path] and version == PROBE_VERSION:
+                    found[path] = json.loads(data)
+    for path, info in found.items():
+        _remember(keys[path], info)
+    return found
+
+
+def probe_file(path: str) -> dict | None:
+    """
+    {"duration", "bit_rate", "video_codec", "audio_codec", "width", "height",
+    "pix_fmt", "streams": [{index, codec_type, codec_name, language, title,
+    default, forced, width, height, pix_fmt}]} do arquivo, ou None se o ffprobe
+    não está disponível ou não conseguiu lê-lo. Bloqueante: pool 'probe' (use probe_path).
+    """
+    if not FFPROBE:
+        return None
+    key = _file_key(path)
+    if key is None:
+        return None
+    info = _lookup(key)
+    if info is not None:
+        return info
+
+    with _lock:
+        failed_at = _failed.get(key)
+    if failed_at is not None and time.monotonic() - failed_at < PROBE_RETRY_AFTER:
+        return None
+    info = _run_ffprobe(path)
+    with _lock:
+        _failed.pop(key, None)
+        if info is None:
+            # Limitado como o LRU: as falhas mais antigas são esquecidas e tentadas de novo
+            _failed[key] = time.monotonic()
+            while len(_failed) > PROBE_CACHE_ENTRIES:
+                _failed.popitem(last=False)
+    if info is None:
+        return None
+    with _lock:
+        db = _get_db()
+        db.execute("INSERT OR REPLACE INTO probes (path, size, mtime_ns, version, data) VALUES (?, ?, ?, ?, ?)",
+                   (*key, PROBE_VERSION, json.dumps(info)))
+        db.commit()
+    _remember(key, info)
+    return info
+
+
+def _abs_video(rel_video: str) -> str | None:
+    path = os.path.abspath(os.path.join(VIDEO_DIR, rel_video))
+    return path if library_index.inside_video_dir(path) else None
+
+
+async def probe_path(path: str) -> dict | None:
+    """probe_file no pool 'probe', que limita os ffprobe simultâneos (o cache não espera vaga)."""
+    info = await run_in("disk", cached, path)
+    if info is not None or not FFPROBE:
+        return info
+    return await run_in("probe", probe_file, path)
+
+
+async def probe(rel_video: str) -> dict | None:
+    """probe_path de um vídeo relativo a VIDEO_DIR."""
+    path = _abs_video(rel_video)
+    return await probe_path(path) if path else None
+
+
+def schedule(rel_videos: list[str]) -> dict:
+    """
+    Agenda em segundo plano o probe dos vídeos (os já agendados não se repetem).
+    Retorna {caminho: asyncio.Task} de cada vídeo pedido, para quem quiser esperar.
+    """
+    tasks = {}
+    if not FFPROBE:
+        return tasks
+    for rel_video in rel_videos:
+        path = _abs_video(rel_video)
+        if not path:
+            continue
+        if path not in _pending:
+            task = asyncio.create_task(probe_path(path))
+            _pending[path] = task
+            task.add_done_callback(lambda _, path=path: _pending.pop(path, None))
+        tasks[path] = _pending[path]
+    return tasks
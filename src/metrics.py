@@ -0,0 +1,144 @@
+import json
+import logging
+import sys
+import time
+
+# --- Métricas (formato de texto do Prometheus) ---
+# Contadores, gauges e histogramas mínimos, sem dependências, expostos em /metrics.
+# Atualizar uma série é só uma soma num dicionário; valores caros de calcular
+# (salas, filas dos pools) são lidos por coletores apenas quando /metrics é pedido.
+# Com vários workers cada processo exporta as próprias séries.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_metrics = []
+_collectors = []  # funções chamadas antes de cada exportação
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self._values = {}  # tupla de valores dos labels -> valor
+        _metrics.append(self)
+
+    def _samples(self):
+        for labels, value in self._values.items():
+            yield self.name, labels, "", value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, extra, value in self._samples():
+            lines.append(f"{name}{_format_labels(self.label_names, labels, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def clear(self):
+        self._values.clear()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+        # Só o primeiro bucket que cabe; o acumulado é montado na exportação
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series["counts"][i] += 1
+                break
+        series["sum"] += value
+        series["count"] += 1
+
+    def _samples(self):
+        for labels, series in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["counts"]):
+                cumulative += count
+                yield f"{self.name}_bucket", labels, f'le="{_format_value(float(bound))}"', cumulative
+            yield f"{self.name}_bucket", labels, 'le="+Inf"', series["count"]
+            yield f"{self.name}_sum", labels, "", series["sum"]
+            yield f"{self.name}_count", labels, "", series["count"]
+
+
+def add_collector(callback):
+    """Registra callback(), chamado antes de cada exportação para atualizar gauges."""
+    _collectors.append(callback)
+
+
+def render() -> str:
+    """Todas as séries no formato de texto do Prometheus."""
+    for collector in _collectors:
+        try:
+            collector()
+        except Exception as e:
+            log_event("metrics_collector_failed", level=logging.ERROR, error=str(e))
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Logs Estruturados ---
+# Caminhos lentos e falhas viram uma linha JSON por evento em stderr, fáceis de
+# filtrar e agregar, em vez de prints em texto livre.
+
+_event_logger = logging.getLogger("watchparty.events")
+_event_logger.setLevel(logging.INFO)
+_event_logger.propagate = False
+_event_handler = logging.StreamHandler(sys.stderr)
+_event_handler.setFormatter(logging.Formatter("%(message)s"))
+_event_logger.addHandler(_event_handler)
+
+
+def log_event(event: str, level: int = logging.INFO, **fields):
+    """Uma linha JSON: {"ts", "level", "event", ...fields}."""
+    if not _event_logger.isEnabledFor(level):
+        return
+    record = {"ts": round(time.time(), 3), "level": logging.getLevelName(level).lower(), "event": event, **fields}
+    _event_logger.log(level, json.dumps(record, ensure_ascii=False, default=str))
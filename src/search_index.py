@@ -0,0 +1,238 @@
+import asyncio
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+
+import library_index
+import metrics
+from executors import run_in
+
+# --- Busca na Biblioteca ---
+# Índice em memória dos nomes de pastas e vídeos de toda a biblioteca, para o
+# /api/search responder sem percorrer pastas. Cada nome é normalizado (sem
+# acentos, minúsculo, pontuação vira espaço) e indexado por trigramas (buscas
+# por trechos e com erros de digitação) e pelos prefixos de 1 e 2 letras de
+# cada palavra (buscas curtas). O índice é alimentado pelos listeners do
+# library_index, então acompanha cada pasta reescaneada, e uma varredura
+# periódica da árvore pega as pastas que ninguém abriu.
+
+RESCAN_INTERVAL = 60       # s entre varreduras da árvore (só re-stat, via library_index)
+FUZZY_MIN_SIMILARITY = 0.5  # fração dos trigramas da busca que um nome precisa ter sem match exato
+MAX_RESULTS = 200
+
+_NON_ALNUM_RE = re.compile(r"[^0-9a-z]+")
+
+_items = {}          # id -> {"name", "type", "path", "norm", "words"}
+_ids = {}            # caminho relativo -> id
+_children = {}       # rel_dir -> {nome: "folder" ou "video"} do que foi indexado dessa pasta
+_postings = {}       # chave (trigrama ou " " + prefixo) -> set de ids
+_next_id = 0
+_lock = threading.Lock()
+_ready = asyncio.Event()
+
+INDEXED_ITEMS = metrics.Gauge("watchparty_search_indexed_items", "Pastas e vídeos no índice de busca, por tipo.",
+                              ("type",))
+SEARCH_SECONDS = metrics.Histogram("watchparty_search_seconds", "Duração das buscas na biblioteca.",
+                                   buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+
+
+def normalize(text: str) -> str:
+    """"Ação.Épica_2010" -> "acao epica 2010"."""
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii").lower()
+    return _NON_ALNUM_RE.sub(" ", text.replace("'", "")).strip()
+
+
+def _word_keys(word: str) -> set[str]:
+    keys = {" " + word[:1], " " + word[:2]}
+    keys.update(word[i:i + 3] for i in range(len(word) - 2))
+    return keys
+
+
+def _query_keys(token: str) -> set[str]:
+    # Tokens curtos só casam com o começo de palavras; os outros, com qualquer trecho
+    if len(token) < 3:
+        return {" " + token}
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+# --- Atualização ---
+
+def _add(rel_path: str, name: str, kind: str):
+    global _next_id
+    display = os.path.splitext(name)[0] if kind == "video" else name
+    norm = normalize(display)
+    words = tuple(norm.split())
+    item_id = _next_id
+    _next_id += 1
+    _items[item_id] = {"name": name, "type": kind, "path": rel_path.replace(os.sep, "/"),
+                       "norm": norm, "words": words}
+    _ids[rel_path] = item_id
+    for word in words:
+        for key in _word_keys(word):
+            _postings.setdefault(key, set()).add(item_id)
+    return item_id
+
+
+def _remove(rel_path: str):
+    item_id = _ids.pop(rel_path, None)
+    if item_id is None:
+        return
+    item = _items.pop(item_id)
+    for word in item["words"]:
+        for key in _word_keys(word):
+            posting = _postings.get(key)
+            if posting is not None:
+                posting.discard(item_id)
+                if not posting:
+                    del _postings[key]
+    # Uma pasta removida leva junto tudo o que foi indexado dentro dela
+    if item["type"] == "folder":
+        _remove_dir(rel_path)
+
+
+def _remove_dir(rel_dir: str):
+    for name in list(_children.pop(rel_dir, {})):
+        _remove(os.path.join(rel_dir, name))
+
+
+def _index_dir(rel_dir: str, entry: dict | None):
+    """Sincroniza os filhos indexados de uma pasta com a entrada do library_index."""
+    with _lock:
+        if entry is None:
+            _remove_dir(rel_dir)
+            return
+        current = {name: "folder" for name in entry["folders"]}
+        current.update((video["name"], "video") for video in entry["videos"])
+        children = _children.setdefault(rel_dir, {})
+        for name in list(children):
+            if current.get(name) != children[name]:
+                _remove(os.path.join(rel_dir, name))
+                del children[name]
+        for name, kind in current.items():
+            if name not in children:
+                _add(os.path.join(rel_dir, name), name, kind)
+                children[name] = kind
+
+
+def _on_library_change(rel_dir: str, old: dict | None, new: dict | None):
+    _index_dir(rel_dir, new)
+
+
+def _walk_all():
+    """Varre a árvore pelo library_index, indexando as pastas. Bloqueante: pool 'disk'."""
+    seen = set()
+    for rel_dir, entry in library_index.walk(""):
+        seen.add(rel_dir)
+        _index_dir(rel_dir, entry)
+    # Pastas que sumiram sem que o pai fosse reescaneado
+    with _lock:
+        for rel_dir in [d for d in _children if d not in seen]:
+            _remove_dir(rel_dir)
+
+
+def _collect_metrics():
+    counts = {"folder": 0, "video": 0}
+    with _lock:
+        for item in _items.values():
+            counts[item["type"]] += 1
+    for kind, count in counts.items():
+        INDEXED_ITEMS.set(count, kind)
+
+
+metrics.add_collector(_collect_metrics)
+library_index.add_listener(_on_library_change)
+
+
+async def run(interval: float = RESCAN_INTERVAL):
+    """Indexa a biblioteca e a revarre periodicamente. Deve ser iniciada como uma Task."""
+    while True:
+        started = time.monotonic()
+        try:
+            await run_in("disk", _walk_all)
+            if not _ready.is_set():
+                metrics.log_event("search_index_ready", items=len(_items), seconds=round(time.monotonic() - started, 1))
+        except Exception as e:
+            metrics.log_event("search_index_failed", level=logging.ERROR, error=repr(e))
+        _ready.set()
+        await asyncio.sleep(interval)
+
+
+async def wait_ready(timeout: float):
+    """Espera a primeira indexação completa (no máximo `timeout` s)."""
+    try:
+        await asyncio.wait_for(_ready.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+# --- Consulta ---
+
+def _rank(norm: str, query: str, word_starts: list[str], similarity: float) -> tuple:
+    if norm == query:
+        tier = 0
+    elif norm.startswith(query):
+        tier = 1
+    elif all(start in " " + norm for start in word_starts):
+        tier = 2
+    elif similarity >= 1:
+        tier = 3
+    else:
+        tier = 4
+    return tier, -similarity, len(norm)
+
+
+def search(query: str, limit: int = 50, kind: str | None = None) -> list[dict]:
+    """
+    Pastas e vídeos cujo nome casa com a busca, do melhor para o pior: nome
+    igual, começando pela busca, palavras começando pelos termos, trecho do
+    nome e, sem nenhum desses, nomes parecidos (erros de digitação).
+    """
+    started = time.perf_counter()
+    query = normalize(query)
+    tokens = query.split()
+    if not tokens:
+        return []
+    limit = max(1, min(limit, MAX_RESULTS))
+
+    with _lock:
+        keys = set().union(*(_query_keys(token) for token in tokens))
+        postings = sorted((_postings.get(key, set()) for key in keys), key=len)
+        # Match exato: interseção começando pelas listas menores
+        candidates = set(postings[0]) if postings else set()
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates &= posting
+        # Os trigramas não garantem a ordem: confere o trecho inteiro dos termos longos
+        long_tokens = [token for token in tokens if len(token) > 3]
+        candidates = {item_id: 1.0 for item_id in candidates
+                      if all(token in _items[item_id]["norm"] for token in long_tokens)}
+
+        fuzzy_keys = [key for key in keys if not key.startswith(" ")]
+        if not candidates and fuzzy_keys:
+            counts = {}
+            for key in fuzzy_keys:
+                for item_id in _postings.get(key, ()):
+                    counts[item_id] = counts.get(item_id, 0) + 1
+            needed = FUZZY_MIN_SIMILARITY * len(fuzzy_keys)
+            candidates = {item_id: count / len(fuzzy_keys) for item_id, count in counts.items() if count >= needed}
+
+        word_starts = [" " + token for token in tokens]
+        ranked = heapq.nsmallest(
+            limit,
+            ((_rank(item["norm"], query, word_starts, similarity), item["path"], item_id)
+             for item_id, similarity in candidates.items()
+             for item in (_items[item_id],)
+             if kind is None or item["type"] == kind))
+        results = []
+        for _, _, item_id in ranked:
+            item = _items[item_id]
+            results.append({"name": item["name"], "type": item["type"], "path": item["path"],
+                            "folder": os.path.dirname(item["path"])})
+
+    SEARCH_SECONDS.observe(time.perf_counter() - started)
+    return results
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import os
+
+import library_index
+import media_probe
+import metrics
+from config import VIDEO_DIR
+from executors import run_in
+from thumbnails import build_seek_previews, seek_preview_vtt_name
+
+# --- Pré-visualizações do Seek sob Demanda ---
+# Os sprites só são gerados para vídeos que alguém realmente colocou para tocar.
+
+_pending = {}  # rel_video -> asyncio.Task
+
+
+def _split(rel_video: str):
+    rel_dir, filename = os.path.split(rel_video.replace("\\", "/"))
+    return rel_dir, os.path.splitext(filename)[0]
+
+
+def _vtt_url(rel_dir: str, base_name: str) -> str:
+    return os.path.join("/videos", rel_dir, ".previews", seek_preview_vtt_name(base_name)).replace("\\", "/")
+
+
+async def find_seek_previews(rel_video: str) -> str | None:
+    """URL da trilha WebVTT de pré-visualização do vídeo, se já foi gerada."""
+    rel_dir, base_name = _split(rel_video)
+    entry = await run_in("disk", library_index.get_dir, rel_dir)
+    if entry and seek_preview_vtt_name(base_name) in entry["sidecars"][".previews"]:
+        return _vtt_url(rel_dir, base_name)
+    return None
+
+
+async def _generate(rel_video: str) -> str | None:
+    rel_dir, base_name = _split(rel_video)
+    preview_dir = os.path.join(VIDEO_DIR, rel_dir, ".previews")
+    try:
+        await run_in("disk", os.makedirs, preview_dir, exist_ok=True)
+        metrics.log_event("seek_previews_started", video=rel_video)
+        info = await media_probe.probe(rel_video)
+        if not await run_in("decode", build_seek_previews, os.path.join(VIDEO_DIR, rel_video), preview_dir, base_name,
+                            info["duration"] if info else None):
+            return None
+        library_index.invalidate(rel_dir)
+        return _vtt_url(rel_dir, base_name)
+    except Exception as e:
+        metrics.log_event("seek_previews_failed", level=logging.ERROR, video=rel_video, error=repr(e))
+        return None
+    finally:
+        _pending.pop(rel_video, None)
+
+
+async def ensure_seek_previews(rel_video: str) -> str | None:
+    """
+    Retorna a URL da trilha de pré-visualização do vídeo, gerando os sprites
+    no pool 'decode' se ainda não existirem. Pedidos simultâneos para o mesmo
+    vídeo compartilham a mesma geração.
+    """
+    if await run_in("disk", library_index.video_path, rel_video) is None:
+        return None
+    url = await find_seek_previews(rel_video)
+    if url:
+        return url
+    if rel_video not in _pending:
+        _pending[rel_video] = asyncio.create_task(_generate(rel_video))
+    return await asyncio.shield(_pending[rel_video])
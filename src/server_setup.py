@@ -1,19 +1,186 @@
 import asyncio
+import functools
+import inspect
+import logging
+import os
+import time
 from contextlib import asynccontextmanager
 
 import fastapi
 import socketio
 
+import metrics
+from config import MESSAGE_QUEUE, data_path
+
+# Com vários workers, só um deles roda as tarefas que não podem duplicar
+# (atualizador de DNS, retomada do job de banners): quem pegar este lock.
+SINGLETON_LOCK_FILE = data_path("server.lock")
+_singleton_lock = None
+
+
+def try_lock_file(path: str):
+    """
+    Tenta travar o arquivo sem bloquear. Retorna o arquivo aberto (o lock dura
+    até ele ser fechado ou o processo morrer) ou None se outro processo o travou.
+    """
+    lock_file = open(path, "a+")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def _acquire_singleton_lock() -> bool:
+    """Tenta travar SINGLETON_LOCK_FILE; o lock dura enquanto o processo viver."""
+    global _singleton_lock
+    _singleton_lock = try_lock_file(SINGLETON_LOCK_FILE)
+    return _singleton_lock is not None
+
+
+def _client_manager():
+    """Fila de mensagens que leva os emits do Socket.IO aos sockets de outros workers."""
+    if not MESSAGE_QUEUE:
+        return None
+    if MESSAGE_QUEUE.startswith(("redis://", "rediss://", "unix://")):
+        return socketio.AsyncRedisManager(MESSAGE_QUEUE)
+    if MESSAGE_QUEUE.startswith(("amqp://", "amqps://")):
+        return socketio.AsyncAioPikaManager(MESSAGE_QUEUE)
+    print(f"Aviso: message_queue '{MESSAGE_QUEUE}' não suportada. Usando apenas este processo.")
+    return None
+
+
+# --- Instrumentação do Socket.IO ---
+# Todo handler registrado com sio.on/sio.event é cronometrado, e todo emit é
+# contado junto com seus destinatários. Os destinatários são os sockets deste
+# worker, lidos do tamanho da sala (sem copiá-la nem serializar o payload); com
+# uma message_queue os outros workers entregam o mesmo emit aos seus.
+SLOW_EVENT_SECONDS = 0.25
+
+EVENT_SECONDS = metrics.Histogram("watchparty_socketio_event_seconds",
+                                  "Duração dos handlers de eventos do Socket.IO.", ("event",))
+EVENT_ERRORS = metrics.Counter("watchparty_socketio_event_errors_total",
+                               "Handlers de eventos que terminaram com exceção.", ("event",))
+EMITS = metrics.Counter("watchparty_socketio_emits_total", "Emits do servidor.", ("event",))
+EMIT_RECIPIENTS = metrics.Histogram("watchparty_socketio_emit_recipients",
+                                    "Sockets alcançados por emit (fan-out).", ("event",),
+                                    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250))
+
+
+def _max_positional(handler) -> int | None:
+    """Quantos argumentos posicionais o handler aceita (None se aceita *args)."""
+    parameters = inspect.signature(handler).parameters.values()
+    if any(p.kind == p.VAR_POSITIONAL for p in parameters):
+        return None
+    return sum(p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD) for p in parameters)
+
+
+def _timed_handler(event, handler):
+    if not asyncio.iscoroutinefunction(handler):
+        return handler
+    max_args = _max_positional(handler)
+
+    @functools.wraps(handler)
+    async def timed(*args):
+        # O python-socketio tenta connect/disconnect com mais argumentos e repete
+        # com menos ao receber TypeError: essa tentativa não é um evento
+        if max_args is not None and len(args) > max_args:
+            raise TypeError(f"{event}() recebe {max_args} argumentos")
+        started = time.perf_counter()
+        try:
+            return await handler(*args)
+        except Exception as e:
+            EVENT_ERRORS.inc(event)
+            metrics.log_event("socketio_event_failed", level=logging.ERROR, handler=event,
+                              sid=args[0] if args else None, error=repr(e))
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            EVENT_SECONDS.observe(elapsed, event)
+            if elapsed > SLOW_EVENT_SECONDS:
+                metrics.log_event("slow_socketio_event", level=logging.WARNING, handler=event,
+                                  sid=args[0] if args else None, seconds=round(elapsed, 3))
+
+    return timed
+
+
+def _recipient_count(manager, namespace, room, skip_sid) -> int:
+    """Sockets deste worker na(s) sala(s) do emit, menos os pulados (salas sobrepostas contam duas vezes)."""
+    rooms = manager.rooms.get(namespace, {})
+    targets = room if isinstance(room, (list, tuple)) else [room]
+    members = [rooms[r] for r in targets if r in rooms]
+    count = sum(len(m) for m in members)
+    if skip_sid is not None:
+        skipped = skip_sid if isinstance(skip_sid, list) else [skip_sid]
+        count -= sum(1 for sid in skipped for m in members if sid in m)
+    return max(0, count)
+
+
+class InstrumentedServer(socketio.AsyncServer):
+    """AsyncServer que mede handlers e o fan-out dos emits (ver metrics)."""
+
+    def on(self, event, handler=None, namespace=None):
+        register = super().on(event, namespace=namespace)
+
+        def set_handler(handler):
+            register(_timed_handler(event, handler))
+            return handler
+
+        if handler is None:
+            return set_handler
+        set_handler(handler)
+
+    async def emit(self, event, data=None, to=None, room=None, skip_sid=None, namespace=None, **kwargs):
+        EMITS.inc(event)
+        EMIT_RECIPIENTS.observe(_recipient_count(self.manager, namespace or "/", to or room, skip_sid), event)
+        return await super().emit(event, data=data, to=to, room=room, skip_sid=skip_sid,
+                                  namespace=namespace, **kwargs)
+
 
 @asynccontextmanager
 async def lifespan(_):
-    from src.config import USE_CLOUDFLARE
-    from src.dns_manager import start_dns_updater
+    from config import USE_CLOUDFLARE
+    from dns_manager import start_dns_updater
+    from library_index import watch_library, stop_watching
+    from executors import run_in, shutdown as shutdown_executors
+    from banner_job import resume_pending_job
+    from hls import stop_all as stop_hls_jobs, discard_incomplete as discard_incomplete_hls
+    from subtitles import stop_all as stop_subtitle_jobs
+    from audio_tracks import stop_all as stop_audio_jobs
+    from static_assets import build as build_static_assets
+    from imdb_metadata import close as close_imdb_client
+    import ip_discovery
+    import search_index
 
-    if USE_CLOUDFLARE:
+    await run_in("disk", build_static_assets)
+    singleton = _acquire_singleton_lock()
+    ip_refresher = asyncio.create_task(ip_discovery.run())
+    if singleton and USE_CLOUDFLARE:
         asyncio.create_task(start_dns_updater())
+    library_watcher = asyncio.create_task(watch_library())
+    search_indexer = asyncio.create_task(search_index.run())
+    if singleton:
+        await run_in("disk", discard_incomplete_hls)
+        await resume_pending_job()
     yield
+    stop_watching()
+    stop_hls_jobs()
+    stop_subtitle_jobs()
+    stop_audio_jobs()
+    await library_watcher
+    ip_refresher.cancel()
+    search_indexer.cancel()
+    await asyncio.gather(ip_refresher, search_indexer, return_exceptions=True)
+    await close_imdb_client()
+    shutdown_executors()
 
 app = fastapi.FastAPI(lifespan=lifespan)
-sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*")
+sio = InstrumentedServer(async_mode="asgi", cors_allowed_origins="*", client_manager=_client_manager())
 socket_app = socketio.ASGIApp(sio, other_asgi_app=app)
@@ -1,128 +1,339 @@
+import asyncio
+import logging
+import time
+
+from socketio.exceptions import TimeoutError as SocketTimeoutError
+
+import chat_history
+import hls
+import library_index
+import metrics
+from executors import run_in
+from seek_previews import ensure_seek_previews
 from server_setup import sio
-from state import server_state
+from thumbnails import find_video_banner
+from state import (load_room, update_room, room_of, sid_room, set_sid_room, clear_sid_room,
+                   normalize_room_id, discard_room_if_empty, current_position, anchor_playback)
+
+# O estado das salas fica no backend configurado (ver state_backend) e pode ser
+# compartilhado por vários workers: toda alteração passa por update_room com uma
+# função que só mexe na sala, e os emits saem depois, com a sala já gravada.
+
+# O request_sync é respondido pelo relógio da sala; o host só é consultado
+# (get_host_time) no máximo uma vez a cada HOST_POLL_INTERVAL s, para corrigir o drift.
+HOST_POLL_INTERVAL = 15.0
+HOST_POLL_TIMEOUT = 2
+# Cada cliente pede a cada 3 s; pedidos mais próximos que isso (um cliente com
+# defeito ou malicioso) são ignorados sem tocar no backend nem enfileirar force_sync
+SYNC_REQUEST_MIN_INTERVAL = 1.0
+_last_sync_requests = {}  # sid -> time.monotonic() do último request_sync atendido
+
+# Rajadas de host_sync (ex. arrastar a barra de progresso) são agrupadas: o primeiro
+# evento sai na hora e o estado mais recente sai ao fim de cada janela.
+SYNC_COALESCE_WINDOW = 0.15
+_sync_windows = {}  # room_id -> {"dirty": bool}
+
+SYNC_REQUESTS_THROTTLED = metrics.Counter("watchparty_sync_requests_throttled_total",
+                                          "Pedidos request_sync ignorados por chegarem rápido demais.")
+HOST_TIME_CALLS = metrics.Counter("watchparty_host_time_calls_total",
+                                  "Consultas get_host_time ao host, por resultado (ok, timeout, error).", ("result",))
+ROOM_SOCKETS = metrics.Gauge("watchparty_room_sockets", "Sockets conectados a este worker, por sala.", ("room",))
+CONNECTED_SOCKETS = metrics.Gauge("watchparty_connected_sockets", "Sockets conectados a este worker.")
+
+
+def _collect_room_sockets():
+    rooms = sio.manager.rooms.get("/", {})
+    sids = rooms.get(None, {})
+    CONNECTED_SOCKETS.set(len(sids))
+    ROOM_SOCKETS.clear()
+    for room_id, members in rooms.items():
+        # Cada sid também é uma sala com ele mesmo; só contam as salas de verdade
+        if room_id is not None and room_id not in sids:
+            ROOM_SOCKETS.set(len(members), room_id)
+
+
+metrics.add_collector(_collect_room_sockets)
+
+# Referências para tarefas em segundo plano (o asyncio só guarda referências fracas)
+_background_tasks = set()
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+# --- Presença ---
+# Quem entra recebe um presence_snapshot (lista completa); os demais recebem só
+# o que mudou em um presence_delta versionado. Um cliente que perder uma versão
+# pede um novo snapshot com request_presence.
+
+async def _send_presence_snapshot(room, to):
+    await sio.emit('presence_snapshot', {"version": room["presence_version"], "users": room["users"]}, to=to)
+
+
+async def _send_presence_delta(room_id, room, changes, skip_sid=None):
+    # changes = [{"op": "join", "sid": ..., "user": {...}} | {"op": "leave", "sid": ...}
+    #            | {"op": "host", "sid": novo_host, "previous": host_anterior}]
+    # A versão é incrementada junto com a alteração, dentro do update_room.
+    await sio.emit('presence_delta', {"version": room["presence_version"], "changes": changes},
+                   to=room_id, skip_sid=skip_sid)
 
 
 @sio.event
 async def connect(sid, environ):
-    print(f"Cliente conectado: {sid}")
+    metrics.log_event("socket_connected", sid=sid)
+
+
+async def _leave_current_room(sid):
+    """Remove o sid da sala em que ele estava, elegendo um novo host se preciso."""
+    room_id = await sid_room(sid)
+    if room_id is None:
+        return
+    await clear_sid_room(sid)
+
+    def leave(room):
+        was_host = sid == room["host_sid"]
+        room["users"].pop(sid, None)
+        changes = [{"op": "leave", "sid": sid}]
+        stopped_screen_share = False
+
+        # Se o host saiu, elege um novo host (lógica simples)
+        if was_host:
+            if room.get("is_screen_sharing"):
+                room["is_screen_sharing"] = False
+                room["current_video"] = None
+                stopped_screen_share = True
+
+            if room["users"]:
+                new_host_sid = next(iter(room["users"]))
+                room["host_sid"] = new_host_sid
+                room["users"][new_host_sid]["isHost"] = True
+                changes.append({"op": "host", "sid": new_host_sid, "previous": sid})
+            else:
+                room["host_sid"] = None  # Sala vazia
+                room["is_screen_sharing"] = False
+
+        if room["users"]:
+            room["presence_version"] += 1
+        return changes, stopped_screen_share
+
+    room, result = await update_room(room_id, leave)
+    await sio.leave_room(sid, room_id)
+    if room is None:
+        return
+    changes, stopped_screen_share = result
+
+    if stopped_screen_share:
+        await sio.emit('screen_share_stopped', to=room_id)
+
+    if room["users"]:
+        if len(changes) > 1:
+            await sio.emit('set_host', to=room["host_sid"])
+        # Atualiza a lista de usuários para todos da sala
+        await _send_presence_delta(room_id, room, changes)
+        # Notifica os outros que este usuário saiu, para limpar conexões WebRTC
+        await sio.emit('peer_disconnected', {'sid': sid}, to=room_id, skip_sid=sid)
+    else:
+        await discard_room_if_empty(room_id)
 
 
 @sio.event
 async def join_room(sid, data):
-    # data = {"name": "User", "pfp": "/cache/pic.png"}
-    server_state["users"][sid] = data
-
-    # O primeiro a entrar é o host
-    if server_state["host_sid"] is None:
-        server_state["host_sid"] = sid
-        server_state["users"][sid]["isHost"] = True
-        # Initialize screen sharing state for a new room
-        server_state["is_screen_sharing"] = False
+    # data = {"name": "User", "pfp": "/cache/pic.png", "room": "sala"}
+    room_id = normalize_room_id(data.pop("room", None))
+
+    if await sid_room(sid) not in (None, room_id):
+        await _leave_current_room(sid)
+
+    def join(room):
+        room["users"][sid] = dict(data)
+        # O primeiro a entrar é o host
+        became_host = room["host_sid"] is None
+        if became_host:
+            room["host_sid"] = sid
+            room["users"][sid]["isHost"] = True
+            # Initialize screen sharing state for a new room
+            room["is_screen_sharing"] = False
+        room["presence_version"] += 1
+        return became_host
+
+    room, became_host = await update_room(room_id, join, create=True)
+    await set_sid_room(sid, room_id)
+    await sio.enter_room(sid, room_id)
+
+    if became_host:
         await sio.emit('set_host', to=sid)
 
-    await sio.emit('update_users', server_state["users"])
+    # O delta vem antes para que o snapshot do novo usuário já tenha a versão que o inclui
+    await _send_presence_delta(room_id, room, [{"op": "join", "sid": sid, "user": room["users"][sid]}], skip_sid=sid)
+    await _send_presence_snapshot(room, sid)
 
     # If screen share is active, sync the new user to it
-    if server_state.get("is_screen_sharing"):
+    if room.get("is_screen_sharing"):
         await sio.emit('sync_event', {
             "type": "set_video",
             "video": "screen-share"
         }, to=sid)
         # Tell host to start WebRTC connection to the new user
-        await sio.emit('initiate_screen_share_to_peer', {'target_sid': sid}, to=server_state["host_sid"])
+        await sio.emit('initiate_screen_share_to_peer', {'target_sid': sid}, to=room["host_sid"])
     else:
         # Otherwise, send the normal video state
         await sio.emit('sync_state', {
-            "video": server_state["current_video"],
-            "time": server_state["current_time"],
-            "paused": server_state["is_paused"]
+            "video": room["current_video"],
+            "stream": hls.stream_url(room["current_video"]),
+            "time": current_position(room),
+            "paused": room["is_paused"],
+            "rate": room["playback_rate"]
         }, to=sid)
 
+    # Últimas mensagens da sala; as anteriores vêm sob demanda (request_chat_history)
+    messages, has_more = await chat_history.history_page(room_id)
+    await sio.emit('chat_history', {"messages": messages, "has_more": has_more}, to=sid)
+
 
 @sio.event
 async def disconnect(sid):
-    print(f"Cliente desconectado: {sid}")
-    was_host = sid == server_state["host_sid"]
-    if sid in server_state["users"]:
-        del server_state["users"][sid]
-
-    # Se o host saiu, elege um novo host (lógica simples)
-    if was_host:
-        if server_state.get("is_screen_sharing"):
-            server_state["is_screen_sharing"] = False
-            server_state["current_video"] = None
-            await sio.emit('screen_share_stopped')
-
-        if server_state["users"]:
-            new_host_sid = list(server_state["users"].keys())[0]
-            server_state["host_sid"] = new_host_sid
-            server_state["users"][new_host_sid]["isHost"] = True
-            await sio.emit('set_host', to=new_host_sid)
-        else:
-            server_state["host_sid"] = None  # Sala vazia
-            server_state["is_screen_sharing"] = False
-
-    # Atualiza a lista de usuários para todos
-    await sio.emit('update_users', server_state["users"])
-    
-    # Notifica os outros que este usuário saiu, para limpar conexões WebRTC
-    await sio.emit('peer_disconnected', {'sid': sid}, skip_sid=sid)
+    metrics.log_event("socket_disconnected", sid=sid)
+    chat_history.forget_sid(sid)
+    _last_sync_requests.pop(sid, None)
+    await _leave_current_room(sid)
+
+
+async def _broadcast_message(room_id, room, message):
+    """Guarda a mensagem no histórico da sala e a envia para todos."""
+    message = await chat_history.add_message(room_id, message)
+    chat_history.count_broadcast(len(room["users"]) if room else 0)
+    await sio.emit('new_message', message, to=room_id)
 
 
 @sio.event
 async def send_message(sid, message_text):
-    user_info = server_state["users"].get(sid, {"name": "Guest"})
+    chat_history.count_received()
+    if not isinstance(message_text, str) or not message_text.strip() \
+            or len(message_text) > chat_history.MAX_MESSAGE_CHARS:
+        chat_history.count_rejected()
+        return
+
+    room_id, room = await room_of(sid)
+    if room is None:
+        return
+
+    if not chat_history.allow_message(sid):
+        await sio.emit('new_message', {
+            "sender": "System",
+            "pfp": "/system_avatar.png",
+            "text": "Você está enviando mensagens rápido demais. Aguarde um pouco."
+        }, to=sid)
+        return
+
+    user_info = room["users"].get(sid, {"name": "Guest"})
     message_data = {
         "sender": user_info.get("name", "Guest"),
         "pfp": user_info.get("pfp", ""),
         "text": message_text
     }
-    await sio.emit('new_message', message_data)
+    await _broadcast_message(room_id, room, message_data)
+
+
+@sio.on("request_chat_history")
+async def handle_request_chat_history(sid, data):
+    """Página de mensagens anteriores à mensagem `before` (retornada no ack)."""
+    room_id = await sid_room(sid)
+    if room_id is None:
+        return {"messages": [], "has_more": False}
+    before = data.get("before") if isinstance(data, dict) else None
+    if isinstance(before, bool) or not isinstance(before, int):
+        before = None
+    messages, has_more = await chat_history.history_page(room_id, before)
+    return {"messages": messages, "has_more": has_more}
 
 
 # --- Eventos de Sincronização (Apenas Host) ---
 
 @sio.on("transfer_host")
 async def handle_transfer_host(sid, new_host_sid):
-    if server_state["host_sid"] == sid:
-        if new_host_sid in server_state["users"]:
-            server_state["host_sid"] = new_host_sid
-            server_state["users"][sid]["isHost"] = False
-            server_state["users"][new_host_sid]["isHost"] = True
-            
-            await sio.emit('set_host', to=new_host_sid)
-            await sio.emit('remove_host', to=sid)
-            
-            await sio.emit('update_users', server_state["users"])
+    room_id = await sid_room(sid)
+    if room_id is None:
+        return
+
+    def transfer(room):
+        if room["host_sid"] != sid or new_host_sid not in room["users"]:
+            return False
+        room["host_sid"] = new_host_sid
+        room["users"][sid]["isHost"] = False
+        room["users"][new_host_sid]["isHost"] = True
+        room["presence_version"] += 1
+        return True
+
+    room, transferred = await update_room(room_id, transfer)
+    if transferred:
+        await sio.emit('set_host', to=new_host_sid)
+        await sio.emit('remove_host', to=sid)
+
+        await _send_presence_delta(room_id, room, [{"op": "host", "sid": new_host_sid, "previous": sid}])
+
+
+@sio.on("request_presence")
+async def handle_request_presence(sid):
+    """Snapshot da presença para um cliente que ficou desatualizado."""
+    _, room = await room_of(sid)
+    if room is not None:
+        await _send_presence_snapshot(room, sid)
 
 @sio.on("webrtc_signal")
 async def handle_webrtc_signal(sid, data):
     """
     Encaminha sinais WebRTC (ofertas, respostas, candidatos)
-    para um cliente alvo específico.
+    para um cliente alvo específico da mesma sala.
     data = {"target_sid": "...", "payload": {...}}
     The payload can now include a "purpose" to distinguish streams.
     """
+    _, room = await room_of(sid)
+    if room is None:
+        return
+
     target_sid = data.get("target_sid")
-    if target_sid and target_sid in server_state["users"]:
+    if target_sid and target_sid in room["users"]:
         payload = data.get("payload", {})
         payload["sender_sid"] = sid
         await sio.emit('webrtc_signal', payload, to=target_sid)
 
 @sio.on("host_set_video")
-async def set_video(sid, video_name):
-    print(f"Host ou painel de host definiu o vídeo para: {video_name}")
-    server_state["current_video"] = video_name
-    server_state["current_time"] = 0
-    server_state["is_paused"] = True
+async def set_video(sid, data):
+    # data = "caminho/video.mp4" ou {"room": "sala", "video": "caminho/video.mp4"}
+    # O painel do host não entra na sala, então informa o id da sala no payload.
+    if isinstance(data, dict):
+        video_name = data.get("video")
+        room_id = await sid_room(sid) or normalize_room_id(data.get("room"))
+    else:
+        video_name = data
+        room_id = await sid_room(sid) or normalize_room_id(None)
+    if not video_name or not isinstance(video_name, str):
+        return
+    # Caminhos locais vêm do cliente: nada fora de VIDEO_DIR chega ao disco
+    if not video_name.startswith("http") and await run_in("disk", library_index.video_path, video_name) is None:
+        metrics.log_event("video_rejected", level=logging.WARNING, sid=sid, room=room_id, video=video_name)
+        return
+
+    metrics.log_event("video_set", sid=sid, room=room_id, video=video_name)
+
+    def load_video(room):
+        room["current_video"] = video_name
+        anchor_playback(room, 0, paused=True)
+
+    room, _ = await update_room(room_id, load_video, create=True)
 
+    # "stream": playlist HLS para formatos que o navegador não toca direto
     await sio.emit('sync_event', {
         "type": "set_video",
-        "video": video_name
-    })
+        "video": video_name,
+        "stream": hls.stream_url(video_name)
+    }, to=room_id)
 
     if video_name.startswith("http"):
-        await sio.emit('new_message', {
+        await _broadcast_message(room_id, room, {
             "sender": "System",
             "pfp": "/system_avatar.png",
             "text": f"Reproduzindo vídeo de: {video_name}"
@@ -131,8 +342,10 @@ async def set_video(sid, video_name):
         last_slash_index = max(video_name.rfind('/'), video_name.rfind('\\'))
         dir_path = video_name[:last_slash_index] + "/" if last_slash_index != -1 else ''
         base_name = video_name[last_slash_index + 1:video_name.rfind('.')] if last_slash_index != -1 else video_name[:video_name.rfind('.')]
-        video_preview_path = f'/videos/{dir_path}.previews/{base_name}_banner.png'
-        await sio.emit('new_message', {
+        entry = await run_in("disk", library_index.get_dir, dir_path)
+        banner = find_video_banner(entry["sidecars"][".previews"], base_name, width=640) if entry else None
+        video_preview_path = f'/videos/{dir_path}.previews/{banner}' if banner else '/banner_video.png'
+        await _broadcast_message(room_id, room, {
             "sender": "System",
             "pfp": "/system_avatar.png",
             "text": f"""
@@ -141,74 +354,197 @@ async def set_video(sid, video_name):
             """
         })
 
+        _spawn(_announce_seek_previews(room_id, video_name))
+
+
+async def _announce_seek_previews(room_id, video_name):
+    """Gera (se preciso) os sprites de pré-visualização e avisa a sala quando estiverem prontos."""
+    url = await ensure_seek_previews(video_name)
+    room = await load_room(room_id) if url else None
+    if room and room["current_video"] == video_name:
+        await sio.emit('seek_previews_ready', {"video": video_name, "src": url}, to=room_id)
+
+
+def _number(value, positive=False):
+    """Valor numérico enviado pelo cliente, ou None se inválido."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != value:
+        return None
+    if value < 0 or (positive and value == 0):
+        return None
+    return float(value)
+
 
 @sio.on("host_sync")
 async def host_sync_event(sid, data):
-    # data = {"type": "play" | "pause" | "seek", "time": 123.45}
-    if sid != server_state["host_sid"]:
+    # data = {"type": "play" | "pause" | "seek" | "rate", "time": 123.45, "rate": 1.0}
+    if not isinstance(data, dict):
+        return
+    room_id = await sid_room(sid)
+    if room_id is None:
         return
 
-    # Atualiza estado do servidor
-    if data["type"] == "play":
-        server_state["is_paused"] = False
-    elif data["type"] == "pause":
-        server_state["is_paused"] = True
+    def sync(room):
+        if sid != room["host_sid"]:
+            return False
+        # Reancora o relógio da sala
+        paused = {"play": False, "pause": True}.get(data.get("type"))
+        anchor_playback(room, _number(data.get("time")), paused=paused, rate=_number(data.get("rate"), positive=True))
+        room["host_polled_at"] = time.time()
+        return True
+
+    _, synced = await update_room(room_id, sync)
+    if synced:
+        # Transmite o estado para todos da sala, *exceto* o host
+        await _schedule_sync_broadcast(room_id)
+
+
+async def _broadcast_room_state(room_id) -> bool:
+    room = await load_room(room_id)
+    if room is None:
+        return False
+    await sio.emit('sync_event', {
+        "type": "state",
+        "time": round(current_position(room), 3),
+        "paused": room["is_paused"],
+        "rate": room["playback_rate"]
+    }, to=room_id, skip_sid=room["host_sid"])
+    return True
+
+
+async def _schedule_sync_broadcast(room_id):
+    window = _sync_windows.get(room_id)
+    if window is not None:
+        # Já existe uma janela aberta: o estado mais recente sai quando ela fechar
+        window["dirty"] = True
+        return
+    _sync_windows[room_id] = {"dirty": False}
+    await _broadcast_room_state(room_id)
+    _spawn(_close_sync_window(room_id))
 
-    if "time" in data:
-        server_state["current_time"] = data["time"]
 
-    # Transmite o evento para todos, *exceto* o host que enviou
-    await sio.emit('sync_event', data, skip_sid=sid)
+async def _close_sync_window(room_id):
+    try:
+        while True:
+            await asyncio.sleep(SYNC_COALESCE_WINDOW)
+            window = _sync_windows[room_id]
+            if not window["dirty"]:
+                return
+            window["dirty"] = False
+            # A sala pode ter sido removida durante a janela
+            if not await _broadcast_room_state(room_id):
+                return
+    finally:
+        _sync_windows.pop(room_id, None)
 
 
 # --- Eventos de Transmissão de Tela ---
 
 @sio.on("start_screen_share")
 async def handle_start_screen_share(sid):
-    if sid != server_state.get("host_sid"):
+    room_id = await sid_room(sid)
+    if room_id is None:
         return
 
-    print(f"Host {sid} iniciou a transmissão de tela.")
-    server_state["is_screen_sharing"] = True
-    server_state["current_video"] = "screen-share"
-    server_state["is_paused"] = False
+    def start(room):
+        if sid != room.get("host_sid"):
+            return False
+        room["is_screen_sharing"] = True
+        room["current_video"] = "screen-share"
+        anchor_playback(room, 0, paused=False)
+        return True
+
+    room, started = await update_room(room_id, start)
+    if not started:
+        return
+    metrics.log_event("screen_share_started", sid=sid, room=room_id)
 
-    # Notify all other clients that screen sharing has started
-    await sio.emit('sync_event', {"type": "set_video", "video": "screen-share"}, skip_sid=sid)
+    # Notify all other clients in the room that screen sharing has started
+    await sio.emit('sync_event', {"type": "set_video", "video": "screen-share"}, to=room_id, skip_sid=sid)
 
     # Tell host to initiate WebRTC connection to each peer
-    for peer_sid in server_state["users"]:
+    for peer_sid in room["users"]:
         if peer_sid != sid:
             await sio.emit('initiate_screen_share_to_peer', {'target_sid': peer_sid}, to=sid)
 
 @sio.on("stop_screen_share")
 async def handle_stop_screen_share(sid):
-    if sid != server_state.get("host_sid"):
+    room_id = await sid_room(sid)
+    if room_id is None:
         return
-    print(f"Host {sid} parou a transmissão de tela.")
-    server_state["is_screen_sharing"] = False
-    server_state["current_video"] = None
-    await sio.emit('screen_share_stopped')
+
+    def stop(room):
+        if sid != room.get("host_sid"):
+            return False
+        room["is_screen_sharing"] = False
+        room["current_video"] = None
+        return True
+
+    _, stopped = await update_room(room_id, stop)
+    if stopped:
+        metrics.log_event("screen_share_stopped", sid=sid, room=room_id)
+        await sio.emit('screen_share_stopped', to=room_id)
 
 
 @sio.on("request_sync")
 async def handle_client_sync_request(sid):
     """
     Chamado por um cliente que deseja verificar se seu tempo está correto.
-    O servidor responde com o estado atual para que o cliente possa se corrigir.
+    O servidor responde na hora com a posição calculada pelo relógio da sala.
     """
+    now = time.monotonic()
+    if now - _last_sync_requests.get(sid, 0.0) < SYNC_REQUEST_MIN_INTERVAL:
+        SYNC_REQUESTS_THROTTLED.inc()
+        return
+    _last_sync_requests[sid] = now
+
+    room_id, room = await room_of(sid)
+    if room is None:
+        return
+
     # Só responde se houver um host e um vídeo tocando
-    host_sid = server_state.get("host_sid")
-    if host_sid is None or server_state.get("current_video") is None:
+    if room.get("host_sid") is None or room.get("current_video") is None:
         return
 
-    try:
-        host_state = await sio.call('get_host_time', to=host_sid, timeout=2)
+    await sio.emit('force_sync', {
+        "time": current_position(room),
+        "paused": room["is_paused"],
+        "rate": room["playback_rate"]
+    }, to=sid)
 
-        server_state["current_time"] = host_state["time"]
-        server_state["is_paused"] = host_state["paused"]
+    if not room["host_poll_pending"] and time.time() - room["host_polled_at"] > HOST_POLL_INTERVAL:
+        def claim_poll(room):
+            # Confere de novo dentro da transação: só um pedido (de qualquer worker) consulta o host
+            if room["host_poll_pending"] or time.time() - room["host_polled_at"] <= HOST_POLL_INTERVAL:
+                return None
+            room["host_poll_pending"] = True
+            return room["host_sid"]
 
-        await sio.emit('force_sync', host_state, to=sid)
+        _, host_sid = await update_room(room_id, claim_poll)
+        if host_sid:
+            _spawn(_poll_host_clock(room_id, host_sid))
 
+
+async def _poll_host_clock(room_id, host_sid):
+    """Corrige o drift do relógio da sala com o tempo real do player do host."""
+    host_state = None
+    try:
+        host_state = await sio.call('get_host_time', to=host_sid, timeout=HOST_POLL_TIMEOUT)
+        HOST_TIME_CALLS.inc("ok")
+    except SocketTimeoutError:
+        HOST_TIME_CALLS.inc("timeout")
+        metrics.log_event("host_time_timeout", level=logging.WARNING, room=room_id, sid=host_sid,
+                          timeout=HOST_POLL_TIMEOUT)
     except Exception as e:
-        print(f"Não foi possível obter o tempo do host ({host_sid}): {e}")
+        HOST_TIME_CALLS.inc("error")
+        metrics.log_event("host_time_failed", level=logging.WARNING, room=room_id, sid=host_sid, error=repr(e))
+
+    def apply(room):
+        # O host pode ter mudado enquanto esperávamos
+        if isinstance(host_state, dict) and room["host_sid"] == host_sid:
+            anchor_playback(room, _number(host_state.get("time")), paused=bool(host_state.get("paused")),
+                            rate=_number(host_state.get("rate"), positive=True))
+        room["host_polled_at"] = time.time()
+        room["host_poll_pending"] = False
+
+    # Se a sala esvaziou nesse meio tempo, não há nada para atualizar
+    await update_room(room_id, apply)
@@ -1,8 +1,117 @@
+import re
+import time
 
-server_state = {
-    "current_video": None,
-    "is_paused": True,
-    "current_time": 0,
-    "host_sid": None,
-    "users": {}
-}
+from config import STATE_BACKEND, REDIS_URL
+from state_backend import create_backend
+
+# --- Registro de Salas ---
+# Cada sala (party) tem seu próprio host, vídeo, relógio e usuários.
+# O id da sala também é o nome da room do python-socketio, então um
+# sio.emit(..., to=room_id) alcança apenas os membros daquela sala.
+
+DEFAULT_ROOM = "default"
+_ROOM_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Onde ficam as salas e o mapa sid -> sala (ver state_backend). Com um backend
+# persistente load_room/room_of devolvem cópias: alterações só valem via update_room.
+backend = create_backend(STATE_BACKEND, REDIS_URL)
+
+
+def new_room_state():
+    return {
+        "current_video": None,
+        "is_paused": True,
+        # Relógio da sala: current_time é a posição no instante anchor_time
+        # (time.time()); enquanto toca, avança playback_rate s por segundo. É
+        # relógio de parede, e não monotonic, porque a âncora é compartilhada
+        # entre workers e sobrevive a restarts.
+        "current_time": 0,
+        "anchor_time": None,
+        "playback_rate": 1.0,
+        "host_polled_at": 0.0,
+        "host_poll_pending": False,
+        "host_sid": None,
+        "is_screen_sharing": False,
+        "users": {},
+        # Incrementada a cada presence_delta; o cliente pede um snapshot se pular uma versão
+        "presence_version": 0
+    }
+
+
+def current_position(room) -> float:
+    """Posição atual do vídeo da sala, calculada pelo relógio (sem consultar o host)."""
+    if room["is_paused"] or room["anchor_time"] is None:
+        return room["current_time"]
+    return room["current_time"] + (time.time() - room["anchor_time"]) * room["playback_rate"]
+
+
+def anchor_playback(room, position=None, paused=None, rate=None):
+    """
+    Reancora o relógio da sala no instante atual. Sem `position`, mantém a
+    posição calculada até agora (ex. um pause sem tempo informado).
+    """
+    room["current_time"] = current_position(room) if position is None else position
+    if paused is not None:
+        room["is_paused"] = paused
+    if rate is not None:
+        room["playback_rate"] = rate
+    room["anchor_time"] = time.time()
+
+
+def normalize_room_id(room_id) -> str:
+    """Valida o id da sala enviado pelo cliente, caindo na sala padrão se for inválido."""
+    if isinstance(room_id, str):
+        room_id = room_id.strip()
+        if _ROOM_ID_RE.match(room_id):
+            return room_id
+    return DEFAULT_ROOM
+
+
+async def load_room(room_id) -> dict | None:
+    """Estado atual da sala (somente leitura: alterações passam por update_room)."""
+    return await backend.load_room(room_id)
+
+
+async def update_room(room_id, mutate, create=False):
+    """
+    Aplica mutate(room) à sala de forma atômica, mesmo com vários workers, e
+    grava o resultado. Retorna (sala, valor retornado por mutate), ou
+    (None, None) se a sala não existe e create é False.
+    """
+    return await backend.update_room(room_id, mutate, new_room_state if create else None)
+
+
+async def discard_room_if_empty(room_id):
+    await backend.delete_room_if_empty(room_id)
+
+
+async def room_of(sid):
+    """Retorna (room_id, estado) da sala em que o sid entrou, ou (None, None)."""
+    room_id = await backend.get_sid_room(sid)
+    if room_id is None:
+        return None, None
+    room = await backend.load_room(room_id)
+    if room is None:
+        return None, None
+    return room_id, room
+
+
+async def sid_room(sid) -> str | None:
+    return await backend.get_sid_room(sid)
+
+
+async def set_sid_room(sid, room_id):
+    await backend.set_sid_room(sid, room_id)
+
+
+async def clear_sid_room(sid):
+    await backend.delete_sid_room(sid)
+
+
+async def reset_presence():
+    """
+    Chamado uma vez ao iniciar o servidor: mantém vídeo e posição das salas
+    persistidas, mas remove usuários e host, que reentram ao reconectar.
+    """
+    await backend.reset_presence()
+    await backend.close()
@@ -0,0 +1,397 @@
+import json
+import os
+import sqlite3
+import threading
+from collections import deque
+
+from config import data_path
+from executors import run_in
+
+# --- Backends do Estado das Salas ---
+# O estado de cada sala (ver state.new_room_state) e o mapa sid -> sala ficam atrás
+# desta interface, para que vários workers (uvicorn --workers N) enxerguem as
+# mesmas salas e para que um restart não derrube as parties em andamento.
+#
+#   memory -> dicionários no próprio processo (um único worker)
+#   sqlite -> arquivo em DATA_DIR, compartilhado pelos workers da mesma máquina
+#   redis  -> servidor Redis (ou compatível), compartilhado entre máquinas
+#
+# Alterações passam sempre por update_room(room_id, mutate, default): mutate(room)
+# roda dentro de uma transação e o valor que ela retorna volta para quem chamou.
+# No Redis a transação pode ser repetida, então mutate não deve ter efeitos
+# colaterais além de alterar a sala.
+#
+# O histórico do chat de cada sala (ver chat_history) fica no mesmo backend, fora
+# do estado da sala para não ser regravado a cada evento: append_chat numera e
+# guarda a mensagem e remove as mais antigas além dos limites, chat_page lê uma
+# página, e delete_room_if_empty apaga o histórico junto com a sala.
+
+SQLITE_PATH = data_path("rooms.sqlite3")
+REDIS_PREFIX = "watchparty:"
+
+
+def _dump_message(message) -> tuple[str, int]:
+    data = json.dumps(message)
+    return data, len(data.encode("utf-8"))
+
+
+def without_presence(room):
+    """
+    Estado da sala sem usuários nem host: depois de um restart os sids antigos
+    não existem mais, e os clientes entram de novo ao reconectar.
+    """
+    room.update({"users": {}, "host_sid": None, "is_screen_sharing": False,
+                 "host_poll_pending": False, "presence_version": room.get("presence_version", 0) + 1})
+    if room.get("current_video") == "screen-share":
+        room["current_video"] = None
+    return room
+
+
+class MemoryStateBackend:
+    def __init__(self):
+        self.rooms = {}      # room_id -> estado da sala
+        self.sid_rooms = {}  # sid -> room_id
+        self.chats = {}      # room_id -> {"messages": deque de (mensagem, bytes), "bytes": int, "next_id": int}
+
+    async def load_room(self, room_id):
+        return self.rooms.get(room_id)
+
+    async def update_room(self, room_id, mutate, default=None):
+        room = self.rooms.get(room_id)
+        if room is None:
+            if default is None:
+                return None, None
+            room = self.rooms[room_id] = default()
+        return room, mutate(room)
+
+    async def delete_room_if_empty(self, room_id):
+        room = self.rooms.get(room_id)
+        if room is not None and not room["users"]:
+            del self.rooms[room_id]
+            self.chats.pop(room_id, None)
+
+    async def append_chat(self, room_id, message, max_messages, max_bytes):
+        chat = self.chats.setdefault(room_id, {"messages": deque(), "bytes": 0, "next_id": 1})
+        message = {"id": chat["next_id"], **message}
+        chat["next_id"] += 1
+        size = _dump_message(message)[1]
+        chat["messages"].append((message, size))
+        chat["bytes"] += size
+
+        # Remove as mais antigas até caber nos limites
+        evicted = 0
+        while (len(chat["messages"]) > max_messages or chat["bytes"] > max_bytes) and len(chat["messages"]) > 1:
+            chat["bytes"] -= chat["messages"].popleft()[1]
+            evicted += 1
+        return message, evicted
+
+    async def chat_page(self, room_id, before, limit):
+        chat = self.chats.get(room_id)
+        if chat is None:
+            return [], False
+        messages = chat["messages"]
+        end = len(messages)
+        if before is not None:
+            # Os ids são crescentes e contíguos dentro do buffer
+            end = 0 if not messages else max(0, min(end, before - messages[0][0]["id"]))
+        start = max(0, end - limit)
+        return [messages[i][0] for i in range(start, end)], start > 0
+
+    async def chat_usage(self):
+        return {"rooms": len(self.chats),
+                "messages": sum(len(chat["messages"]) for chat in self.chats.values()),
+                "bytes": sum(chat["bytes"] for chat in self.chats.values())}
+
+    async def get_sid_room(self, sid):
+        return self.sid_rooms.get(sid)
+
+    async def set_sid_room(self, sid, room_id):
+        self.sid_rooms[sid] = room_id
+
+    async def delete_sid_room(self, sid):
+        self.sid_rooms.pop(sid, None)
+
+    async def reset_presence(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class SqliteStateBackend:
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+
+    def _get_db(self):
+        # Cada processo (worker) abre a sua própria conexão; transações explícitas
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=10, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS rooms (room_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS sid_rooms (sid TEXT PRIMARY KEY, room_id TEXT NOT NULL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS chat_messages (room_id TEXT NOT NULL, id INTEGER NOT NULL, "
+                             "size INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (room_id, id))")
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._get_db().execute(sql, params).fetchone()
+
+    def _query_all(self, sql, params=()):
+        with self._lock:
+            return self._get_db().execute(sql, params).fetchall()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            self._get_db().execute(sql, params)
+
+    def _update_room(self, room_id, mutate, default):
+        with self._lock:
+            db = self._get_db()
+            # IMMEDIATE: trava a escrita já na leitura, para que outro worker não intercale
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT data FROM rooms WHERE room_id = ?", (room_id,)).fetchone()
+                room = json.loads(row[0]) if row else (default() if default else None)
+                if room is None:
+                    db.execute("ROLLBACK")
+                    return None, None
+                result = mutate(room)
+                db.execute("INSERT OR REPLACE INTO rooms (room_id, data) VALUES (?, ?)", (room_id, json.dumps(room)))
+                db.execute("COMMIT")
+                return room, result
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+    def _delete_room_if_empty(self, room_id):
+        with self._lock:
+            db = self._get_db()
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM rooms WHERE room_id = ? AND json_extract(data, '$.users') = '{}'", (room_id,))
+            db.execute("DELETE FROM chat_messages WHERE room_id = ? AND NOT EXISTS "
+                       "(SELECT 1 FROM rooms WHERE room_id = ?)", (room_id, room_id))
+            db.execute("COMMIT")
+
+    def _append_chat(self, room_id, message, max_messages, max_bytes):
+        with self._lock:
+            db = self._get_db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                last_id = db.execute("SELECT MAX(id) FROM chat_messages WHERE room_id = ?", (room_id,)).fetchone()[0]
+                message = {"id": (last_id or 0) + 1, **message}
+                data, size = _dump_message(message)
+                db.execute("INSERT INTO chat_messages (room_id, id, size, data) VALUES (?, ?, ?, ?)",
+                           (room_id, message["id"], size, data))
+
+                # Remove as mais antigas até caber nos limites
+                rows = db.execute("SELECT id, size FROM chat_messages WHERE room_id = ? ORDER BY id",
+                                  (room_id,)).fetchall()
+                count, total = len(rows), sum(row[1] for row in rows)
+                evicted = 0
+                while (count - evicted > max_messages or total > max_bytes) and count - evicted > 1:
+                    total -= rows[evicted][1]
+                    evicted += 1
+                if evicted:
+                    db.execute("DELETE FROM chat_messages WHERE room_id = ? AND id <= ?",
+                               (room_id, rows[evicted - 1][0]))
+                db.execute("COMMIT")
+                return message, evicted
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+    async def load_room(self, room_id):
+        row = await run_in("state", self._query, "SELECT data FROM rooms WHERE room_id = ?", (room_id,))
+        return json.loads(row[0]) if row else None
+
+    async def update_room(self, room_id, mutate, default=None):
+        return await run_in("state", self._update_room, room_id, mutate, default)
+
+    async def delete_room_if_empty(self, room_id):
+        await run_in("state", self._delete_room_if_empty, room_id)
+
+    async def append_chat(self, room_id, message, max_messages, max_bytes):
+        return await run_in("state", self._append_chat, room_id, message, max_messages, max_bytes)
+
+    async def chat_page(self, room_id, before, limit):
+        rows = await run_in("state", self._query_all,
+                            "SELECT data FROM chat_messages WHERE room_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                            (room_id, before if before is not None else 2 ** 62, limit + 1))
+        return [json.loads(row[0]) for row in reversed(rows[:limit])], len(rows) > limit
+
+    async def chat_usage(self):
+        rooms, messages, size = await run_in("state", self._query, "SELECT COUNT(DISTINCT room_id), COUNT(*), "
+                                             "COALESCE(SUM(size), 0) FROM chat_messages")
+        return {"rooms": rooms, "messages": messages, "bytes": size}
+
+    async def get_sid_room(self, sid):
+        row = await run_in("state", self._query, "SELECT room_id FROM sid_rooms WHERE sid = ?", (sid,))
+        return row[0] if row else None
+
+    async def set_sid_room(self, sid, room_id):
+        await run_in("state", self._execute, "INSERT OR REPLACE INTO sid_rooms (sid, room_id) VALUES (?, ?)", (sid, room_id))
+
+    async def delete_sid_room(self, sid):
+        await run_in("state", self._execute, "DELETE FROM sid_rooms WHERE sid = ?", (sid,))
+
+    async def reset_presence(self):
+        # Roda uma única vez, antes de o servidor aceitar conexões
+        with self._lock:
+            db = self._get_db()
+            db.execute("BEGIN IMMEDIATE")
+            for room_id, data in db.execute("SELECT room_id, data FROM rooms").fetchall():
+                db.execute("UPDATE rooms SET data = ? WHERE room_id = ?",
+                           (json.dumps(without_presence(json.loads(data))), room_id))
+            db.execute("DELETE FROM sid_rooms")
+            db.execute("COMMIT")
+
+    async def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class RedisStateBackend:
+    def __init__(self, url):
+        self.url = url
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            import redis.asyncio as redis  # dependência opcional, só para este backend
+            self._client = redis.from_url(self.url, decode_responses=True)
+        return self._client
+
+    def _room_key(self, room_id):
+        return f"{REDIS_PREFIX}room:{room_id}"
+
+    def _chat_keys(self, room_id):
+        """(lista de mensagens em JSON, último id, total de bytes da lista)"""
+        return (f"{REDIS_PREFIX}chat:{room_id}", f"{REDIS_PREFIX}chat_id:{room_id}",
+                f"{REDIS_PREFIX}chat_bytes:{room_id}")
+
+    async def load_room(self, room_id):
+        data = await self._get_client().get(self._room_key(room_id))
+        return json.loads(data) if data else None
+
+    async def update_room(self, room_id, mutate, default=None):
+        from redis.exceptions import WatchError
+
+        key = self._room_key(room_id)
+        async with self._get_client().pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    data = await pipe.get(key)
+                    room = json.loads(data) if data else (default() if default else None)
+                    if room is None:
+                        await pipe.unwatch()
+                        return None, None
+                    result = mutate(room)
+                    pipe.multi()
+                    pipe.set(key, json.dumps(room))
+                    await pipe.execute()
+                    return room, result
+                except WatchError:
+                    continue  # outro worker alterou a sala no meio: tenta de novo
+
+    async def delete_room_if_empty(self, room_id):
+        from redis.exceptions import WatchError
+
+        key = self._room_key(room_id)
+        async with self._get_client().pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                data = await pipe.get(key)
+                if not data or json.loads(data)["users"]:
+                    await pipe.unwatch()
+                    return
+                pipe.multi()
+                pipe.delete(key, *self._chat_keys(room_id))
+                await pipe.execute()
+            except WatchError:
+                pass  # alguém entrou na sala nesse meio tempo
+
+    async def append_chat(self, room_id, message, max_messages, max_bytes):
+        from redis.exceptions import WatchError
+
+        messages_key, id_key, bytes_key = self._chat_keys(room_id)
+        client = self._get_client()
+        # O id e o RPUSH vão na mesma transação: a lista fica sempre em ordem de id
+        async with client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(id_key)
+                    message = {"id": int(await pipe.get(id_key) or 0) + 1, **message}
+                    data, size = _dump_message(message)
+                    pipe.multi()
+                    pipe.set(id_key, message["id"])
+                    pipe.rpush(messages_key, data)
+                    pipe.incrby(bytes_key, size)
+                    await pipe.execute()
+                    break
+                except WatchError:
+                    continue  # outro worker guardou uma mensagem no meio: tenta de novo
+
+        # Remove as mais antigas até caber nos limites; cada LPOP desconta o próprio tamanho
+        evicted = 0
+        while True:
+            count, total = await client.llen(messages_key), int(await client.get(bytes_key) or 0)
+            if count <= 1 or (count <= max_messages and total <= max_bytes):
+                break
+            data = await client.lpop(messages_key)
+            if data is None:
+                break
+            await client.decrby(bytes_key, len(data.encode("utf-8")))
+            evicted += 1
+        return message, evicted
+
+    async def chat_page(self, room_id, before, limit):
+        # A lista já é limitada pelo histórico (poucas centenas de mensagens)
+        messages = [json.loads(data) for data in await self._get_client().lrange(self._chat_keys(room_id)[0], 0, -1)]
+        if before is not None:
+            messages = [message for message in messages if message["id"] < before]
+        start = max(0, len(messages) - limit)
+        return messages[start:], start > 0
+
+    async def chat_usage(self):
+        return None  # exigiria varrer todas as chaves do Redis
+
+    async def get_sid_room(self, sid):
+        return await self._get_client().get(f"{REDIS_PREFIX}sid:{sid}")
+
+    async def set_sid_room(self, sid, room_id):
+        await self._get_client().set(f"{REDIS_PREFIX}sid:{sid}", room_id)
+
+    async def delete_sid_room(self, sid):
+        await self._get_client().delete(f"{REDIS_PREFIX}sid:{sid}")
+
+    async def reset_presence(self):
+        client = self._get_client()
+        async for key in client.scan_iter(f"{REDIS_PREFIX}sid:*"):
+            await client.delete(key)
+        async for key in client.scan_iter(f"{REDIS_PREFIX}room:*"):
+            data = await client.get(key)
+            if data:
+                await client.set(key, json.dumps(without_presence(json.loads(data))))
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def create_backend(name, redis_url=None):
+    if name == "sqlite":
+        return SqliteStateBackend()
+    if name == "redis":
+        return RedisStateBackend(redis_url)
+    if name != "memory":
+        print(f"Aviso: backend de estado '{name}' desconhecido. Usando 'memory'.")
+    return MemoryStateBackend()
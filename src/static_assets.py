@@ -0,0 +1,198 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+
+from starlette.responses import Response
+
+import metrics
+from config import FILES_DIR
+
+try:
+    import brotli  # opcional: sem ele os arquivos saem só com gzip
+except ImportError:
+    brotli = None
+
+# --- Arquivos Estáticos do Cliente ---
+# Na inicialização todo o FILES_DIR é lido para a memória. Cada arquivo recebe um
+# hash do seu conteúdo e do conteúdo de tudo que ele importa. Os imports dos
+# módulos JS e os src/href das páginas são reescritos para "arquivo?v=<hash>", e
+# essas URLs voltam com cache imutável. Páginas e URLs sem o hash certo são
+# revalidadas (ETag forte, 304). Textos grandes já ficam comprimidos em gzip e
+# brotli, e as páginas ganham <link rel="modulepreload"> para todo o grafo de
+# módulos, em vez de descobri-lo um import por vez.
+# Alterações em FILES_DIR só valem depois de reiniciar o servidor.
+
+COMPRESSIBLE_EXTENSIONS = {".html", ".js", ".css", ".svg", ".json", ".txt", ".vtt"}
+MIN_COMPRESS_BYTES = 1024
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+# import x from './a.js' | import './a.js' | import('./a.js') | export { x } from './a.js'
+_JS_IMPORT_RE = re.compile(r"""(\bimport\s*\(?\s*|\bfrom\s*)(['"])(\.{1,2}/[^'"?#]+)\2""")
+# src="..." / href="..." locais (sem esquema, como https: ou data:)
+_HTML_REF_RE = re.compile(r"""(\s(?:src|href)=)(["'])([^"':?#]+)\2""")
+_MODULE_SCRIPT_RE = re.compile(r"""<script\b[^>]*\btype=["']module["'][^>]*\bsrc=["']([^"':?#]+)["']""")
+
+_assets = {}  # caminho relativo (com "/") -> {"body", "gzip", "br", "hash", "media_type", "compressible"}
+
+mimetypes.add_type("text/javascript", ".js")  # o registro do Windows às vezes diz text/plain
+
+
+def _read_sources() -> dict[str, bytes]:
+    sources = {}
+    for dirpath, _, filenames in os.walk(FILES_DIR):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            rel = os.path.relpath(path, FILES_DIR).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                sources[rel] = f.read()
+    return sources
+
+
+def _resolve(from_rel: str, ref: str) -> str:
+    if ref.startswith("/"):
+        return posixpath.normpath(ref.lstrip("/"))
+    return posixpath.normpath(posixpath.join(posixpath.dirname(from_rel), ref))
+
+
+def _references(rel: str, text: str) -> list[str]:
+    """Arquivos locais citados por um .js (imports) ou .html (src/href)."""
+    if rel.endswith(".js"):
+        return [_resolve(rel, m.group(3)) for m in _JS_IMPORT_RE.finditer(text)]
+    if rel.endswith(".html"):
+        return [_resolve(rel, m.group(3)) for m in _HTML_REF_RE.finditer(text)]
+    return []
+
+
+def _closure(rel: str, graph: dict) -> set[str]:
+    """O arquivo e tudo que ele referencia, direta ou indiretamente (ciclos incluídos)."""
+    seen, pending = set(), [rel]
+    while pending:
+        current = pending.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        pending.extend(dep for dep in graph.get(current, ()) if dep in graph)
+    return seen
+
+
+def _compress(body: bytes) -> dict:
+    variants = {}
+    if len(body) < MIN_COMPRESS_BYTES:
+        return variants
+    compressed = gzip.compress(body, compresslevel=9, mtime=0)
+    if len(compressed) < len(body):
+        variants["gzip"] = compressed
+    if brotli is not None:
+        compressed = brotli.compress(body, quality=11)
+        if len(compressed) < len(body):
+            variants["br"] = compressed
+    return variants
+
+
+def build():
+    """Lê FILES_DIR e monta as versões reescritas e comprimidas. Bloqueante: pool 'disk'."""
+    sources = _read_sources()
+    texts = {rel: data.decode("utf-8") for rel, data in sources.items()
+             if rel.endswith((".js", ".html"))}
+    graph = {rel: [] for rel in sources}
+    for rel, text in texts.items():
+        graph[rel] = _references(rel, text)
+
+    # O hash cobre o próprio conteúdo e o de todas as dependências, então mudar um
+    # módulo muda a URL de quem o importa (e assim por diante até a página)
+    digests = {rel: hashlib.sha256(data).hexdigest() for rel, data in sources.items()}
+    hashes = {}
+    for rel in sources:
+        combined = "".join(f"{dep}:{digests[dep]}\n" for dep in sorted(_closure(rel, graph)))
+        hashes[rel] = hashlib.sha256(combined.encode("utf-8")).hexdigest()[:16]
+
+    def versioned(from_rel, match):
+        ref = match.group(3)
+        target = _resolve(from_rel, ref)
+        if target not in hashes:
+            return match.group(0)
+        return f"{match.group(1)}{match.group(2)}{ref}?v={hashes[target]}{match.group(2)}"
+
+    assets = {}
+    for rel, data in sources.items():
+        if rel in texts:
+            text = texts[rel]
+            if rel.endswith(".js"):
+                text = _JS_IMPORT_RE.sub(lambda m: versioned(rel, m), text)
+            else:
+                text = _add_modulepreload(rel, text, graph, hashes)
+                text = _HTML_REF_RE.sub(lambda m: versioned(rel, m), text)
+            data = text.encode("utf-8")
+
+        extension = os.path.splitext(rel)[1].lower()
+        media_type, _ = mimetypes.guess_type(rel)
+        compressible = extension in COMPRESSIBLE_EXTENSIONS
+        assets[rel] = {
+            "body": data,
+            "hash": hashes[rel],
+            "media_type": media_type or "application/octet-stream",
+            "compressible": compressible,
+            **(_compress(data) if compressible else {}),
+        }
+
+    _assets.clear()
+    _assets.update(assets)
+    total = sum(len(a["body"]) for a in assets.values())
+    compressed = sum(len(a.get("br", a.get("gzip", a["body"]))) for a in assets.values())
+    metrics.log_event("static_assets_built", files=len(assets), kb=total // 1024, compressed_kb=compressed // 1024)
+
+
+def _add_modulepreload(rel: str, text: str, graph: dict, hashes: dict) -> str:
+    """Antecipa, no <head>, o download de todos os módulos importados pelos <script type="module">."""
+    entries = [_resolve(rel, m.group(1)) for m in _MODULE_SCRIPT_RE.finditer(text)]
+    modules = set()
+    for entry in entries:
+        modules |= {dep for dep in _closure(entry, graph) if dep.endswith(".js")}
+    modules -= set(entries)
+    if not modules or "</head>" not in text:
+        return text
+    # Já com a versão: o _HTML_REF_RE não mexe em href com "?"
+    links = "".join(f'    <link rel="modulepreload" href="/{dep}?v={hashes[dep]}">\n' for dep in sorted(modules))
+    return text.replace("</head>", links + "</head>", 1)
+
+
+def _pick_encoding(accept_encoding: str, asset: dict) -> str | None:
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(coding.strip())
+    for encoding in ("br", "gzip"):
+        if encoding in asset and (encoding in accepted or "*" in accepted):
+            return encoding
+    return None
+
+
+def asset_response(request, rel: str) -> Response | None:
+    """Resposta para o arquivo `rel` de FILES_DIR, ou None se ele não existe."""
+    asset = _assets.get(rel)
+    if asset is None:
+        return None
+
+    encoding = _pick_encoding(request.headers.get("accept-encoding", ""), asset)
+    # ETag forte: cada codificação é uma representação diferente
+    etag = f'"{asset["hash"]}-{encoding}"' if encoding else f'"{asset["hash"]}"'
+    versioned = request.query_params.get("v") == asset["hash"]
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE if versioned else REVALIDATE_CACHE}
+    if asset["compressible"]:
+        headers["Vary"] = "Accept-Encoding"
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in tags or "*" in tags:
+            return Response(status_code=304, headers=headers)
+
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    body = asset[encoding] if encoding else asset["body"]
+    return Response(body, media_type=asset["media_type"], headers=headers)
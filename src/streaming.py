@@ -0,0 +1,358 @@
+import mmap
+import os
+import secrets
+import sys
+import time
+from email.utils import formatdate, parsedate_to_datetime
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+import metrics
+from executors import run_in
+
+# Quanto cada conexão pode ler à frente do que o cliente já consumiu.
+# O `send` do servidor ASGI aplica backpressure, então nunca há mais de um
+# bloco deste tamanho em memória por conexão.
+READ_AHEAD = 512 * 1024
+
+# Limite de intervalos num único pedido multipart (evita pedidos abusivos)
+MAX_RANGES = 16
+
+# Arquivos ainda sendo gravados (GrowingFileResponse): intervalo entre releituras
+# quando o leitor alcança o fim, e quanto um Range espera pelos bytes pedidos
+GROWING_POLL_INTERVAL = 0.5
+GROWING_RANGE_WAIT = 30
+
+STREAM_BYTES = metrics.Counter("watchparty_stream_bytes_total", "Bytes de arquivo enviados por rota.", ("route",))
+ACTIVE_STREAMS = metrics.Gauge("watchparty_active_streams", "Respostas de arquivo sendo enviadas agora, por rota.",
+                               ("route",))
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def make_etag(stat_result: os.stat_result) -> str:
+    """ETag forte derivado de inode, tamanho e mtime (ns) do arquivo."""
+    return f'"{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def parse_range_header(header: str, size: int) -> list[tuple[int, int]] | None:
+    """
+    Interpreta um cabeçalho `Range: bytes=...`.
+    Retorna uma lista de intervalos [start, end) ordenados e mesclados,
+    ou None se o cabeçalho for malformado (e deve ser ignorado, RFC 9110).
+    Levanta RangeNotSatisfiable se nenhum intervalo cabe no arquivo.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition("-")
+        if not sep:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) + 1 if last else size
+            else:
+                # Sufixo: "-500" = últimos 500 bytes
+                suffix = int(last)
+                if suffix == 0:
+                    continue
+                start, end = max(size - suffix, 0), size
+        except ValueError:
+            return None
+        if start < 0 or end <= start:
+            if first and last and int(last) < start:
+                return None
+            continue
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class RangeFileResponse(Response):
+    """
+    Resposta de arquivo com suporte completo a Range (206/416, multipart/byteranges),
+    If-Range e If-None-Match. O arquivo é mapeado em memória e enviado em blocos
+    de até READ_AHEAD bytes. (O uvicorn não implementa a extensão ASGI
+    `http.response.zerocopysend`, então não há envio por os.sendfile.)
+    """
+
+    def __init__(self, path: str, stat_result: os.stat_result, media_type: str | None = None,
+                 headers: dict | None = None, route: str = "video"):
+        self.path = path
+        self.route = route  # label das métricas de streaming
+        self.stat_result = stat_result
+        self.media_type = media_type or "application/octet-stream"
+        self.status_code = 200
+        self.background = None
+        self.init_headers(headers)
+        self.etag = make_etag(stat_result)
+        self.last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+        self.headers.setdefault("accept-ranges", "bytes")
+        self.headers.setdefault("etag", self.etag)
+        self.headers.setdefault("last-modified", self.last_modified)
+
+    def _if_range_matches(self, if_range: str) -> bool:
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            return if_range == self.etag
+        # Data (RFC 9110 §13.1.5): tem que ser igual ao Last-Modified, e ele só é um
+        # validador forte se o arquivo não mudou no último segundo
+        if time.time() - self.stat_result.st_mtime < 1:
+            return False
+        try:
+            return int(parsedate_to_datetime(if_range).timestamp()) == int(self.stat_result.st_mtime)
+        except (TypeError, ValueError):
+            return False
+
+    async def __call__(self, scope, receive, send):
+        request_headers = Headers(scope=scope)
+        size = self.stat_result.st_size
+        header_only = scope["method"].upper() == "HEAD"
+
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match and self.etag in [tag.strip() for tag in if_none_match.split(",")]:
+            await self._send_start(send, 304, [])
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        ranges = None
+        http_range = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if http_range and (if_range is None or self._if_range_matches(if_range)):
+            try:
+                ranges = parse_range_header(http_range, size)
+            except RangeNotSatisfiable:
+                await self._send_start(send, 416, [(b"content-range", f"bytes */{size}".encode())])
+                await send({"type": "http.response.body", "body": b""})
+                return
+            if ranges is not None and len(ranges) > MAX_RANGES:
+                ranges = None
+
+        if not ranges:
+            parts = [(None, 0, size)]
+            await self._send_start(send, 200, [(b"content-type", self.media_type.encode()),
+                                               (b"content-length", str(size).encode())])
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            parts = [(None, start, end)]
+            await self._send_start(send, 206, [
+                (b"content-type", self.media_type.encode()),
+                (b"content-range", f"bytes {start}-{end - 1}/{size}".encode()),
+                (b"content-length", str(end - start).encode()),
+            ])
+        else:
+            boundary = secrets.token_hex(12)
+            parts = []
+            length = 0
+            for start, end in ranges:
+                preamble = (f"--{boundary}\r\n"
+                            f"Content-Type: {self.media_type}\r\n"
+                            f"Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n").encode()
+                parts.append((preamble, start, end))
+                length += len(preamble) + (end - start) + 2
+            epilogue = f"--{boundary}--\r\n".encode()
+            length += len(epilogue)
+            parts.append((epilogue, 0, 0))
+            await self._send_start(send, 206, [
+                (b"content-type", f"multipart/byteranges; boundary={boundary}".encode()),
+                (b"content-length", str(length).encode()),
+            ])
+
+        if header_only or size == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        ACTIVE_STREAMS.inc(self.route)
+        try:
+            async with anyio.create_task_group() as task_group:
+                async def stream():
+                    await self._send_parts(send, parts)
+                    task_group.cancel_scope.cancel()
+
+                task_group.start_soon(stream)
+                while (await receive())["type"] != "http.disconnect":
+                    pass
+                task_group.cancel_scope.cancel()
+        finally:
+            ACTIVE_STREAMS.dec(self.route)
+
+    async def _send_start(self, send, status: int, extra_headers: list):
+        skip = {name for name, _ in extra_headers} | {b"content-length", b"content-type"}
+        headers = [(k, v) for k, v in self.raw_headers if k not in skip] + extra_headers
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+
+    async def _send_parts(self, send, parts):
+        multipart = parts[0][0] is not None
+
+        # Abrir e mapear pode bloquear no disco (ex. um HD externo acordando)
+        with await run_in("disk", _map_file, self.path) as mapped:
+            for preamble, start, end in parts:
+                if preamble:
+                    await send({"type": "http.response.body", "body": preamble, "more_body": True})
+                for offset in range(start, end, READ_AHEAD):
+                    stop = min(offset + READ_AHEAD, end)
+                    # Copiar da página mapeada pode bloquear no disco: faz isso numa thread
+                    chunk = await anyio.to_thread.run_sync(mapped.__getitem__, slice(offset, stop))
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                    STREAM_BYTES.inc(self.route, amount=len(chunk))
+                if multipart and end > start:
+                    await send({"type": "http.response.body", "body": b"\r\n", "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class GrowingFileResponse(Response):
+    """
+    Arquivo que ainda está sendo gravado (ex. um MP4 fragmentado saindo do
+    ffmpeg), enquanto done() retorna False. Sem Range (ou com "bytes=0-") o
+    corpo acompanha o arquivo até ele terminar: 200 sem Content-Length. Um Range
+    é respondido só com o que já foi gravado (206 com tamanho total "*"),
+    esperando até GROWING_RANGE_WAIT s pelos bytes pedidos. Sem ETag nem cache:
+    o conteúdo muda até o fim. Se o arquivo sumir antes de ser aberto (a gravação
+    terminou e ele foi movido), serve final_path.
+    """
+
+    def __init__(self, path: str, done, final_path: str | None = None, media_type: str | None = None,
+                 headers: dict | None = None, route: str = "video"):
+        self.path = path
+        self.done = done
+        self.final_path = final_path
+        self.route = route
+        self.media_type = media_type or "application/octet-stream"
+        self.status_code = 200
+        self.background = None
+        self.init_headers(headers)
+        self.headers.setdefault("accept-ranges", "bytes")
+        self.headers.setdefault("cache-control", "no-store")
+
+    def _requested_range(self, header: str | None) -> tuple[int, int | None] | None:
+        """(início, fim ou None se aberto) de um Range simples; None para ignorá-lo."""
+        if not header or header.split("=", 1)[-1].strip().startswith("-"):
+            return None  # sufixos ("-500") dependem do tamanho final, ainda desconhecido
+        try:
+            ranges = parse_range_header(header, sys.maxsize)
+        except RangeNotSatisfiable:
+            return None
+        if not ranges or len(ranges) > 1:
+            return None
+        start, end = ranges[0]
+        end = None if end == sys.maxsize else end
+        return None if start == 0 and end is None else (start, end)
+
+    async def __call__(self, scope, receive, send):
+        requested = self._requested_range(Headers(scope=scope).get("range"))
+        header_only = scope["method"].upper() == "HEAD"
+        file = await run_in("disk", _open_first, self.path, self.final_path)
+
+        try:
+            if requested is None:
+                await self._send_start(send, 200, [(b"content-type", self.media_type.encode())])
+                start, end = 0, None
+            else:
+                start, end = requested
+                deadline = time.monotonic() + GROWING_RANGE_WAIT
+                while True:
+                    finished = self.done()
+                    written = await run_in("disk", _file_size, file)
+                    if written > start or finished or time.monotonic() > deadline:
+                        break
+                    await anyio.sleep(GROWING_POLL_INTERVAL)
+                total = str(written) if finished else "*"
+                if start >= written:
+                    await self._send_start(send, 416, [(b"content-range", f"bytes */{total}".encode())])
+                    await send({"type": "http.response.body", "body": b""})
+                    return
+                end = min(end or written, written)
+                await self._send_start(send, 206, [
+                    (b"content-type", self.media_type.encode()),
+                    (b"content-range", f"bytes {start}-{end - 1}/{total}".encode()),
+                    (b"content-length", str(end - start).encode()),
+                ])
+
+            if header_only:
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+            ACTIVE_STREAMS.inc(self.route)
+            try:
+                async with anyio.create_task_group() as task_group:
+                    async def stream():
+                        await self._follow(send, file, start, end)
+                        task_group.cancel_scope.cancel()
+
+                    task_group.start_soon(stream)
+                    while (await receive())["type"] != "http.disconnect":
+                        pass
+                    task_group.cancel_scope.cancel()
+            finally:
+                ACTIVE_STREAMS.dec(self.route)
+        finally:
+            await run_in("disk", file.close)
+
+    async def _send_start(self, send, status: int, extra_headers: list):
+        skip = {name for name, _ in extra_headers} | {b"content-length", b"content-type"}
+        headers = [(k, v) for k, v in self.raw_headers if k not in skip] + extra_headers
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+
+    async def _follow(self, send, file, start: int, end: int | None):
+        offset = start
+        while end is None or offset < end:
+            # Lido antes do bloco: o que foi gravado até done() virar True ainda é enviado
+            finished = self.done()
+            size = READ_AHEAD if end is None else min(READ_AHEAD, end - offset)
+            chunk = await anyio.to_thread.run_sync(_read_at, file, offset, size)
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                STREAM_BYTES.inc(self.route, amount=len(chunk))
+                offset += len(chunk)
+            elif finished:
+                break
+            else:
+                await anyio.sleep(GROWING_POLL_INTERVAL)
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def _open_first(path: str, fallback: str | None):
+    try:
+        return open(path, "rb")
+    except FileNotFoundError:
+        if fallback is None:
+            raise
+        return open(fallback, "rb")
+
+
+def _file_size(file) -> int:
+    return os.fstat(file.fileno()).st_size
+
+
+def _read_at(file, offset: int, size: int) -> bytes:
+    file.seek(offset)
+    return file.read(size)
+
+
+def _map_file(path: str) -> mmap.mmap:
+    """Mapeia o arquivo inteiro para leitura (o mapa continua válido depois de fechar o arquivo)."""
+    with open(path, "rb") as file:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
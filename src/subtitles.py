@@ -0,0 +1,288 @@
+import asyncio
+import logging
+import os
+import re
+import subprocess
+import tempfile
+from urllib.parse import quote
+
+import library_index
+import media_probe
+import metrics
+from config import CACHE_DIR, VIDEO_DIR, SUBTITLE_CACHE_MB
+from disk_cache import DiskCache
+from executors import run_in
+from thumbnails import FFMPEG
+
+# --- Legendas sob Demanda ---
+# /api/get_subtitles lista, além dos .vtt já extraídos pelo make_captions.py, as
+# legendas avulsas (.srt/.ass/.ssa/.vtt ao lado do vídeo ou em .subs) e as
+# trilhas de texto embutidas no vídeo (lidas pelo ffprobe). O que não é WebVTT
+# é convertido na primeira vez que é pedido, em segundo plano, e fica num
+# DiskCache indexado por (arquivo, tamanho, mtime, trilha). Ao listar as
+# legendas de um vídeo, as trilhas embutidas já começam a ser extraídas (numa
+# única leitura do arquivo), então só os vídeos assistidos pagam esse custo.
+
+MAX_JOBS = 2                # conversões simultâneas
+TRACK_WAIT_TIMEOUT = 20     # s que um pedido de trilha espera pela conversão
+TEXT_SUBTITLE_CODECS = {"subrip", "ass", "ssa", "webvtt", "mov_text", "text"}
+# Trilhas: "s<n>" = n-ésima legenda embutida (como 0:s:n no ffmpeg e track_<n> no
+# make_captions), "file:<nome>" = ao lado do vídeo, "subs:<nome>" = na pasta .subs
+TRACK_RE = re.compile(r"^(?:s(\d{1,3})|(file|subs):([^/\\]+))$")
+_TRACK_INDEX_RE = re.compile(r"\.track_(\d+)\.")
+_SRT_TIMESTAMP_RE = re.compile(r"(\d{1,2}:\d{2}:\d{2}),(\d{3})")
+
+cache = DiskCache("subtitles", SUBTITLE_CACHE_MB * 1024 * 1024)
+_jobs = {}          # chave do cache -> asyncio.Task
+_processes = set()  # ffmpeg em execução (encerrados no shutdown)
+_job_slots = asyncio.Semaphore(MAX_JOBS)
+
+
+def _convertible(filename: str) -> bool:
+    extension = os.path.splitext(filename)[1].lower()
+    return extension == ".srt" or (extension in (".ass", ".ssa") and FFMPEG is not None)
+
+
+def _lang_from_name(filename: str, default: str) -> str:
+    parts = os.path.splitext(filename)[0].split('.')
+    if len(parts) > 2:
+        return parts[-1] if len(parts[-1]) == 2 else parts[-2]
+    return default
+
+
+def _sidecar_lang(base_name: str, filename: str) -> str:
+    """Idioma de "Filme.pt.srt" / "Filme.forced.pt-BR.srt"; "und" se o nome não diz."""
+    suffixes = os.path.splitext(filename)[0][len(base_name):].split('.')
+    for part in reversed(suffixes):
+        if re.fullmatch(r"[A-Za-z]{2,3}(?:-[A-Za-z]{2})?", part):
+            return part
+    return "und"
+
+
+def track_url(rel_video: str, track: str) -> str:
+    return f"/api/subtitle_track/{quote(rel_video.replace(os.sep, '/'))}?track={quote(track)}"
+
+
+def _file_url(*parts: str) -> str:
+    return os.path.join("/videos", *parts).replace("\\", "/")
+
+
+# --- Listagem ---
+
+async def list_tracks(rel_video: str, entry: dict) -> list[dict]:
+    """Legendas do vídeo ({lang, label, src}) a partir da entrada do índice da pasta."""
+    rel_dir = os.path.dirname(rel_video)
+    base_name = os.path.splitext(os.path.basename(rel_video))[0]
+    tracks, extracted = [], set()
+
+    for filename in entry["sidecars"].get(".subs", []):
+        if not filename.startswith(base_name):
+            continue
+        lang = _lang_from_name(filename, "pt")
+        if filename.lower().endswith(".vtt"):
+            src = _file_url(rel_dir, ".subs", filename)
+            # Trilha embutida já extraída pelo make_captions
+            match = _TRACK_INDEX_RE.search(filename)
+            if match:
+                extracted.add(int(match.group(1)))
+        elif _convertible(filename):
+            src = track_url(rel_video, f"subs:{filename}")
+        else:
+            continue
+        tracks.append({"lang": lang, "label": lang.upper(), "src": src})
+
+    for filename in entry.get("subtitles", []):
+        if not filename.startswith(base_name + "."):
+            continue
+        lang = _sidecar_lang(base_name, filename)
+        if filename.lower().endswith(".vtt"):
+            src = _file_url(rel_dir, filename)
+        elif _convertible(filename):
+            src = track_url(rel_video, f"file:{filename}")
+        else:
+            continue
+        tracks.append({"lang": lang, "label": lang.upper(), "src": src})
+
+    info = await media_probe.probe(rel_video) if FFMPEG else None
+    if info:
+        embedded = []
+        subtitle_streams = [s for s in info["streams"] if s["codec_type"] == "subtitle"]
+        for i, stream in enumerate(subtitle_streams):
+            if i in extracted or stream["codec_name"] not in TEXT_SUBTITLE_CODECS:
+                continue
+            lang = stream["language"] or "und"
+            tracks.append({"lang": lang, "label": stream["title"] or lang.upper(),
+                           "src": track_url(rel_video, f"s{i}")})
+            embedded.append(i)
+        if embedded:
+            await _start_embedded(rel_video, embedded)
+    return tracks
+
+
+# --- Conversão ---
+
+def _resolve(rel_video: str, track: str) -> tuple[str, str, int | None] | None:
+    """(arquivo de origem, chave do cache, índice embutido ou None) de uma trilha."""
+    match = TRACK_RE.match(track)
+    video_path = os.path.abspath(os.path.join(VIDEO_DIR, rel_video))
+    if not match or not library_index.inside_video_dir(video_path):
+        return None
+    index, place, filename = match.groups()
+    if index is not None:
+        source, index = video_path, int(index)
+    else:
+        if not _convertible(filename):
+            return None
+        folder = os.path.dirname(video_path)
+        source = os.path.join(folder, ".subs", filename) if place == "subs" else os.path.join(folder, filename)
+    try:
+        stat_result = os.stat(source)
+    except OSError:
+        return None
+    key = DiskCache.make_key(os.path.relpath(source, VIDEO_DIR), stat_result.st_size, stat_result.st_mtime_ns, track)
+    return source, key, index
+
+
+def _read_text(path: str) -> str:
+    with open(path, "rb") as f:
+        data = f.read()
+    # Legendas antigas costumam vir em Windows-1252
+    for encoding in ("utf-8-sig", "cp1252"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("latin-1")
+
+
+def srt_to_vtt(text: str) -> str:
+    text = text.replace("\r\n", "\n").replace("\r", "\n").strip()
+    return "WEBVTT\n\n" + _SRT_TIMESTAMP_RE.sub(r"\1.\2", text) + "\n"
+
+
+def _temp_output() -> str:
+    fd, path = tempfile.mkstemp(prefix=".subtitle-", suffix=".vtt", dir=CACHE_DIR)
+    os.close(fd)
+    return path
+
+
+def _store(tmp_path: str, key: str):
+    """Move a conversão pronta para o cache e a contabiliza. Bloqueante: pool 'disk'."""
+    os.replace(tmp_path, cache.path(key))
+    cache.commit(key)
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _convert_srt(source: str, tmp_path: str):
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(srt_to_vtt(_read_text(source)))
+
+
+async def _run_ffmpeg(args: list[str]) -> bool:
+    # Popen + poll, como no hls: funciona com qualquer event loop sem prender uma thread
+    process = subprocess.Popen([FFMPEG, '-v', 'error', '-nostdin', '-y', *args],
+                               stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _processes.add(process)
+    try:
+        while process.poll() is None:
+            await asyncio.sleep(0.2)
+    finally:
+        if process.poll() is None:
+            process.kill()
+        _processes.discard(process)
+    return process.returncode == 0
+
+
+async def _convert(source: str, outputs: dict, embedded: bool):
+    """Gera os .vtt de `outputs` ({chave: índice embutido ou None}) numa única execução."""
+    tmp_paths = {key: await run_in("disk", _temp_output) for key in outputs}
+    try:
+        async with _job_slots:
+            if not embedded and source.lower().endswith(".srt"):
+                (key,) = outputs
+                await run_in("disk", _convert_srt, source, tmp_paths[key])
+                ok = True
+            elif embedded:
+                args = ['-i', source]
+                for key, index in outputs.items():
+                    args += ['-map', f'0:s:{index}', '-c:s', 'webvtt', '-f', 'webvtt', tmp_paths[key]]
+                ok = await _run_ffmpeg(args)
+            else:
+                (key,) = outputs
+                ok = await _run_ffmpeg(['-i', source, '-f', 'webvtt', tmp_paths[key]])
+        if not ok:
+            metrics.log_event("subtitle_conversion_failed", level=logging.WARNING, source=os.path.basename(source))
+            return
+        for key, tmp_path in tmp_paths.items():
+            await run_in("disk", _store, tmp_path, key)
+    except Exception as e:
+        metrics.log_event("subtitle_conversion_failed", level=logging.ERROR, source=os.path.basename(source),
+                          error=repr(e))
+    finally:
+        for key, tmp_path in tmp_paths.items():
+            await run_in("disk", _remove_quietly, tmp_path)
+            _jobs.pop(key, None)
+
+
+async def _is_text_track(rel_video: str, index: int) -> bool:
+    if not FFMPEG:
+        return False
+    info = await media_probe.probe(rel_video)
+    subtitle_streams = [s for s in info["streams"] if s["codec_type"] == "subtitle"] if info else []
+    return index < len(subtitle_streams) and subtitle_streams[index]["codec_name"] in TEXT_SUBTITLE_CODECS
+
+
+def _spawn(source: str, outputs: dict, embedded: bool) -> asyncio.Task:
+    task = asyncio.create_task(_convert(source, outputs, embedded))
+    for key in outputs:
+        _jobs[key] = task
+    return task
+
+
+async def _start_embedded(rel_video: str, indexes: list[int]):
+    """Extrai de uma vez as trilhas embutidas que ainda não estão no cache."""
+    outputs, source = {}, None
+    for index in indexes:
+        resolved = await run_in("disk", _resolve, rel_video, f"s{index}")
+        if resolved is None:
+            return
+        source, key, _ = resolved
+        if key not in _jobs and not await run_in("disk", cache.has, key):
+            outputs[key] = index
+    if outputs:
+        _spawn(source, outputs, embedded=True)
+
+
+async def find_track(rel_video: str, track: str) -> str | None:
+    """
+    Caminho do .vtt da trilha, convertendo-a se preciso. None se a trilha não
+    existe ou a conversão falhou; TimeoutError se ela ainda não terminou.
+    """
+    resolved = await run_in("disk", _resolve, rel_video, track)
+    if resolved is None:
+        return None
+    source, key, index = resolved
+    if index is not None and not await _is_text_track(rel_video, index):
+        return None
+
+    if key not in _jobs and await run_in("disk", cache.has, key):
+        await run_in("disk", cache.touch, key)
+        return cache.path(key)
+
+    task = _jobs.get(key) or _spawn(source, {key: index}, embedded=index is not None)
+    await asyncio.wait_for(asyncio.shield(task), TRACK_WAIT_TIMEOUT)
+    return cache.path(key) if await run_in("disk", cache.has, key) else None
+
+
+def stop_all():
+    """Encerra as conversões em andamento (chamado no shutdown)."""
+    for task in set(_jobs.values()):
+        task.cancel()
+    for process in list(_processes):
+        process.kill()
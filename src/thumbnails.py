@@ -0,0 +1,251 @@
+import logging
+import os
+import random
+import shutil
+import subprocess
+
+import cv2
+import numpy as np
+
+import metrics
+
+# Funções executadas no pool 'decode' (processos separados): mantenha este módulo
+# leve de importar e as funções no nível do módulo para que sejam serializáveis.
+
+# Larguras geradas para cada thumbnail ({base}_banner_{largura}.webp)
+THUMBNAIL_WIDTHS = (320, 640)
+WEBP_QUALITY = 80
+
+FFMPEG = shutil.which("ffmpeg")
+FFPROBE = shutil.which("ffprobe")
+
+# Nomes possíveis do banner de um vídeo dentro de .previews, do preferido ao legado
+VIDEO_BANNER_SUFFIXES = tuple(f"_banner_{width}.webp" for width in THUMBNAIL_WIDTHS) + ("_banner.jpg", "_banner.png")
+
+
+def find_video_banner(previews, base_name: str, width: int = THUMBNAIL_WIDTHS[0]) -> str | None:
+    """Escolhe, entre os arquivos de .previews, o banner do vídeo mais adequado para a largura pedida."""
+    preferred = f"{base_name}_banner_{width}.webp"
+    if preferred in previews:
+        return preferred
+    for suffix in VIDEO_BANNER_SUFFIXES:
+        if f"{base_name}{suffix}" in previews:
+            return f"{base_name}{suffix}"
+    return None
+
+
+def probe_duration(video_path: str) -> float | None:
+    """Duração do vídeo em segundos, lida do contêiner (sem decodificar nada)."""
+    if FFPROBE:
+        try:
+            result = subprocess.run(
+                [FFPROBE, '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', video_path],
+                capture_output=True, text=True, timeout=15)
+            return float(result.stdout.strip())
+        except (subprocess.SubprocessError, ValueError):
+            pass
+
+    cap = cv2.VideoCapture(video_path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        return frames / fps if fps > 0 and frames > 0 else None
+    finally:
+        cap.release()
+
+
+def grab_keyframe(video_path: str, seconds: float, max_width: int = max(THUMBNAIL_WIDTHS)):
+    """
+    Decodifica um único frame: o keyframe mais próximo (antes) de `seconds`,
+    já reduzido para no máximo max_width de largura.
+
+    Com ffmpeg, o seek é feito no contêiner até o keyframe e só keyframes são
+    decodificados (-skip_frame nokey), então não há decodificação de GOP inteiro.
+    Sem ffmpeg, cai para o seek por timestamp do OpenCV.
+    """
+    if FFMPEG:
+        command = [
+            FFMPEG, '-v', 'error', '-nostdin',
+            '-skip_frame', 'nokey', '-noaccurate_seek', '-ss', f"{max(seconds, 0):.3f}",
+            '-i', video_path,
+            '-map', '0:v:0', '-frames:v', '1', '-an', '-sn',
+            '-vf', f"scale='min({max_width},iw)':-2",
+            '-f', 'image2pipe', '-vcodec', 'bmp', 'pipe:1'
+        ]
+        try:
+            result = subprocess.run(command, capture_output=True, timeout=30)
+            if result.stdout:
+                frame = cv2.imdecode(np.frombuffer(result.stdout, np.uint8), cv2.IMREAD_COLOR)
+                if frame is not None:
+                    return frame
+        except subprocess.SubprocessError:
+            pass
+
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            return None
+        cap.set(cv2.CAP_PROP_POS_MSEC, seconds * 1000)
+        success, frame = cap.read()
+        if not success:
+            return None
+        return _resize_to_width(frame, max_width)
+    finally:
+        cap.release()
+
+
+def _resize_to_width(frame, width: int):
+    height, current_width = frame.shape[:2]
+    if current_width <= width:
+        return frame
+    new_height = max(2, round(height * width / current_width))
+    return cv2.resize(frame, (width, new_height), interpolation=cv2.INTER_AREA)
+
+
+def write_variants(frame, out_base: str) -> list[str]:
+    """Grava o frame como WebP em cada largura de THUMBNAIL_WIDTHS: {out_base}_{largura}.webp."""
+    written = []
+    for width in sorted(THUMBNAIL_WIDTHS, reverse=True):
+        frame = _resize_to_width(frame, width)
+        path = f"{out_base}_{width}.webp"
+        if cv2.imwrite(path, frame, [cv2.IMWRITE_WEBP_QUALITY, WEBP_QUALITY]):
+            written.append(path)
+    return written
+
+
+def extract_thumbnail(video_path: str, preview_dir: str, base_name: str, duration: float | None = None) -> bool:
+    """
+    Captura um frame entre 10% e 70% do vídeo e salva as variantes
+    {base_name}_banner_{largura}.webp em preview_dir. A duração, quando já
+    conhecida (media_probe), evita ler o contêiner de novo.
+    """
+    duration = duration or probe_duration(video_path)
+    position = random.uniform(duration * 0.1, duration * 0.7) if duration else 0
+
+    frame = grab_keyframe(video_path, position)
+    if frame is None and position:
+        # Alguns arquivos não permitem seek: usa o primeiro keyframe
+        frame = grab_keyframe(video_path, 0)
+    if frame is None:
+        metrics.log_event("video_open_failed", level=logging.WARNING, path=video_path)
+        return False
+
+    return bool(write_variants(frame, os.path.join(preview_dir, f"{base_name}_banner")))
+
+
+# --- Sprites de Pré-visualização do Seek ---
+# Mosaicos com um frame a cada SPRITE_INTERVAL segundos e uma trilha WebVTT
+# apontando cada intervalo para sua região do mosaico (#xywh=...), no formato
+# que o Plyr usa para mostrar a prévia ao passar o mouse na barra de progresso.
+
+SPRITE_INTERVAL = 10
+SPRITE_MAX_TILES = 600      # vídeos longos ganham um intervalo maior
+SPRITE_TILE_WIDTH = 160
+SPRITE_COLUMNS = 10
+SPRITE_ROWS = 10
+SPRITE_JPEG_QUALITY = 70
+SPRITE_PASS_TIMEOUT = 600   # s para a passada única do ffmpeg por todo o vídeo
+
+
+def seek_preview_vtt_name(base_name: str) -> str:
+    return f"{base_name}_thumbs.vtt"
+
+
+def _vtt_timestamp(seconds: float) -> str:
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{secs:06.3f}"
+
+
+def _split_bmps(data: bytes) -> list:
+    """Separa a saída do image2pipe (BMPs concatenados) em frames, pelo tamanho no cabeçalho de cada um."""
+    frames = []
+    offset = 0
+    while offset + 6 <= len(data) and data[offset:offset + 2] == b"BM":
+        size = int.from_bytes(data[offset + 2:offset + 6], "little")
+        if size <= 0 or offset + size > len(data):
+            break
+        frame = cv2.imdecode(np.frombuffer(data, np.uint8, size, offset), cv2.IMREAD_COLOR)
+        if frame is None:
+            break
+        frames.append(frame)
+        offset += size
+    return frames
+
+
+def _keyframe_tiles(video_path: str, interval: float, count: int) -> list:
+    """
+    Um frame a cada `interval` segundos numa única passada do ffmpeg, decodificando
+    só keyframes (-skip_frame nokey) e já na largura do tile. Pode devolver menos
+    de `count` frames (ou nenhum, sem ffmpeg ou se a passada falhar).
+    """
+    if not FFMPEG:
+        return []
+    command = [
+        FFMPEG, '-v', 'error', '-nostdin',
+        '-skip_frame', 'nokey', '-i', video_path,
+        '-map', '0:v:0', '-an', '-sn',
+        '-vf', f"fps=1/{interval:.6f},scale={SPRITE_TILE_WIDTH}:-2",
+        '-frames:v', str(count),
+        '-f', 'image2pipe', '-vcodec', 'bmp', 'pipe:1'
+    ]
+    try:
+        result = subprocess.run(command, capture_output=True, timeout=SPRITE_PASS_TIMEOUT)
+    except subprocess.SubprocessError:
+        return []
+    return _split_bmps(result.stdout)
+
+
+def build_seek_previews(video_path: str, preview_dir: str, base_name: str, duration: float | None = None) -> bool:
+    """
+    Gera {base_name}_sprite_{n}.jpg e {base_name}_thumbs.vtt em preview_dir.
+    Os frames vêm de uma única passada do ffmpeg pelos keyframes; os intervalos
+    que ela não cobriu são buscados um a um com grab_keyframe.
+    """
+    duration = duration or probe_duration(video_path)
+    if not duration:
+        metrics.log_event("video_duration_unknown", level=logging.WARNING, path=video_path)
+        return False
+
+    interval = max(SPRITE_INTERVAL, duration / SPRITE_MAX_TILES)
+    timestamps = [i * interval for i in range(int(duration // interval) + 1) if i * interval < duration]
+
+    tile_height = None
+    tiles = _keyframe_tiles(video_path, interval, len(timestamps))[:len(timestamps)]
+    for seconds in timestamps[len(tiles):]:
+        tiles.append(grab_keyframe(video_path, seconds, max_width=SPRITE_TILE_WIDTH))
+    for frame in tiles:
+        if frame is not None:
+            tile_height = max(2, round(frame.shape[0] * SPRITE_TILE_WIDTH / frame.shape[1]))
+            break
+    if tile_height is None:
+        metrics.log_event("video_open_failed", level=logging.WARNING, path=video_path)
+        return False
+
+    per_sheet = SPRITE_COLUMNS * SPRITE_ROWS
+    cues = ["WEBVTT", ""]
+    for sheet_index in range(0, len(tiles), per_sheet):
+        sheet_tiles = tiles[sheet_index:sheet_index + per_sheet]
+        rows = (len(sheet_tiles) + SPRITE_COLUMNS - 1) // SPRITE_COLUMNS
+        sheet = np.zeros((rows * tile_height, SPRITE_COLUMNS * SPRITE_TILE_WIDTH, 3), np.uint8)
+        sheet_name = f"{base_name}_sprite_{sheet_index // per_sheet}.jpg"
+
+        for offset, frame in enumerate(sheet_tiles):
+            x = (offset % SPRITE_COLUMNS) * SPRITE_TILE_WIDTH
+            y = (offset // SPRITE_COLUMNS) * tile_height
+            if frame is not None:
+                sheet[y:y + tile_height, x:x + SPRITE_TILE_WIDTH] = cv2.resize(
+                    frame, (SPRITE_TILE_WIDTH, tile_height), interpolation=cv2.INTER_AREA)
+
+            start = timestamps[sheet_index + offset]
+            end = min(start + interval, duration)
+            cues.append(f"{_vtt_timestamp(start)} --> {_vtt_timestamp(end)}")
+            cues.append(f"{sheet_name}#xywh={x},{y},{SPRITE_TILE_WIDTH},{tile_height}")
+            cues.append("")
+
+        cv2.imwrite(os.path.join(preview_dir, sheet_name), sheet, [cv2.IMWRITE_JPEG_QUALITY, SPRITE_JPEG_QUALITY])
+
+    # A trilha é gravada por último: a existência dela indica que os sprites estão completos
+    with open(os.path.join(preview_dir, seek_preview_vtt_name(base_name)), "w", encoding="utf-8") as f:
+        f.write("\n".join(cues))
+    return True
@@ -0,0 +1,293 @@
+import hashlib
+import os
+import re
+import shutil
+import struct
+import tempfile
+
+import cv2
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+import metrics
+from config import CACHE_DIR, UPLOAD_CACHE_MB
+from disk_cache import DiskCache
+from executors import run_in
+
+# --- Upload de Imagens (avatares e imagens do chat) ---
+# O corpo multipart é lido em streaming direto da requisição e só o campo do
+# arquivo é copiado, em blocos, para um temporário (calculando o hash no caminho
+# e abortando assim que o corpo passa de MAX_UPLOAD_BYTES, mesmo sem
+# Content-Length ou com chunked). Depois ele é decodificado no pool 'decode'
+# e salvo só como variantes WebP reduzidas. O original e a extensão enviada pelo
+# cliente são descartados. As variantes ficam em CACHE_DIR/uploads/<chave>/,
+# com remoção das menos usadas ao passar de UPLOAD_CACHE_MB. A pasta é gerada
+# num temporário e renomeada de uma vez, então existir no disco (de qualquer
+# worker) significa estar completa. Antes de decodificar, as dimensões são lidas
+# do cabeçalho: imagens acima de MAX_IMAGE_PIXELS (ou de formato desconhecido)
+# são recusadas sem alocar o bitmap.
+
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 256 * 1024
+MULTIPART_OVERHEAD = 64 * 1024  # folga para boundaries, cabeçalhos das partes e outros campos
+UPLOAD_WEBP_QUALITY = 82
+MAX_IMAGE_PIXELS = 40_000_000   # ~ 8000x5000; um PNG pequeno pode declarar um bitmap de gigabytes
+
+# Avatares são quadrados (o cliente já recorta); imagens do chat mantêm a proporção.
+# "url" é a variante usada por padrão nas mensagens e na lista de usuários.
+KINDS = {
+    "avatar": {"sizes": (64, 128, 256), "square": True, "url": 128},
+    "chat": {"sizes": (480, 960), "square": False, "url": 960},
+}
+VARIANT_NAME = re.compile(r"^(\d{2,4})\.webp$")
+KEY_RE = re.compile(r"^[0-9a-f]{24}$")
+
+cache = DiskCache("uploads", UPLOAD_CACHE_MB * 1024 * 1024)
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class InvalidUpload(Exception):
+    """O corpo não é multipart/form-data ou não traz o campo do arquivo."""
+
+
+def _temp_upload() -> str:
+    fd, path = tempfile.mkstemp(prefix=".upload-", dir=CACHE_DIR)
+    os.close(fd)
+    return path
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def _spool_upload(chunks, content_type: str, field: str = "file") -> tuple[str, str]:
+    """
+    Lê o corpo multipart (iterador assíncrono de bytes, ex. request.stream()) e
+    copia só o campo `field` para um temporário. Retorna (caminho, sha256).
+    """
+    mime, options = parse_options_header(content_type)
+    boundary = options.get(b"boundary")
+    if mime != b"multipart/form-data" or not boundary:
+        raise InvalidUpload()
+
+    digest = hashlib.sha256()
+    pending = []    # blocos do arquivo ainda não gravados
+    part = {"headers": {}, "field": b"", "value": b"", "target": False, "found": False, "size": 0}
+
+    def on_part_begin():
+        part.update(headers={}, target=False)
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part.update(field=b"", value=b"")
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["target"] = not part["found"] and disposition.get(b"name") == field.encode()
+        part["found"] = part["found"] or part["target"]
+
+    def on_part_data(data, start, end):
+        if part["target"]:
+            part["size"] += end - start
+            if part["size"] > MAX_UPLOAD_BYTES:
+                raise UploadTooLarge()
+            chunk = data[start:end]
+            digest.update(chunk)
+            pending.append(chunk)
+
+    def on_part_end():
+        part["target"] = False
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin, "on_header_field": on_header_field, "on_header_value": on_header_value,
+        "on_header_end": on_header_end, "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data, "on_part_end": on_part_end,
+    })
+
+    tmp_path = await run_in("disk", _temp_upload)
+    out = await run_in("disk", open, tmp_path, "wb")
+    received = 0
+    try:
+        async for chunk in chunks:
+            received += len(chunk)
+            if received > MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD:
+                raise UploadTooLarge()
+            try:
+                parser.write(chunk)
+            except UploadTooLarge:
+                raise
+            except Exception as e:
+                raise InvalidUpload() from e
+            if sum(map(len, pending)) >= UPLOAD_CHUNK_SIZE:
+                await run_in("disk", out.write, b"".join(pending))
+                pending.clear()
+        parser.finalize()
+        if not part["found"]:
+            raise InvalidUpload()
+        await run_in("disk", out.write, b"".join(pending))
+        await run_in("disk", out.close)
+    except BaseException:
+        await run_in("disk", out.close)
+        await run_in("disk", _remove_quietly, tmp_path)
+        raise
+    return tmp_path, digest.hexdigest()
+
+
+def _jpeg_size(f) -> tuple[int, int] | None:
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7:
+            continue  # marcadores sem tamanho
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        # SOF0..SOF15 (C4, C8 e CC são outras tabelas) trazem a altura e a largura
+        if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+            header = f.read(5)
+            if len(header) < 5:
+                return None
+            height, width = struct.unpack(">HH", header[1:5])
+            return width, height
+        f.seek(struct.unpack(">H", length)[0] - 2, os.SEEK_CUR)
+
+
+def _image_size(path: str) -> tuple[int, int] | None:
+    """(largura, altura) lida do cabeçalho de PNG, JPEG, WebP, GIF ou BMP, sem decodificar; None se outro formato."""
+    with open(path, "rb") as f:
+        head = f.read(32)
+        if head.startswith(b"\x89PNG\r\n\x1a\n") and head[12:16] == b"IHDR":
+            return struct.unpack(">II", head[16:24])
+        if head[:6] in (b"GIF87a", b"GIF89a"):
+            return struct.unpack("<HH", head[6:10])
+        if head[:2] == b"BM" and len(head) >= 26:
+            width, height = struct.unpack("<ii", head[18:26])
+            return abs(width), abs(height)
+        if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+            chunk = head[12:16]
+            if chunk == b"VP8 ":
+                width, height = struct.unpack("<HH", head[26:30])
+                return width & 0x3FFF, height & 0x3FFF
+            if chunk == b"VP8L":
+                bits = int.from_bytes(head[21:25], "little")
+                return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            if chunk == b"VP8X":
+                return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+            return None
+        if head[:2] == b"\xff\xd8":
+            return _jpeg_size(f)
+    return None
+
+
+def make_variants(source_path: str, out_dir: str, kind: str) -> list[int]:
+    """
+    Decodifica a imagem e grava uma WebP por tamanho de KINDS[kind] em out_dir.
+    Roda no pool 'decode'. Retorna os tamanhos gravados (vazio se não é uma
+    imagem ou se ela passa de MAX_IMAGE_PIXELS).
+    """
+    spec = KINDS[kind]
+    try:
+        size = _image_size(source_path)
+    except (OSError, struct.error):
+        size = None
+    if size is None or not size[0] or not size[1] or size[0] * size[1] > MAX_IMAGE_PIXELS:
+        return []
+    image = cv2.imread(source_path, cv2.IMREAD_COLOR)
+    if image is None:
+        return []
+
+    if spec["square"]:
+        height, width = image.shape[:2]
+        side = min(height, width)
+        top, left = (height - side) // 2, (width - side) // 2
+        image = image[top:top + side, left:left + side]
+
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for size in sorted(spec["sizes"], reverse=True):
+        height, width = image.shape[:2]
+        if width > size:
+            # Reduz a partir da variante anterior, que já é menor que o original
+            image = cv2.resize(image, (size, max(1, round(height * size / width))), interpolation=cv2.INTER_AREA)
+        if cv2.imwrite(os.path.join(out_dir, f"{size}.webp"), image, [cv2.IMWRITE_WEBP_QUALITY, UPLOAD_WEBP_QUALITY]):
+            written.append(size)
+    return written
+
+
+def variant_url(key: str, size: int) -> str:
+    return f"/uploads/{key}/{size}.webp"
+
+
+def _urls(key: str, kind: str) -> dict:
+    spec = KINDS[kind]
+    return {
+        "url": variant_url(key, spec["url"]),
+        "variants": {str(size): variant_url(key, size) for size in spec["sizes"]},
+    }
+
+
+async def store_image(chunks, content_type: str, kind: str) -> dict | None:
+    """
+    Salva a imagem enviada no campo "file" do corpo multipart (iterador
+    assíncrono de bytes, ex. request.stream()) e retorna as URLs das variantes,
+    ou None se o arquivo não é uma imagem válida. Levanta UploadTooLarge acima
+    de MAX_UPLOAD_BYTES e InvalidUpload sem o campo.
+    """
+    tmp_path, file_hash = await _spool_upload(chunks, content_type)
+    try:
+        key = DiskCache.make_key(file_hash, kind)
+        # A mesma imagem já enviada (por este ou outro worker): confere a variante no disco
+        if await run_in("disk", os.path.isfile, os.path.join(cache.path(key), f"{KINDS[kind]['url']}.webp")):
+            await run_in("disk", cache.touch, key)
+            return _urls(key, kind)
+
+        tmp_dir = await run_in("disk", tempfile.mkdtemp, prefix=f".{key}-", dir=cache.root)
+        try:
+            written = await run_in("decode", make_variants, tmp_path, tmp_dir, kind)
+            if not written:
+                return None
+            await run_in("disk", _publish, tmp_dir, cache.path(key))
+        finally:
+            await run_in("disk", shutil.rmtree, tmp_dir, True)
+        await run_in("disk", cache.commit, key)
+        metrics.log_event("image_stored", kind=kind, key=key, variants=written)
+        return _urls(key, kind)
+    finally:
+        await run_in("disk", _remove_quietly, tmp_path)
+
+
+def _publish(tmp_dir: str, out_dir: str):
+    """Renomeia a pasta gerada para o lugar definitivo; se outro worker chegou antes, fica a dele."""
+    try:
+        os.replace(tmp_dir, out_dir)
+    except OSError:
+        if not os.path.isdir(out_dir):
+            raise
+
+
+async def find_variant(key: str, name: str) -> str | None:
+    """Caminho de uma variante já gerada, marcando a entrada como usada."""
+    if not KEY_RE.match(key) or not VARIANT_NAME.match(name):
+        return None
+    path = os.path.join(cache.path(key), name)
+    if not await run_in("disk", os.path.isfile, path):
+        return None
+    await run_in("disk", cache.touch, key)
+    return path